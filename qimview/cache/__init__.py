@@ -1,4 +1,17 @@
 from .imagecache import ImageCache
 from .filecache import FileCache
+from .diskcache import DiskImageCache
+from .compressedcache import CompressedImageCache
+from .statcache import StatCache, gb_stat_cache
+from .memory_governor import MemoryGovernor, gb_memory_governor
+from .cache_stats import CacheStats, all_cache_stats, dump_cache_stats
+from .tilecache import TileCache, gb_tile_cache, get_pyramid, PyramidBuilder, gb_pyramid_builder
+from .eviction import EvictionPolicy, LRUPolicy, GDSFPolicy, create_eviction_policy
+from .read_engine import ReadEngine, BufferPool
 
-__all__ = ['ImageCache', 'FileCache' ]
+__all__ = ['ImageCache', 'FileCache', 'DiskImageCache', 'CompressedImageCache', 'StatCache', 'gb_stat_cache',
+           'MemoryGovernor', 'gb_memory_governor',
+           'CacheStats', 'all_cache_stats', 'dump_cache_stats',
+           'EvictionPolicy', 'LRUPolicy', 'GDSFPolicy', 'create_eviction_policy',
+           'TileCache', 'gb_tile_cache', 'get_pyramid', 'PyramidBuilder', 'gb_pyramid_builder',
+           'ReadEngine', 'BufferPool' ]
@@ -1,22 +1,45 @@
-from collections import deque
-from typing import List, TypeVar, Optional, Generic, Any, Tuple
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import TypeVar, Optional, Generic, Tuple, KeysView, Dict, Callable, List, Set, TextIO
 
 from qimview.utils.utils      import deep_getsizeof
 from qimview.utils.thread_pool import ThreadPool
 from qimview.utils.qt_imports import QtWidgets
+from .cache_stats import CacheStats
+from .cache_config import CacheConfig
+from .eviction import EvictionPolicy, LRUPolicy
 
 TId    = TypeVar("TId")
 TValue = TypeVar("TValue")
 TExtra = TypeVar("TExtra")
 
 class BaseCache(Generic[TId, TValue, TExtra]):
-    """ Base class for Image and File caches """
+    """ Base class for Image and File caches
+
+        Elements are stored in an ordered hash map from id to (id, value, extra), ordered from
+        the least recently used to the most recently used element: search, append and remove are O(1),
+        a successful search promotes the element and eviction removes the least recently used one.
+        The memory size of each element is measured once when it is added, and the cache keeps
+        a running total that is used to evict elements.
+        All the public methods are protected by a lock, so the cache can be shared between the
+        UI thread and worker threads; get_or_load() makes concurrent loads of the same id share a
+        single loader call.
+    """
     # --- Private methods
     def __init__(self, name : str =""):
-        # Python list and deque are thread-safe
-        self.cache      : deque[Tuple[TId, TValue, TExtra]]    = deque()
-        self.cache_list : List[TId]                            = []
+        self.cache      : OrderedDict[TId, Tuple[TId, TValue, TExtra]] = OrderedDict()
+        # Size in bytes of each element, measured at insertion
+        self.entry_sizes: Dict[TId, int]                       = {}
+        # Running total of entry_sizes, in bytes
         self.cache_size : int                                  = 0
+        # Futures of the elements being currently loaded by get_or_load()
+        self._loading   : Dict[TId, Future]                    = {}
+        # Reentrant lock since public methods call each other
+        self._lock      : threading.RLock                      = threading.RLock()
         # Max size in Mb
         self.max_cache_size : int                              = 2000
         self.verbose        : bool                             = False
@@ -24,7 +47,21 @@ class BaseCache(Generic[TId, TValue, TExtra]):
         self.thread_pool    : ThreadPool                       = ThreadPool()
         self.memory_bar     : Optional[QtWidgets.QProgressBar] = None
         self._name          : str                              = name
-        # Avoid changing progressbar inside a thread so no need for mutex
+        # Debug: compare the running total with a full recursive walk of the cache at each size check
+        self.debug_check_size : bool                           = False
+        # Counters and load latencies
+        self.stats          : CacheStats                       = CacheStats(name)
+        # Source of the current load in each thread, set by the load function of get_or_load()
+        self._load_source   : threading.local                  = threading.local()
+        self.policy         : EvictionPolicy[TId]              = LRUPolicy()
+        # Elements that cannot be evicted, they may be pinned before being added
+        self._pinned        : Set[TId]                         = set()
+        # Optional record of the accesses, replayed by eviction_simulator
+        self._trace_file    : Optional[TextIO]                 = None
+        if CacheConfig.trace_dir:
+            os.makedirs(CacheConfig.trace_dir, exist_ok=True)
+            self.start_trace(os.path.join(CacheConfig.trace_dir, f"{name}_{os.getpid()}_{id(self)}.jsonl"))
+        # The progress bar must only be updated from the UI thread
 
     # --- Protected methods
     def _print_log(self, message : str) -> None:
@@ -32,79 +69,282 @@ class BaseCache(Generic[TId, TValue, TExtra]):
             print(message)
 
     # --- Public methods
+    @property
+    def hit_count(self) -> int:
+        return self.stats.hits
+
+    @property
+    def load_count(self) -> int:
+        return self.stats.loads
+
+    @property
+    def load_time(self) -> float:
+        """ Total time in seconds of the loads of get_or_load() """
+        return self.stats.load_time
+
+    def set_load_source(self, source : str) -> None:
+        """ Called by the load function of get_or_load() to label its latency (reader plugin, cache tier ...) """
+        self._load_source.value = source
+
+    @property
+    def cache_list(self) -> KeysView[TId]:
+        """ Cache identifiers, from least to most recently used, with O(1) membership test,
+            iterating over it is not thread-safe """
+        return self.cache.keys()
+
     def set_memory_bar(self, progress_bar:QtWidgets.QProgressBar) -> None:
         self.memory_bar = progress_bar
         self.memory_bar.setRange(0, self.max_cache_size)
         self.memory_bar.setFormat("%v Mb")
 
     def reset(self) -> None:
-        self.cache = deque()
-        self.cache_list = []
-        self.cache_size = 0
+        with self._lock:
+            self.cache = OrderedDict()
+            self.entry_sizes = {}
+            self.cache_size = 0
+            self.policy.reset()
+
+    def set_eviction_policy(self, policy : EvictionPolicy[TId]) -> None:
+        """ Change the eviction policy, the current elements are added to the new policy with
+            the mean load time as cost """
+        with self._lock:
+            self.policy = policy
+            mean_cost = self.mean_load_time()
+            for id in self.cache:
+                self.policy.on_insert(id, self.entry_sizes[id], mean_cost)
+
+    def mean_load_time(self) -> float:
+        return self.stats.load_time / self.stats.loads if self.stats.loads else 0.001
+
+    def saved_time_per_hit(self) -> float:
+        """ Time in seconds saved by each hit, used by the memory governor """
+        return self.stats.load_time / self.stats.loads if self.stats.loads else 0
+
+    def pin(self, id : TId) -> None:
+        """ Prevent the element from being evicted, it can still be removed """
+        with self._lock:
+            self._pinned.add(id)
+
+    def unpin(self, id : TId) -> None:
+        with self._lock:
+            self._pinned.discard(id)
+
+    def start_trace(self, filename : str) -> None:
+        """ Record each access of get_or_load() as a json line: id, size in bytes, load time in seconds
+            for misses """
+        with self._lock:
+            self._trace_file = open(filename, 'w', buffering=1)
+
+    def stop_trace(self) -> None:
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+            self._trace_file = None
+
+    def _trace(self, id : TId, size : Optional[int], cost : Optional[float]) -> None:
+        if self._trace_file is None: return
+        line = json.dumps({ 'id': str(id), 'size': size, 'cost': cost })
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.write(line+'\n')
 
     def set_max_cache_size(self, size : int) -> None:
-        self.max_cache_size = size
-        self.check_size_limit()
+        with self._lock:
+            self.max_cache_size = size
+            self.check_size_limit()
         if self.memory_bar is not None:
             self.memory_bar.setRange(0, self.max_cache_size)
 
+    def has(self, id : TId) -> bool:
+        """ Check if id is in the cache, without changing its LRU position """
+        with self._lock:
+            return id in self.cache
+
+    def is_loading(self, id : TId) -> bool:
+        """ Check if id is currently being loaded by get_or_load() """
+        with self._lock:
+            return id in self._loading
+
     def search(self, id : TId) -> Optional[Tuple[TId, TValue,TExtra]]:
-        res = None
-        if id in self.cache_list:
-            pos = self.cache_list.index(id)
-            # print(f"pos {pos} len(cache) {len(self.cache)}")
-            try:
-                res = self.cache[pos]
-            except Exception as e:
-                print(f" Error in getting cache data: {e}")
-                self._print_log(f" *** Cache {self._name}: search() cache_list {len(self.cache_list)} cache {len(self.cache)}")
-                res = None
-        return res
-
-    def append(self, id : TId, value: TValue, extra: TExtra, check_size=True) -> None:
+        """ Return the cache element (id, value, extra) if found, and mark it as most recently used """
+        with self._lock:
+            res = self.cache.get(id)
+            if res is not None:
+                self.cache.move_to_end(id)
+                self.policy.on_access(id)
+            return res
+
+    def get_or_load(self, id : TId,
+                    load: Callable[[], Optional[Tuple[TValue, TExtra]]],
+                    is_valid: Optional[Callable[[Tuple[TId, TValue, TExtra]], bool]] = None,
+                    check_size: bool = True,
+                    cold: bool = False) -> Tuple[Optional[TValue], bool]:
+        """ Return the value of id from the cache, or load it and add it to the cache.
+            Single-flight loading: if another thread is already loading id, wait for its result
+            instead of calling load() again.
+
+        Args:
+            id (TId): cache element identifier
+            load (Callable): called without the lock held, returns the pair (value, extra) or None if it failed
+            is_valid (Callable, optional): check if a cached element (id, value, extra) can be used,
+                if not it is removed and reloaded. Defaults to None (always valid).
+            check_size (bool, optional): check the cache size limit after adding the element. Defaults to True.
+            cold (bool, optional): add the loaded element as least recently used. Defaults to False.
+
+        Returns:
+            Tuple[Optional[TValue], bool]: the value (None if loading failed) and a boolean which is True
+                if the value was not loaded by this call
+        """
+        with self._lock:
+            elt = self.search(id)
+            if elt is not None:
+                if is_valid is None or is_valid(elt):
+                    self.stats.add_hit()
+                    self._trace(id, self.entry_sizes.get(id), None)
+                    return elt[1], True
+                self.remove(id)
+                stale = True
+            else:
+                stale = False
+            future = self._loading.get(id)
+            is_loader = future is None
+            if is_loader:
+                future = Future()
+                self._loading[id] = future
+        if not is_loader:
+            self.stats.add_wait()
+            self._print_log(f" *** Cache {self._name}: waiting for {id} loaded by another thread")
+            value = future.result()
+            return value, value is not None
+        self.stats.add_miss(stale)
+        self._load_source.value = 'load'
+        start = time.perf_counter()
+        try:
+            res = load()
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(id, None)
+            future.set_exception(e)
+            raise
+        # Add to the cache and stop loading atomically, so that the element is always found
+        with self._lock:
+            if res is not None:
+                duration = time.perf_counter() - start
+                self.append(id, res[0], res[1], check_size=check_size, cold=cold, cost=duration)
+                self.stats.add_load(duration, self._load_source.value)
+                if self._trace_file is not None:
+                    self._trace(id, self.entry_size(id, *res), duration)
+            self._loading.pop(id, None)
+        value = res[0] if res is not None else None
+        future.set_result(value)
+        return value, False
+
+    def entry_size(self, id : TId, value: TValue, extra: TExtra) -> int:
+        """ Size in bytes charged to the cache for one element, called once when the element is added,
+            can be overridden by derived classes with a cheaper measure """
+        return deep_getsizeof(value, set())
+
+    def append(self, id : TId, value: TValue, extra: TExtra, check_size=True, cold=False,
+               cost : Optional[float] = None) -> None:
         """
         :param id: cache element identifier
         :param value: cache value, typically numpy array of the image
         :param extra: additional data in the cache
+        :param cold: add the element as least recently used, first to be evicted, used for prefetched
+            elements that should not evict the ones in use
+        :param cost: time in seconds to load the element, for the eviction policy, default to the mean load time
         :return:
         """
         # update cache
-        self._print_log(f"added size {deep_getsizeof([id, value, extra], set())}")
-        self.cache.append((id, value, extra))
-        self.cache_list.append(id)
-        self._print_log(f" *** Cache {self._name}: append() cache_list {len(self.cache_list)} cache {len(self.cache)}")
-        if check_size:
-            self.check_size_limit()
+        size = self.entry_size(id, value, extra)
+        self._print_log(f"added size {size}")
+        self.stats.add_bytes_in(size)
+        with self._lock:
+            self.cache_size += size - self.entry_sizes.get(id, 0)
+            self.entry_sizes[id] = size
+            self.cache[id] = (id, value, extra)
+            self.cache.move_to_end(id, last=not cold)
+            self.policy.on_insert(id, size, cost if cost is not None else self.mean_load_time(), cold)
+            self._print_log(f" *** Cache {self._name}: append() cache {len(self.cache)}")
+            if check_size:
+                self.check_size_limit()
     
+    def update_entry_size(self, id : TId) -> None:
+        """ Recompute the size charged for an element whose memory footprint changes over time """
+        with self._lock:
+            elt = self.cache.get(id, None)
+            if elt is None: return
+            size = self.entry_size(*elt)
+            self.cache_size += size - self.entry_sizes[id]
+            self.entry_sizes[id] = size
+            self.policy.on_resize(id, size)
+
     def remove(self, id:TId) -> bool:
         """ Remove id from cache
             returns: True if removed False otherwise (not found)
         """ 
-        res = self.search(id)
-        if res is None: return False
-        self.cache.remove(res)
-        self.cache_list.remove(id)
+        with self._lock:
+            if self.cache.pop(id, None) is None: return False
+            size = self.entry_sizes.pop(id)
+            self.cache_size -= size
+            self.policy.on_remove(id)
+        self.stats.add_bytes_out(size, evicted=False)
         return True
 
     def get_cache_size(self) -> int:
-        size = deep_getsizeof(self.cache, set())
+        """ Full recursive walk of the cache memory, slow: only used to check the running total """
+        with self._lock:
+            size = deep_getsizeof(self.cache, set())
         return size
+
+    def check_cache_size(self) -> bool:
+        """ Debug: check that the running total matches the sizes of the current elements
+            returns: True if consistent
+        """
+        with self._lock:
+            total = sum(self.entry_size(*elt) for elt in self.cache.values())
+        if total != self.cache_size:
+            print(f" *** Cache {self._name}: running size {self.cache_size} differs from elements size {total}")
+        self._print_log(f" *** Cache {self._name}: running size {self.cache_size}, "
+                        f"recursive walk {self.get_cache_size()} (includes container overhead)")
+        return total == self.cache_size
     
+    def free_size(self) -> int:
+        """ Remaining size in bytes before reaching the cache limit """
+        return self.max_cache_size * self.cache_unit - self.cache_size
+
     def update_progress(self):
         if self.memory_bar is not None:
             new_progress_value = int(self.cache_size/self.cache_unit+0.5)
             if new_progress_value != self.memory_bar.value():
                 self.memory_bar.setValue(new_progress_value)
 
+    def on_evicted(self, elements : List[Tuple[TId, TValue, TExtra]]) -> None:
+        """ Called without the lock held with the elements evicted by check_size_limit(),
+            can be overridden to keep them in another tier """
+        pass
+
     def check_size_limit(self, update_progress : bool = False) -> None:
         self._print_log(" *** Cache: check_size_limit()")
-        cache_size = self.get_cache_size()
-        while cache_size >= self.max_cache_size * self.cache_unit:
-            self.cache.popleft()
-            self.cache_list.pop(0)
-            self._print_log(" *** Cache: pop ")
-            cache_size = self.get_cache_size()
-        self._print_log(f" *** Cache::append() {self._name} {cache_size/self.cache_unit} Mb; size {len(self.cache)}")
-        self.cache_size = cache_size
+        if self.debug_check_size:
+            self.check_cache_size()
+        evicted = []
+        with self._lock:
+            while self.cache_size >= self.max_cache_size * self.cache_unit and len(self.cache)>0:
+                # Evict the element chosen by the policy, least recently used by default
+                id = self.policy.select_victim(self.cache.keys(), self._pinned)
+                if id is None:
+                    self._print_log(f" *** Cache {self._name}: all elements are pinned")
+                    break
+                elt = self.cache.pop(id)
+                size = self.entry_sizes.pop(id)
+                self.cache_size -= size
+                self.policy.on_remove(id)
+                self.stats.add_bytes_out(size, evicted=True)
+                evicted.append(elt)
+                self._print_log(" *** Cache: pop ")
+        if len(evicted)>0:
+            self.on_evicted(evicted)
+        self._print_log(f" *** Cache::append() {self._name} {self.cache_size/self.cache_unit} Mb; size {len(self.cache)}")
         if update_progress:
             self.update_progress()
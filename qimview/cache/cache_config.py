@@ -0,0 +1,124 @@
+"""
+    Sets cache configuration variables
+        either from the configuration file if available
+        or sets default values
+"""
+
+import os
+import configparser
+from dataclasses import dataclass
+
+config = configparser.ConfigParser()
+res = config.read([os.path.expanduser('~/.qimview.cfg')])
+
+@dataclass
+class CacheConfig:
+    """
+        Configuration parameters for image caches
+    """
+    # Default values
+    # Persistent on-disk cache of decoded images
+    disk_cache_enabled  : bool = False
+    disk_cache_dir      : str  = os.path.join('~', '.cache', 'qimview', 'images')
+    # Maximal size of the disk cache in Mb
+    disk_cache_max_size : int  = 20000
+    # FileCache keeps memory-mapped files instead of reading them, suited to local SSDs
+    file_cache_mmap     : bool = False
+    # Detection of file changes for the cache of modification times: 'watcher', 'polling' or 'none'
+    stat_cache_mode          : str   = 'watcher'
+    # Polling period in seconds
+    stat_cache_poll_interval : float = 2
+    # In memory tier of compressed images evicted from ImageCache, and its compression level
+    compressed_cache_enabled : bool = False
+    compressed_cache_level   : int  = 1
+    # Memory budget shared by all the caches, as a ratio of the total memory
+    memory_budget        : float = 0.30
+    # Caches are shrunk to keep at least this ratio of the total memory available to the system
+    memory_min_available : float = 0.10
+    # Period of the memory check in seconds
+    memory_check_interval : float = 2
+    # If set, the cache statistics are saved to this json file at exit
+    stats_file : str = ''
+    # Eviction policy of ImageCache: 'lru' or 'gdsf' (cost-aware, favors slow decodes and small images)
+    eviction_policy : str = 'lru'
+    # If set, each cache records its accesses in this folder, to replay with eviction_simulator
+    trace_dir : str = ''
+    # Images above this size in megapixels are converted once to a tiled pyramid (0 to disable)
+    pyramid_min_size  : float = 200
+    pyramid_tile_size : int   = 256
+    pyramid_dir       : str   = os.path.join('~', '.cache', 'qimview', 'pyramids')
+    # ImageCache decodes the images in its threads ('thread') or in worker processes ('process'),
+    # which scales better with the cores for readers that hold the GIL
+    read_backend : str = 'thread'
+    # FileCache reads: maximal number of parallel reads, adapted to the measured throughput if
+    # file_read_adaptive is set, and size in Mb of the pool of free read buffers
+    file_read_max_threads : int  = 8
+    file_read_adaptive    : bool = True
+    file_buffer_pool_size : int  = 128
+    # Read-ahead of FileCache.add_files(): maximal size in Mb and duration in seconds
+    read_ahead_max_size : int   = 512
+    read_ahead_max_time : float = 5
+
+if res:
+    CacheConfig.disk_cache_enabled  = config.getboolean('CACHE', 'disk_cache_enabled',
+                                                        fallback=CacheConfig.disk_cache_enabled)
+    CacheConfig.disk_cache_dir      = config.get('CACHE', 'disk_cache_dir',
+                                                 fallback=CacheConfig.disk_cache_dir)
+    CacheConfig.disk_cache_max_size = config.getint('CACHE', 'disk_cache_max_size',
+                                                    fallback=CacheConfig.disk_cache_max_size)
+    CacheConfig.file_cache_mmap     = config.getboolean('CACHE', 'file_cache_mmap',
+                                                        fallback=CacheConfig.file_cache_mmap)
+    CacheConfig.stat_cache_mode     = config.get('CACHE', 'stat_cache_mode',
+                                                 fallback=CacheConfig.stat_cache_mode)
+    CacheConfig.stat_cache_poll_interval = config.getfloat('CACHE', 'stat_cache_poll_interval',
+                                                           fallback=CacheConfig.stat_cache_poll_interval)
+    CacheConfig.compressed_cache_enabled = config.getboolean('CACHE', 'compressed_cache_enabled',
+                                                             fallback=CacheConfig.compressed_cache_enabled)
+    CacheConfig.compressed_cache_level   = config.getint('CACHE', 'compressed_cache_level',
+                                                         fallback=CacheConfig.compressed_cache_level)
+    CacheConfig.memory_budget        = config.getfloat('CACHE', 'memory_budget',
+                                                       fallback=CacheConfig.memory_budget)
+    CacheConfig.memory_min_available = config.getfloat('CACHE', 'memory_min_available',
+                                                       fallback=CacheConfig.memory_min_available)
+    CacheConfig.memory_check_interval = config.getfloat('CACHE', 'memory_check_interval',
+                                                        fallback=CacheConfig.memory_check_interval)
+    CacheConfig.stats_file = os.path.expanduser(config.get('CACHE', 'stats_file', fallback=CacheConfig.stats_file))
+    CacheConfig.eviction_policy = config.get('CACHE', 'eviction_policy', fallback=CacheConfig.eviction_policy)
+    CacheConfig.trace_dir = os.path.expanduser(config.get('CACHE', 'trace_dir', fallback=CacheConfig.trace_dir))
+    CacheConfig.pyramid_min_size  = config.getfloat('CACHE', 'pyramid_min_size', fallback=CacheConfig.pyramid_min_size)
+    CacheConfig.pyramid_tile_size = config.getint('CACHE', 'pyramid_tile_size', fallback=CacheConfig.pyramid_tile_size)
+    CacheConfig.pyramid_dir       = config.get('CACHE', 'pyramid_dir', fallback=CacheConfig.pyramid_dir)
+    CacheConfig.read_backend      = config.get('CACHE', 'read_backend', fallback=CacheConfig.read_backend)
+    CacheConfig.file_read_max_threads = config.getint('CACHE', 'file_read_max_threads',
+                                                      fallback=CacheConfig.file_read_max_threads)
+    CacheConfig.file_read_adaptive    = config.getboolean('CACHE', 'file_read_adaptive',
+                                                          fallback=CacheConfig.file_read_adaptive)
+    CacheConfig.file_buffer_pool_size = config.getint('CACHE', 'file_buffer_pool_size',
+                                                      fallback=CacheConfig.file_buffer_pool_size)
+    CacheConfig.read_ahead_max_size   = config.getint('CACHE', 'read_ahead_max_size',
+                                                      fallback=CacheConfig.read_ahead_max_size)
+    CacheConfig.read_ahead_max_time   = config.getfloat('CACHE', 'read_ahead_max_time',
+                                                        fallback=CacheConfig.read_ahead_max_time)
+    print(f"{CacheConfig.disk_cache_enabled=}")
+    print(f"{CacheConfig.disk_cache_dir=}")
+    print(f"{CacheConfig.disk_cache_max_size=}")
+    print(f"{CacheConfig.file_cache_mmap=}")
+    print(f"{CacheConfig.stat_cache_mode=}")
+    print(f"{CacheConfig.stat_cache_poll_interval=}")
+    print(f"{CacheConfig.compressed_cache_enabled=}")
+    print(f"{CacheConfig.compressed_cache_level=}")
+    print(f"{CacheConfig.memory_budget=}")
+    print(f"{CacheConfig.memory_min_available=}")
+    print(f"{CacheConfig.memory_check_interval=}")
+    print(f"{CacheConfig.stats_file=}")
+    print(f"{CacheConfig.eviction_policy=}")
+    print(f"{CacheConfig.trace_dir=}")
+    print(f"{CacheConfig.pyramid_min_size=}")
+    print(f"{CacheConfig.pyramid_tile_size=}")
+    print(f"{CacheConfig.pyramid_dir=}")
+    print(f"{CacheConfig.read_backend=}")
+    print(f"{CacheConfig.file_read_max_threads=}")
+    print(f"{CacheConfig.file_read_adaptive=}")
+    print(f"{CacheConfig.file_buffer_pool_size=}")
+    print(f"{CacheConfig.read_ahead_max_size=}")
+    print(f"{CacheConfig.read_ahead_max_time=}")
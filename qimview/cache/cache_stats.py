@@ -0,0 +1,118 @@
+import atexit
+import json
+import threading
+import weakref
+from collections import defaultdict
+from typing import Any, Dict, List
+from .cache_config import CacheConfig
+
+# Upper bounds in ms of the load latency histogram bins, the last bin counts the slower loads
+latency_bins_ms : List[int] = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class CacheStats:
+    """
+        Counters of a cache, updated by BaseCache:
+            hits, misses (loads started), waits (load shared with another thread), stale (outdated elements
+            reloaded), evictions, bytes_in (added), bytes_out (evicted or removed)
+        and the histogram of load latencies for each load source (reader plugin, other cache tier ...).
+        All the instances are listed by all_cache_stats().
+    """
+    _instances : 'weakref.WeakSet[CacheStats]' = weakref.WeakSet()
+
+    def __init__(self, name : str):
+        self.name      : str   = name
+        self.hits      : int   = 0
+        self.misses    : int   = 0
+        self.waits     : int   = 0
+        self.stale     : int   = 0
+        self.evictions : int   = 0
+        self.bytes_in  : int   = 0
+        self.bytes_out : int   = 0
+        self.loads     : int   = 0
+        # Total load time in seconds
+        self.load_time : float = 0
+        # Number of loads per latency bin, for each load source
+        self.latency   : Dict[str, List[int]] = defaultdict(lambda: [0]*(len(latency_bins_ms)+1))
+        self._lock     : threading.Lock = threading.Lock()
+        CacheStats._instances.add(self)
+
+    def add_hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def add_miss(self, stale : bool = False) -> None:
+        with self._lock:
+            self.misses += 1
+            if stale: self.stale += 1
+
+    def add_wait(self) -> None:
+        with self._lock:
+            self.waits += 1
+
+    def add_load(self, duration : float, source : str) -> None:
+        """ Count a successful load that took duration seconds """
+        duration_ms = duration*1000
+        pos = next((n for n, b in enumerate(latency_bins_ms) if duration_ms <= b), len(latency_bins_ms))
+        with self._lock:
+            self.loads += 1
+            self.load_time += duration
+            self.latency[source][pos] += 1
+
+    def add_bytes_in(self, size : int) -> None:
+        with self._lock:
+            self.bytes_in += size
+
+    def add_bytes_out(self, size : int, evicted : bool) -> None:
+        with self._lock:
+            self.bytes_out += size
+            if evicted: self.evictions += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = self.misses = self.waits = self.stale = self.evictions = 0
+            self.bytes_in = self.bytes_out = self.loads = 0
+            self.load_time = 0
+            self.latency.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ Copy of the counters as a dictionary that can be saved as json """
+        with self._lock:
+            requests = self.hits + self.misses + self.waits
+            return {
+                'hits'      : self.hits,
+                'misses'    : self.misses,
+                'waits'     : self.waits,
+                'stale'     : self.stale,
+                'hit_ratio' : self.hits / requests if requests else 0,
+                'evictions' : self.evictions,
+                'bytes_in'  : self.bytes_in,
+                'bytes_out' : self.bytes_out,
+                'loads'     : self.loads,
+                'mean_load_ms' : self.load_time*1000/self.loads if self.loads else 0,
+                'latency_bins_ms' : latency_bins_ms,
+                'latency'   : { source: list(counts) for source, counts in self.latency.items() },
+            }
+
+
+def all_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """ Snapshots of the statistics of all the caches, by cache name """
+    res = {}
+    for stats in list(CacheStats._instances):
+        name, n = stats.name, 1
+        while name in res:
+            n += 1
+            name = f"{stats.name}_{n}"
+        res[name] = stats.snapshot()
+    return res
+
+
+def dump_cache_stats(filename : str) -> None:
+    """ Save the statistics of all the caches as json """
+    with open(filename, 'w') as f:
+        json.dump(all_cache_stats(), f, indent=2)
+    print(f"Cache statistics saved to {filename}")
+
+
+if CacheConfig.stats_file:
+    atexit.register(dump_cache_stats, CacheConfig.stats_file)
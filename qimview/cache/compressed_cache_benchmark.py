@@ -0,0 +1,65 @@
+"""
+    Benchmark of the compressed image tier: for each image format, compares the time to read and decode
+    the file with the time to decompress the image kept by CompressedImageCache.
+    The compressed tier is worth its memory when decompression is much faster than decoding.
+
+    usage: python -m qimview.cache.compressed_cache_benchmark [--level 1] [--repeat 3] images...
+"""
+
+import argparse
+import os
+import time
+from collections import defaultdict
+from qimview.image_readers.image_reader import gb_image_reader, reader_add_plugins
+from qimview.cache.compressedcache import compress_image, decompress_image, has_blosc2
+
+
+def best_time(func, repeat):
+    """ Minimal time in seconds over several calls, and the last result """
+    res, best = None, float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter() - start)
+    return best, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decoding versus decompression times per image format')
+    parser.add_argument('images', nargs='+', help='input images')
+    parser.add_argument('-l', '--level',  type=int, default=1, help='compression level')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of runs, the best time is kept')
+    args = parser.parse_args()
+
+    reader_add_plugins()
+    print(f"codec: {'blosc2 shuffle+LZ4' if has_blosc2 else 'byte shuffle + zlib'} level {args.level}")
+    # decode, compress, decompress times in ms and compression ratios, by format
+    results = defaultdict(list)
+    for filename in args.images:
+        decode, image = best_time(lambda: gb_image_reader.read(filename), args.repeat)
+        if image is None:
+            print(f"Failed to read {filename}")
+            continue
+        compress, compressed = best_time(lambda: compress_image(image, args.level), args.repeat)
+        if compressed is None:
+            print(f"Image format of {filename} not supported")
+            continue
+        decompress, _ = best_time(lambda: decompress_image(compressed), args.repeat)
+        ratio = image.data.nbytes / len(compressed.buffer)
+        key = f"{os.path.splitext(filename)[1].upper()} {image.data.dtype}"
+        results[key].append((decode*1000, compress*1000, decompress*1000, ratio))
+        print(f"{os.path.basename(filename)}: {image.data.shape} decode {decode*1000:0.1f} ms, "
+              f"compress {compress*1000:0.1f} ms, decompress {decompress*1000:0.1f} ms, ratio {ratio:0.2f}")
+
+    print(f"\n{'format':<16}{'nb':>4}{'decode ms':>12}{'compress ms':>13}{'decompress ms':>15}"
+          f"{'ratio':>8}{'speedup':>9}")
+    for key, values in sorted(results.items()):
+        nb = len(values)
+        decode, compress, decompress, ratio = [sum(v[i] for v in values)/nb for i in range(4)]
+        # speedup > 1: getting the image from the compressed tier is faster than reading it again
+        print(f"{key:<16}{nb:>4}{decode:>12.1f}{compress:>13.1f}{decompress:>15.1f}{ratio:>8.2f}"
+              f"{decode/decompress:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+try:
+    import blosc2
+except:
+    has_blosc2 = False
+else:
+    has_blosc2 = True
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+import numpy as np
+from qimview.utils.utils import get_time
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.utils.thread_pool import TaskPriority
+from .basecache import BaseCache
+from .statcache import FileKey
+
+# Image id: file key and downscale factor, as in ImageCache
+ImageId = Tuple[FileKey, int]
+
+
+@dataclass
+class CompressedImage:
+    """ Lossless compressed pixels of a ViewerImage with the metadata needed to rebuild it """
+    buffer    : bytes
+    shape     : Tuple[int, ...]
+    dtype     : str
+    precision : int
+    downscale : int
+    channels  : ImageFormat
+    filename  : Optional[str]
+
+
+def compress_array(data: np.ndarray, level: int = 1) -> bytes:
+    """ Compress with byte-shuffle and LZ4 if blosc2 is available, otherwise shuffle the bytes
+        of multi-byte pixels with numpy and use zlib at a low level """
+    if has_blosc2:
+        return blosc2.compress(np.ascontiguousarray(data), typesize=data.itemsize, clevel=level,
+                               filter=blosc2.Filter.SHUFFLE, codec=blosc2.Codec.LZ4)
+    if data.itemsize > 1:
+        # Group the bytes of same significance: high bytes of 16-bit images compress much better
+        data = np.ascontiguousarray(data).view(np.uint8).reshape(-1, data.itemsize).T
+    return zlib.compress(np.ascontiguousarray(data).data, level)
+
+
+def decompress_array(buffer: bytes, shape: Tuple[int, ...], dtype: str) -> np.ndarray:
+    dt = np.dtype(dtype)
+    if has_blosc2:
+        return np.frombuffer(blosc2.decompress(buffer), dtype=dt).reshape(shape)
+    data = np.frombuffer(zlib.decompress(buffer), dtype=np.uint8)
+    if dt.itemsize > 1:
+        data = data.reshape(dt.itemsize, -1).T.copy()
+    return data.view(dt).reshape(shape)
+
+
+def compress_image(image: ViewerImage, level: int = 1) -> Optional[CompressedImage]:
+    # Only single array images are supported
+    if image.u is not None or image.v is not None or image.uv is not None:
+        return None
+    return CompressedImage(compress_array(image.data, level), image.data.shape, image.data.dtype.str,
+                           image.precision, image.downscale, image.channels, image.filename)
+
+
+def decompress_image(compressed: CompressedImage) -> ViewerImage:
+    data = decompress_array(compressed.buffer, compressed.shape, compressed.dtype)
+    image = ViewerImage(data, precision=compressed.precision, downscale=compressed.downscale,
+                        channels=compressed.channels)
+    image.set_filename(compressed.filename)
+    return image
+
+
+class CompressedImageCache(BaseCache[ImageId, CompressedImage, float]):
+    """
+        Second tier of ImageCache: the decoded images evicted from ImageCache are kept losslessly compressed,
+        with the same ids and modification times.
+        Getting an image back removes it from this tier, decompressing is much faster than reading
+        and decoding the file again for RAW and 16-bit images.
+    """
+    def __init__(self, level : int = 1):
+        BaseCache.__init__(self, "CompressedImageCache")
+        self.level   : int  = level
+        self.verbose : bool = False
+        # Total and number of the read times of the added images
+        self._saved_time  : float = 0
+        self._saved_count : int   = 0
+
+    def entry_size(self, id: ImageId, value: CompressedImage, extra: float) -> int:
+        return len(value.buffer)
+
+    def add_image(self, id: ImageId, image: ViewerImage, mtime: float, saved_time: float) -> bool:
+        """ Compress and add an image
+            :param saved_time: average time in seconds to read the image, saved at each hit
+        """
+        start = get_time()
+        compressed = compress_image(image, self.level)
+        if compressed is None: return False
+        self._print_log(f" CompressedImageCache: {image.data.nbytes/(1024*1024):0.1f} Mb compressed to "
+                        f"{len(compressed.buffer)/(1024*1024):0.1f} Mb in {(get_time()-start)*1000:0.0f} ms")
+        with self._lock:
+            self._saved_time += saved_time
+            self._saved_count += 1
+        self.append(id, compressed, mtime, cost=saved_time)
+        return True
+
+    def saved_time_per_hit(self) -> float:
+        """ This tier does not load its elements, each hit saves the read time of the image """
+        with self._lock:
+            return self._saved_time / self._saved_count if self._saved_count else 0
+
+    def add_images_async(self, elements, saved_time: float) -> None:
+        """ Compress in background the elements (id, image, mtime) evicted from ImageCache """
+        for id, image, mtime in elements:
+            self.thread_pool.submit(self.add_image, id, image, mtime, saved_time,
+                                    priority=TaskPriority.BACKGROUND, tag='compress')
+
+    def pop_image(self, id: ImageId) -> Optional[ViewerImage]:
+        """ Return the decompressed image if available, and remove it from this tier """
+        with self._lock:
+            elt = self.search(id)
+            if elt is None:
+                self.stats.add_miss()
+                return None
+            self.remove(id)
+            self.stats.add_hit()
+        start = get_time()
+        image = decompress_image(elt[1])
+        self._print_log(f" CompressedImageCache: decompressed in {(get_time()-start)*1000:0.0f} ms")
+        return image
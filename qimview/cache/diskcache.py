@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+import numpy as np
+from qimview.utils.utils import get_time
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from .cache_config import CacheConfig
+
+
+class DiskImageCache:
+    """
+        Persistent cache of decoded images on disk, used as a second tier behind ImageCache.
+
+        Each image is saved as a .npy file holding the pixel array, with a .json file holding the
+        ViewerImage metadata (precision, channels, downscale) and the source file description.
+        Entries are keyed by the absolute path, size and modification time of the source file and
+        by the read options, so a modified source file is never served from the disk cache.
+        A hit returns a ViewerImage backed by np.memmap: the pixels are paged in on demand
+        instead of being decoded.
+        The total size is bounded by max_size, least recently used entries being deleted first.
+    """
+    def __init__(self, cache_dir: Optional[str] = None, max_size: Optional[int] = None):
+        """
+        :param cache_dir: folder where the cache is saved, default from CacheConfig
+        :param max_size: maximal size in Mb, default from CacheConfig
+        """
+        self._dir      : str  = os.path.expanduser(cache_dir if cache_dir else CacheConfig.disk_cache_dir)
+        self._max_size : int  = (max_size if max_size is not None else CacheConfig.disk_cache_max_size)*1024*1024
+        self.verbose   : bool = False
+        # Entries from least to most recently used: key -> size in bytes
+        self._entries  : OrderedDict[str, int] = OrderedDict()
+        self._size     : int = 0
+        self._lock     : threading.Lock = threading.Lock()
+        os.makedirs(self._dir, exist_ok=True)
+        self._load_index()
+
+    def _print_log(self, message : str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _load_index(self) -> None:
+        """ Build the LRU index from the files in the cache folder, using the metadata
+            modification time as last access time """
+        entries = []
+        for f in os.listdir(self._dir):
+            key, ext = os.path.splitext(f)
+            if ext != '.json': continue
+            try:
+                access_time = os.path.getmtime(self._meta_path(key))
+                size = os.path.getsize(self._data_path(key))
+            except OSError:
+                # incomplete entry
+                self._delete_files(key)
+                continue
+            entries.append((access_time, key, size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self._dir, key+'.npy')
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self._dir, key+'.json')
+
+    def _delete_files(self, key: str) -> None:
+        for path in [self._meta_path(key), self._data_path(key)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def get_key(filename: str, read_size: str, use_RGB: bool) -> Tuple[str, dict]:
+        """ Return the cache key of an image and the description of its source file """
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        source = { 'filename': filename, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                   'read_size': read_size, 'use_RGB': use_RGB }
+        key = hashlib.sha1(json.dumps(source, sort_keys=True).encode('utf-8')).hexdigest()
+        return key, source
+
+    @property
+    def size(self) -> int:
+        """ Current size in bytes """
+        return self._size
+
+    def set_max_size(self, max_size: int) -> None:
+        """ Set the maximal size in Mb """
+        with self._lock:
+            self._max_size = max_size*1024*1024
+            self._check_size_limit()
+
+    def _check_size_limit(self) -> None:
+        while self._size > self._max_size and len(self._entries)>0:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self._delete_files(key)
+            self._print_log(f" DiskImageCache: evicted {key}")
+
+    def get(self, filename: str, read_size: str ='full', use_RGB: bool =True) -> Optional[ViewerImage]:
+        """ Return the memory-mapped image if available, None otherwise """
+        start = get_time()
+        try:
+            key, source = DiskImageCache.get_key(filename, read_size, use_RGB)
+        except OSError:
+            return None
+        with self._lock:
+            if key not in self._entries: return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._meta_path(key), 'r') as f:
+                meta = json.load(f)
+            if meta['source'] != source:
+                return None
+            # copy-on-write memmap: pixels are read from disk on demand and the cache file is never modified
+            data = np.load(self._data_path(key), mmap_mode='c')
+            # Save the access time for LRU order of next sessions
+            os.utime(self._meta_path(key))
+        except Exception as e:
+            print(f"DiskImageCache: failed to load entry for {filename}: {e}")
+            self.remove(key)
+            return None
+        image = ViewerImage(data, precision=meta['precision'], downscale=meta['downscale'],
+                            channels=ImageFormat(meta['channels']))
+        self._print_log(f" DiskImageCache.get({os.path.basename(filename)}) "
+                        f"took {int((get_time()-start)*1000+0.5)} ms")
+        return image
+
+    def put(self, filename: str, image: ViewerImage, read_size: str ='full', use_RGB: bool =True) -> bool:
+        """ Save the decoded image to the disk cache
+            returns: True if saved
+        """
+        # Only single array images are supported
+        if image.u is not None or image.v is not None or image.uv is not None:
+            return False
+        # images memory-mapped from their file are already cheap to get back
+        if isinstance(image.data, np.memmap):
+            return False
+        try:
+            key, source = DiskImageCache.get_key(filename, read_size, use_RGB)
+        except OSError:
+            return False
+        if image.data.nbytes > self._max_size: return False
+        meta = { 'source': source, 'precision': image.precision, 'downscale': image.downscale,
+                 'channels': int(image.channels) }
+        start = get_time()
+        # Write to temporary files and rename them, so that an entry is never partially visible,
+        # even to another process sharing the same folder
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(self._data_path(key)+suffix, 'wb') as f:
+                np.save(f, image.data, allow_pickle=False)
+            with open(self._meta_path(key)+suffix, 'w') as f:
+                json.dump(meta, f)
+            os.replace(self._data_path(key)+suffix, self._data_path(key))
+            os.replace(self._meta_path(key)+suffix, self._meta_path(key))
+            size = os.path.getsize(self._data_path(key))
+        except Exception as e:
+            print(f"DiskImageCache: failed to save {filename}: {e}")
+            for path in [self._data_path(key)+suffix, self._meta_path(key)+suffix]:
+                if os.path.exists(path): os.remove(path)
+            return False
+        with self._lock:
+            self._size += size - self._entries.get(key, 0)
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._check_size_limit()
+        self._print_log(f" DiskImageCache.put({os.path.basename(filename)}) {size/(1024*1024):0.1f} Mb "
+                        f"took {int((get_time()-start)*1000+0.5)} ms")
+        return True
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._size -= size
+            self._delete_files(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._entries:
+                self._delete_files(key)
+            self._entries.clear()
+            self._size = 0
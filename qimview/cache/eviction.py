@@ -0,0 +1,132 @@
+import heapq
+from abc import ABC, abstractmethod
+from typing import Dict, Generic, Hashable, Iterable, List, Optional, Set, Tuple, TypeVar
+
+TId = TypeVar("TId", bound=Hashable)
+
+
+class EvictionPolicy(ABC, Generic[TId]):
+    """ Base class of the eviction policies of BaseCache
+
+        The cache notifies the policy of each insertion, access and removal,
+        and asks it for the element to evict.
+    """
+    name : str = "base"
+
+    def on_insert(self, id : TId, size : int, cost : float, cold : bool = False) -> None:
+        """ Element added, its size in bytes and its cost: load time in seconds """
+        pass
+
+    def on_access(self, id : TId) -> None:
+        pass
+
+    def on_resize(self, id : TId, size : int) -> None:
+        pass
+
+    def on_remove(self, id : TId) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+    @abstractmethod
+    def select_victim(self, order : Iterable[TId], pinned : Set[TId]) -> Optional[TId]:
+        """ Element to evict among the cache elements, given from the least to the most recently used,
+            pinned elements cannot be evicted. Returns None if there is no candidate """
+        pass
+
+
+class LRUPolicy(EvictionPolicy[TId]):
+    """ Evicts the least recently used element, using the order of the cache """
+    name : str = "lru"
+
+    def select_victim(self, order : Iterable[TId], pinned : Set[TId]) -> Optional[TId]:
+        for id in order:
+            if id not in pinned:
+                return id
+        return None
+
+
+class GDSFPolicy(EvictionPolicy[TId]):
+    """ GreedyDual-Size-Frequency: evicts the element with the lowest value
+            H = L + frequency * cost / size
+        so large elements that are fast to load go first, and slow decodes accessed often stay.
+        L is the value of the last evicted element: it ages the elements that are not accessed anymore.
+    """
+    name : str = "gdsf"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._inflation : float = 0
+        # frequency, size and cost of each element
+        self._info   : Dict[TId, Tuple[int, int, float]] = {}
+        # current value of each element, and heap of (value, counter, id) with outdated entries
+        self._value  : Dict[TId, float] = {}
+        self._heap   : List[Tuple[float, int, TId]] = []
+        self._counter : int = 0
+
+    def _update(self, id : TId, cold : bool = False) -> None:
+        freq, size, cost = self._info[id]
+        value = self._inflation if cold else self._inflation + freq * cost / max(size, 1)
+        self._value[id] = value
+        self._counter += 1
+        heapq.heappush(self._heap, (value, self._counter, id))
+        # Rebuild the heap when outdated entries dominate
+        if len(self._heap) > 4*len(self._value) + 64:
+            self._heap = [ (v, n, i) for v, n, i in self._heap if self._value.get(i) == v ]
+            heapq.heapify(self._heap)
+
+    def on_insert(self, id : TId, size : int, cost : float, cold : bool = False) -> None:
+        freq = self._info[id][0] if id in self._info else 0
+        self._info[id] = (freq + (0 if cold else 1), size, cost)
+        self._update(id, cold)
+
+    def on_access(self, id : TId) -> None:
+        if id not in self._info: return
+        freq, size, cost = self._info[id]
+        self._info[id] = (freq + 1, size, cost)
+        self._update(id)
+
+    def on_resize(self, id : TId, size : int) -> None:
+        if id not in self._info: return
+        freq, _, cost = self._info[id]
+        self._info[id] = (freq, size, cost)
+        self._update(id)
+
+    def on_remove(self, id : TId) -> None:
+        if self._info.pop(id, None) is not None:
+            self._value.pop(id, None)
+
+    def select_victim(self, order : Iterable[TId], pinned : Set[TId]) -> Optional[TId]:
+        skipped = []
+        victim = None
+        while self._heap:
+            value, n, id = heapq.heappop(self._heap)
+            if self._value.get(id) != value:
+                continue  # outdated entry
+            if id in pinned:
+                skipped.append((value, n, id))
+                continue
+            victim = id
+            self._inflation = value
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        if victim is not None:
+            # the victim stays in the heap until on_remove()
+            heapq.heappush(self._heap, (self._value[victim], self._counter, victim))
+            self._counter += 1
+        return victim
+
+
+eviction_policies = { 'lru': LRUPolicy, 'gdsf': GDSFPolicy }
+
+
+def create_eviction_policy(name : str) -> EvictionPolicy:
+    """ Create a policy from its name: 'lru' or 'gdsf' """
+    if name not in eviction_policies:
+        print(f"Unknown eviction policy {name}, using lru")
+        name = 'lru'
+    return eviction_policies[name]()
@@ -0,0 +1,89 @@
+"""
+    Trace-driven simulation of the cache eviction policies: replays the accesses recorded by BaseCache
+    (see CacheConfig.trace_dir or BaseCache.start_trace()) with each policy and a given capacity.
+    The policy that saves the most load time on real navigation sessions is the one to set in
+    CacheConfig.eviction_policy.
+
+    usage: python -m qimview.cache.eviction_simulator --capacity 2000 traces.jsonl ...
+"""
+
+import argparse
+import json
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+from qimview.cache.eviction import EvictionPolicy, eviction_policies
+
+# Access: id, size in bytes, load time in seconds
+Access = Tuple[str, int, float]
+
+
+def read_trace(filename : str) -> List[Access]:
+    """ Read a trace recorded by BaseCache, the load time of hits is taken from the previous load """
+    accesses = []
+    costs : Dict[str, float] = {}
+    with open(filename) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['size'] is None: continue
+            if record['cost'] is not None:
+                costs[record['id']] = record['cost']
+            accesses.append((record['id'], record['size'], costs.get(record['id'], 0.001)))
+    return accesses
+
+
+def simulate(accesses : Iterable[Access], policy : EvictionPolicy, capacity : int) -> Dict[str, float]:
+    """ Replay the accesses in a cache of capacity bytes using the policy
+        :return: hit ratio, byte hit ratio, load time spent and saved in seconds
+    """
+    policy.reset()
+    # ordered from least to most recently used, as in BaseCache
+    cache : OrderedDict[str, int] = OrderedDict()
+    size = 0
+    nb = hits = total_bytes = hit_bytes = 0
+    spent = saved = 0.0
+    for id, elt_size, cost in accesses:
+        nb += 1
+        total_bytes += elt_size
+        if id in cache:
+            hits += 1
+            hit_bytes += elt_size
+            saved += cost
+            cache.move_to_end(id)
+            policy.on_access(id)
+            continue
+        spent += cost
+        cache[id] = elt_size
+        size += elt_size
+        policy.on_insert(id, elt_size, cost)
+        while size >= capacity and cache:
+            victim = policy.select_victim(cache.keys(), set())
+            if victim is None: break
+            size -= cache.pop(victim)
+            policy.on_remove(victim)
+    return {
+        'hit_ratio'      : hits / nb if nb else 0,
+        'byte_hit_ratio' : hit_bytes / total_bytes if total_bytes else 0,
+        'time_spent'     : spent,
+        'time_saved'     : saved,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay cache traces with each eviction policy')
+    parser.add_argument('traces', nargs='+', help='trace files (json lines) recorded by the caches')
+    parser.add_argument('-c', '--capacity', type=float, nargs='+', default=[2000], help='cache sizes in Mb')
+    args = parser.parse_args()
+
+    for filename in args.traces:
+        accesses = read_trace(filename)
+        print(f"\n{filename}: {len(accesses)} accesses, {len(set(a[0] for a in accesses))} distinct elements")
+        print(f"{'capacity Mb':>12}{'policy':>8}{'hits %':>9}{'bytes %':>9}{'spent s':>10}{'saved s':>10}")
+        for capacity in args.capacity:
+            for name, policy_class in eviction_policies.items():
+                res = simulate(accesses, policy_class(), int(capacity*1024*1024))
+                print(f"{capacity:>12.0f}{name:>8}{res['hit_ratio']*100:>9.1f}{res['byte_hit_ratio']*100:>9.1f}"
+                      f"{res['time_spent']:>10.2f}{res['time_saved']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,127 @@
 
 import os
 from os import path as osp
-import psutil
-from typing import Optional, Tuple
+import mmap
+import ctypes
+import ctypes.util
+import numpy as np
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import List, Optional, Set, Tuple, Union
 from qimview.utils.utils import get_time
+from qimview.utils.thread_pool import TaskPriority
 # from qimview.utils.qt_imports import *
 from .basecache import BaseCache
+from .cache_config import CacheConfig
+from .statcache import gb_stat_cache, FileKey
+from .memory_governor import gb_memory_governor
+from .read_engine import ReadEngine
 
-class FileCache(BaseCache[str,bytes,float]):
+# mincore() gives the pages of a mapping resident in memory, not available on Windows
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _mincore = _libc.mincore
+    _mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    _mincore.restype  = ctypes.c_int
+except:
+    has_mincore = False
+else:
+    has_mincore = True
+
+def resident_size(buffer: mmap.mmap) -> int:
+    """ Number of bytes of the memory-mapped file currently resident in memory,
+        the full size if it cannot be measured """
+    length = len(buffer)
+    if not has_mincore or length == 0:
+        return length
+    nb_pages = (length + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vec = np.zeros(nb_pages, dtype=np.uint8)
+    # numpy gives the address of a read-only mapping, which is page aligned
+    address = np.frombuffer(buffer, dtype=np.uint8).ctypes.data
+    if _mincore(address, length, vec.ctypes.data) != 0:
+        return length
+    return min(int(np.count_nonzero(vec & 1)) * mmap.PAGESIZE, length)
+
+# File content: view of the pooled buffer read from the file, or read-only memory mapping of the file
+FileBuffer = Union[memoryview, bytes, mmap.mmap]
+
+class FileCache(BaseCache[FileKey,FileBuffer,float]):
     """
-        Save output bytes from read() function into a cache indexed by the filename
+        Save output bytes from read() function into a cache indexed by the file key
         inherits from BaseCache, with
-            id as string: input filename
-            bytes: output from binary read()
+            id as FileKey: device, inode, size and modification time of the input file, given by gb_stat_cache,
+                so the paths aliased by symbolic or hard links share the same buffer
+            bytes: view of the buffer read by read_engine, or mmap object if use_mmap is set
             mtime: modification time as float from osp.getmtime(filename)
-        If a file is in the cache but its modification time on disk is more recent,
-        we can enable an automatic reload
+        A modified file gets a new key, the buffer of its previous key is removed when gb_stat_cache
+        reads the new one
+
+        With use_mmap, files are memory-mapped instead of read: the readers decode directly from the
+        mapping without copying the file content, and only the pages resident in memory are charged
+        to the cache size. Files should not be truncated while they are mapped.
+
+        Otherwise, files are read by read_engine into pooled buffers, which are given back to the pool
+        when evicted. add_files() reads ahead the files in a window bounded in size and duration, with
+        the number of parallel reads adapted by read_engine.
 
     Args:
         BaseCache (_type_): _description_
     """    
     def __init__(self):
         BaseCache.__init__(self, "FileCache")
-        total_memory        : float = psutil.virtual_memory().total / self.cache_unit
-        # let use 5% of total memory by default
-        self.max_cache_size : int   = int(total_memory * 0.05)
+        # The memory governor sets max_cache_size, with a small part of the budget at start
+        gb_memory_governor.register(self, weight=5)
         self.last_progress = 0
         self.verbose : bool = False
+        self.use_mmap : bool = CacheConfig.file_cache_mmap
+        self.read_engine : ReadEngine = ReadEngine(CacheConfig.file_read_max_threads,
+                                                   adaptive=CacheConfig.file_read_adaptive,
+                                                   pool_size=CacheConfig.file_buffer_pool_size*self.cache_unit)
+        # Extensions of the files read by their reader, skipped by the read-ahead, set by ImageReader
+        self.skipped_extensions : Set[str] = set()
+        # Incremented by add_files() to stop the previous read-ahead
+        self._read_ahead_generation : int = 0
+        gb_stat_cache.add_key_changed_callback(self.file_changed)
+
+    def file_changed(self, previous_key : FileKey) -> None:
+        """ Free the buffer of the previous content of a modified file """
+        with self._lock:
+            element = self.cache.get(previous_key)
+            removed = self.remove(previous_key)
+        if removed and isinstance(element[1], memoryview):
+            self.read_engine.retire(element[1])
+
+    def set_use_mmap(self, use_mmap: bool) -> None:
+        """ Keep memory-mapped files instead of reading them, for files added after this call """
+        self.use_mmap = use_mmap
+
+    def entry_size(self, id: FileKey, value: FileBuffer, extra: float) -> int:
+        if isinstance(value, mmap.mmap):
+            return resident_size(value)
+        if isinstance(value, memoryview):
+            # the full pooled buffer is held
+            return len(value.obj)
+        return len(value)
+
+    def on_evicted(self, elements : List[Tuple[FileKey, FileBuffer, float]]) -> None:
+        for _, value, _ in elements:
+            if isinstance(value, memoryview):
+                self.read_engine.retire(value)
+
+    def buffer_used(self, filename: str) -> None:
+        """ Called once the buffer of a file has been decoded, to charge the memory-mapped pages
+            that have been read """
+        if self.use_mmap:
+            self.update_entry_size(gb_stat_cache.file_key(gb_stat_cache.abspath(filename)))
 
     def has_file(self, filename):
         # is it too slow
-        filename = os.path.abspath(filename)
-        return filename in self.cache_list
+        try:
+            key = gb_stat_cache.file_key(gb_stat_cache.abspath(filename))
+        except OSError:
+            return False
+        return self.has(key)
 
-    def get_file(self, filename: str, check_size: bool = True) -> Tuple[Optional[bytes], bool]:
+    def get_file(self, filename: str, check_size: bool = True) -> Tuple[Optional[FileBuffer], bool]:
         """_summary_
 
         Args:
@@ -42,62 +130,82 @@ class FileCache(BaseCache[str,bytes,float]):
             check_size (bool, optional): _description_. Defaults to True.
 
         Returns:
-            Tuple[Optional[bytes], bool]: first elt is the data read 
+            Tuple[Optional[FileBuffer], bool]: first elt is the data read 
                 second is a boolean saying if it comes or not from the cache 
         """
         # print(f'get_file {filename}')
         start = get_time()
         # Get absolute normalized path
-        filename = os.path.abspath(filename)
-        # Get file last modification time
-        mtime = os.path.getmtime(filename)
-        # print(f"image cache get_image({filename})")
-        file_data = self.search(filename)
-        if file_data is not None:
-            if file_data[2]>=mtime:
-                # print(f'get_file {filename} found end')
-                return file_data[1], True
-            else:
-                # Remove element from cache?
-                print("Removing outdated cache data from file {filename}")
-                self.cache.remove(file_data)
-                self.cache_list.remove(filename)
-        try:
-            # Read file as binary data
-            self._print_log(" FileCache::get_file() before read() {0:0.3f} sec.".format(get_time() - start))
-            with open(filename, 'rb') as f:
-                file_data = f.read()
-            self._print_log(" FileCache::get_file() after read() {0:0.3f} sec.".format(get_time() - start))
-            self.append(filename, file_data, extra=mtime, check_size=check_size)
-            self._print_log("  FileCache::get_file() after append took {0:0.3f} sec.".format(get_time() - start))
-        except Exception as e:
-            print("Failed to load image {0}: {1}".format(filename, e))
-            return None, False
-        else:
-            # print(f'get_file {filename} read end')
-            return file_data, False
+        filename = gb_stat_cache.abspath(filename)
+        # Get file key, including its last modification time: a modified file gets a new key
+        key = gb_stat_cache.file_key(filename)
+        mtime = key[3]
 
-    def thread_add_files(self, filenames, progress_callback = None):
-        """
-        :param filename:
-        :param show_timing:
-        :return: pair image_data, boolean (True is coming from cache)
+        def read_file() -> Optional[Tuple[FileBuffer, float]]:
+            try:
+                # Read file as binary data
+                self._print_log(" FileCache::get_file() before read() {0:0.3f} sec.".format(get_time() - start))
+                file_data = None
+                if self.use_mmap:
+                    with open(filename, 'rb') as f:
+                        if os.fstat(f.fileno()).st_size > 0:
+                            # the mapping remains valid after closing the file
+                            file_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                            self.set_load_source('mmap')
+                if file_data is None:
+                    file_data = self.read_engine.read(filename)
+                    self.set_load_source('read')
+                self._print_log(" FileCache::get_file() after read() {0:0.3f} sec.".format(get_time() - start))
+            except Exception as e:
+                print("Failed to load image {0}: {1}".format(filename, e))
+                return None
+            return file_data, mtime
+
+        # A file requested concurrently by several threads is only read once
+        return self.get_or_load(key, read_file, check_size=check_size)
+
+    def read_ahead_window(self, filenames) -> List[str]:
+        """ First files not in the cache, up to CacheConfig.read_ahead_max_size Mb and half of the cache,
+            so that the read-ahead does not evict the files in use """
+        max_size = min(CacheConfig.read_ahead_max_size, self.max_cache_size//2)*self.cache_unit
+        window = []
+        total_size = 0
+        for f in filenames:
+            if f is None or os.path.splitext(f)[1].upper() in self.skipped_extensions: continue
+            try:
+                key = gb_stat_cache.file_key(gb_stat_cache.abspath(f))
+            except OSError:
+                continue
+            if self.has(key): continue
+            total_size += key[2]
+            if total_size > max_size and len(window) > 0: break
+            window.append(f)
+        return window
+
+    def thread_add_files(self, filenames, progress_callback = None, generation : Optional[int] = None):
+        """ Read ahead the files of read_ahead_window(), with read_engine.concurrency reads in flight,
+            during at most CacheConfig.read_ahead_max_time seconds
+        :param generation: the read-ahead stops when add_files() is called again
         """
-        nb_files = len(filenames)
-        nb_new_files = 0
-        for n, f in enumerate(filenames):
-            if nb_new_files>80:
+        start = get_time()
+        window = self.read_ahead_window(filenames)
+        engine = self.read_engine
+        futures : Set[Future] = set()
+        for n, f in enumerate(window):
+            if generation != self._read_ahead_generation or get_time()-start > CacheConfig.read_ahead_max_time:
                 break
-            if f is not None and not self.has_file(f):
-                data, flag = self.get_file(f, check_size=False)
-                # slow down to simulate network drive
-                # sleep(.500)
-                if not flag:
-                    nb_new_files += 1
+            while len(futures) >= engine.concurrency:
+                _, futures = wait(futures, return_when=FIRST_COMPLETED)
+            # the files read next are requested to the system in the background
+            if n+engine.concurrency < len(window):
+                engine.will_need(window[n+engine.concurrency])
+            futures.add(engine.thread_pool.submit(self.get_file, f, check_size=False,
+                                                  priority=TaskPriority.BACKGROUND, tag='read_ahead'))
             if progress_callback is not None:
-                progress_callback.emit(int(n*100/nb_files+0.5))
-            # if n%10==0: 
-            #     self.check_size_limit()
+                progress_callback.emit(int(n*100/len(window)+0.5))
+        wait(futures)
+        self._print_log(f" FileCache.thread_add_files() {len(window)} files in {get_time()-start:0.3f} sec., "
+                        f"{engine.throughput/(1024*1024):0.1f} Mb/s with {engine.concurrency} reads")
 
     def file_added(self, filename):
         pass
@@ -117,16 +225,20 @@ class FileCache(BaseCache[str,bytes,float]):
         self.check_size_limit()
 
     def add_files(self, filenames):
-        self.thread_pool.clear()
+        # Cancel previous read-ahead not started yet, and stop the running one
+        self.thread_pool.cancel('read_ahead')
+        self.read_engine.thread_pool.cancel('read_ahead')
+        self._read_ahead_generation += 1
         start = get_time()
         self.add_results = []
         # print(f" start worker with image {f}")
         # This part may be causing issues
         use_threads = True
         if use_threads:
-            self.thread_pool.set_worker(self.thread_add_files, filenames)
-            self.thread_pool.set_worker_callbacks(finished_cb=self.on_finished)
-            self.thread_pool.start_worker()
+            self.thread_pool.submit(self.thread_add_files, filenames, priority=TaskPriority.BACKGROUND,
+                                    tag='read_ahead', finished_cb=self.on_finished,
+                                    generation=self._read_ahead_generation)
         else:
-            self.thread_add_files(filenames, progress_callback=self.show_progress)
+            self.thread_add_files(filenames, progress_callback=self.show_progress,
+                                  generation=self._read_ahead_generation)
         self._print_log(f" FileCache.add_files() {self.add_results} took {int((get_time()-start)*1000+0.5)} ms;")
@@ -2,69 +2,283 @@
 from qimview.utils.utils import get_time
 from qimview.image_readers import gb_image_reader
 from .basecache import BaseCache
+from .cache_config import CacheConfig
+from .statcache import gb_stat_cache, FileKey
+from .memory_governor import gb_memory_governor
+from .diskcache import DiskImageCache
+from .compressedcache import CompressedImageCache
+from .eviction import create_eviction_policy
+from .tilecache import get_pyramid, is_building_pyramid
 import os
-import psutil
-from qimview.utils.viewer_image import ViewerImage
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.utils.thread_pool import ThreadPool, TaskPriority
+from qimview.utils.qt_imports import QtCore, Signal
 
-class ImageCache(BaseCache[str, ViewerImage, float]):
+# Image id: file key and downscale factor
+ImageId = Tuple[FileKey, int]
+
+# Downscale factor of each read_size, as produced by DCT scaling in turbojpeg or OpenCV readers
+read_size_downscale = {'full': 1, '1/2': 2, '1/4': 4, '1/8': 8}
+
+def mapped_size(data : np.ndarray) -> int:
+    """ Size of the file mapping held by a memory-mapped array, strided views hold the whole mapping """
+    mapping = getattr(data, '_mmap', None)
+    return len(mapping) if mapping is not None else data.nbytes
+
+
+class ImageCacheSignals(QtCore.QObject):
+    '''
+    Signals of ImageCache, emitted in the Qt thread
+    image_ready
+        filename as given to add_images_async(), read_size, True if the image was read successfully
+    '''
+    image_ready = Signal(str, str, bool)
+
+
+class ImageCache(BaseCache[ImageId, ViewerImage, float]):
     """
-        Save output bytes from read() function into a cache indexed by the filename
+        Save output bytes from read() function into a cache indexed by the file key
         inherits from BaseCache, with
-            id as string: input filename
+            id as (FileKey, int): device, inode, size and modification time of the input file, and downscale
+                factor of the read_size, so the paths aliased by symbolic or hard links share the decoded images
             ViewerImage: image object
             mtime: modification time as float from osp.getmtime(filename)
-        If a file is in the cache but its modification time on disk is more recent,
-        we can enable an automatic reload
+        A modified file gets a new key, the images of its previous key are removed when gb_stat_cache
+        reads the new one
+
+        Several resolutions of the same file can be cached, a lower resolution is computed from
+        a higher one already in the cache without reading the file again.
 
     Args:
         BaseCache (_type_): _description_
     """
     def __init__(self):
         BaseCache.__init__(self, "ImageCache")
-        # let use 25% of total memory
-        total_memory = psutil.virtual_memory().total / self.cache_unit
-        self.max_cache_size = int(total_memory * 0.25)
-        self.verbose : bool = True
+        # The memory governor sets max_cache_size, decoded images get most of the budget at start
+        gb_memory_governor.register(self, weight=25)
+        self.verbose : bool = False
+        self.set_eviction_policy(create_eviction_policy(CacheConfig.eviction_policy))
+        # Optional persistent tier of decoded images
+        self.disk_cache : Optional[DiskImageCache] = DiskImageCache() if CacheConfig.disk_cache_enabled else None
+        # Optional tier of compressed images evicted from this cache
+        self.compressed_cache : Optional[CompressedImageCache] = None
+        if CacheConfig.compressed_cache_enabled:
+            self.set_compressed_cache(CompressedImageCache(CacheConfig.compressed_cache_level))
+        # Separate pool for prefetching, limited to a few threads to leave the others to displayed images
+        self.prefetch_pool : ThreadPool = ThreadPool()
+        self.prefetch_pool.setMaxThreadCount(max(1, self.thread_pool.maxThreadCount()//4))
+        self.signals : ImageCacheSignals = ImageCacheSignals()
+        # ids pinned by pin_image(), the file key may change before unpin_image()
+        self._pinned_images : Dict[Tuple[str, str], ImageId] = {}
+        gb_stat_cache.add_key_changed_callback(self.file_changed)
+
+    @staticmethod
+    def file_key(filename) -> Optional[FileKey]:
+        """ Key of the file from gb_stat_cache, None if the file does not exist """
+        try:
+            return gb_stat_cache.file_key(gb_stat_cache.abspath(filename))
+        except OSError:
+            return None
+
+    def file_changed(self, previous_key : FileKey) -> None:
+        """ Remove all the resolutions of the previous content of a modified file """
+        for downscale in read_size_downscale.values():
+            self.remove((previous_key, downscale))
+            if self.compressed_cache is not None:
+                self.compressed_cache.remove((previous_key, downscale))
+
+    def set_compressed_cache(self, compressed_cache: Optional[CompressedImageCache]) -> None:
+        """ Set or disable (with None) the tier of compressed evicted images """
+        if self.compressed_cache is not None:
+            gb_memory_governor.unregister(self.compressed_cache)
+        self.compressed_cache = compressed_cache
+        if self.compressed_cache is not None:
+            gb_memory_governor.register(self.compressed_cache, weight=10)
+
+    def on_evicted(self, elements) -> None:
+        """ Keep the evicted images compressed """
+        if self.compressed_cache is None or self.load_count == 0: return
+        # images memory-mapped from the disk cache are cheap to get back
+        elements = [ elt for elt in elements if not isinstance(elt[1].data, np.memmap) and elt[1].pyramid is None ]
+        self.compressed_cache.add_images_async(elements, saved_time=self.load_time/self.load_count)
+
+    def set_disk_cache(self, disk_cache: Optional[DiskImageCache]) -> None:
+        """ Set or disable (with None) the persistent cache of decoded images """
+        self.disk_cache = disk_cache
+
+    def entry_size(self, id: ImageId, value: ViewerImage, extra: float) -> int:
+        # memory-mapped images are charged the size of their mapping: each one keeps its file open and its
+        # pages can fill the memory, they must be evicted like the decoded images
+        if isinstance(value.data, np.memmap):
+            return value.__sizeof__() - value.data.nbytes + mapped_size(value.data)
+        return value.__sizeof__()
+
+    def has_image(self, filename, read_size : Optional[str] = None) -> bool:
+        """ Check if the image is in the cache at the given read_size, or at any resolution if read_size is None """
+        key = ImageCache.file_key(filename)
+        if key is None: return False
+        if read_size is not None:
+            return self.has((key, read_size_downscale[read_size]))
+        return any(self.has((key, downscale)) for downscale in read_size_downscale.values())
+
+    def remove_image(self, filename) -> bool:
+        """ Remove all the resolutions of the image from the cache
+            returns: True if at least one was removed
+        """
+        key = ImageCache.file_key(filename)
+        if key is None: return False
+        removed = [ self.remove((key, downscale)) for downscale in read_size_downscale.values()]
+        return any(removed)
+
+    def pin_image(self, filename, read_size : str = 'full') -> None:
+        """ Prevent the image from being evicted, typically the displayed reference image """
+        key = ImageCache.file_key(filename)
+        if key is None: return
+        id = (key, read_size_downscale[read_size])
+        self._pinned_images[(filename, read_size)] = id
+        self.pin(id)
 
-    def has_image(self, filename):
-        # is it too slow
-        filename = os.path.abspath(filename)
-        return filename in self.cache_list
+    def unpin_image(self, filename, read_size : str = 'full') -> None:
+        id = self._pinned_images.pop((filename, read_size), None)
+        if id is not None:
+            self.unpin(id)
+
+    def get_best_image(self, filename) -> Optional[ViewerImage]:
+        """ Return the highest resolution of the image available in the cache, without reading the file,
+            can be displayed while the requested resolution is being read """
+        key = ImageCache.file_key(filename)
+        if key is None: return None
+        for downscale in sorted(read_size_downscale.values()):
+            image_data = self.search((key, downscale))
+            if image_data is not None:
+                return image_data[1]
+        return None
+
+    @staticmethod
+    def placeholder_image(filename, max_size : int = 512) -> Optional[ViewerImage]:
+        """ Uniform image with the dimensions of the image reduced to at most max_size, displayed
+            while the pyramid of the image is built """
+        info = gb_image_reader.probe(filename, full_read=False)
+        if info is None: return None
+        downscale = 1
+        while max(info.width, info.height) > max_size*downscale:
+            downscale *= 2
+        size = ((info.height+downscale-1)//downscale, (info.width+downscale-1)//downscale)
+        if info.channels == 1:
+            image = ViewerImage(np.full(size, 128, dtype=np.uint8), precision=8, downscale=downscale,
+                                channels=ImageFormat.CH_Y)
+        else:
+            image = ViewerImage(np.full(size + (3,), 128, dtype=np.uint8), precision=8, downscale=downscale,
+                                channels=ImageFormat.CH_RGB)
+        image.set_filename(filename)
+        return image
+
+    @staticmethod
+    def reduce_image(image: ViewerImage, factor: int) -> ViewerImage:
+        """ Compute a lower resolution of the image by area averaging,
+            with the dimensions of a DCT scaled decoding """
+        height, width = image.data.shape[:2]
+        size = ((width+factor-1)//factor, (height+factor-1)//factor)
+        data = cv2.resize(image.data, size, interpolation=cv2.INTER_AREA)
+        if data.ndim < image.data.ndim:
+            # cv2.resize removes the single channel dimension
+            data = data.reshape(data.shape + (1,))
+        res = ViewerImage(data, precision=image.precision, downscale=image.downscale*factor, channels=image.channels)
+        res.set_filename(image.filename)
+        res.pyramid = image.pyramid
+        return res
 
     def get_image(self, filename, read_size='full', verbose=False,
                   use_RGB=True, image_transform=None,
-                  check_size=True):
+                  check_size=True, cold=False):
         """
         :param filename:
         :param show_timing:
+        :param cold: add the image to the cache as least recently used (prefetched image)
         :return: pair image_data, boolean (True is coming from cache)
         """
         start = get_time()
         # Get absolute normalized path
-        filename = os.path.abspath(filename)
-        # print(f"image cache get_image({filename})")
-        image_data = self.search(filename)
-        mtime = os.path.getmtime(filename)
-
-        if image_data is not None:
-            if image_data[2] >= mtime:
-                return image_data[1], True
-            else:
-                # Remove outdated cache element
-                self.cache.remove(image_data)
-                self.cache_list.remove(filename)
-
-        image = gb_image_reader.read(filename, None, read_size, use_RGB=use_RGB, verbose=verbose,
-                                            check_filecache_size=check_size)
-        if image is not None:
+        filename = gb_stat_cache.abspath(filename)
+        key = gb_stat_cache.file_key(filename)
+        mtime = key[3]
+        downscale = read_size_downscale[read_size]
+
+        def reduce_cached_image() -> Optional[ViewerImage]:
+            # Find the closest higher resolution in the cache
+            for finer in sorted(read_size_downscale.values(), reverse=True):
+                if finer >= downscale: continue
+                image_data = self.search((key, finer))
+                # skip the overviews displayed while a pyramid is built
+                if image_data is not None and image_data[1].downscale == finer:
+                    self._print_log(f" ImageCache: computing {read_size} from 1/{finer} resolution")
+                    return ImageCache.reduce_image(image_data[1], downscale//finer)
+            return None
+
+        def read_image() -> Optional[Tuple[ViewerImage, float]]:
+            image = reduce_cached_image()
+            if image is not None:
+                self.set_load_source('reduce')
+                return image, mtime
+            if self.compressed_cache is not None:
+                # already transformed before being evicted
+                image = self.compressed_cache.pop_image((key, downscale))
+                if image is not None:
+                    self.set_load_source('compressed')
+                    return image, mtime
+            if self.disk_cache is not None:
+                image = self.disk_cache.get(filename, read_size, use_RGB)
+                if image is not None:
+                    self.set_load_source('disk')
+                    image.set_filename(filename)
+            if image is None:
+                # Very large images are displayed from their tiled pyramid, and from an overview while it is built
+                pyramid = get_pyramid(filename, lambda: self.pyramid_built(filename, read_size, use_RGB,
+                                                                           image_transform))
+                overview = pyramid is None and is_building_pyramid(filename)
+                self.set_load_source(gb_image_reader.plugin_name(filename) if pyramid is None else 'pyramid')
+                if overview and gb_image_reader.reads_reduced_sizes(filename):
+                    image = gb_image_reader.read(filename, None, '1/8', use_RGB=use_RGB, verbose=verbose,
+                                                 check_filecache_size=check_size)
+                elif overview:
+                    # decoding the image would compete with the pyramid build for the memory
+                    self.set_load_source('placeholder')
+                    image = ImageCache.placeholder_image(filename)
+                elif pyramid is None and CacheConfig.read_backend == 'process':
+                    # this thread waits for a worker process
+                    image = gb_image_reader.read_in_process(filename, read_size, use_RGB=use_RGB, verbose=verbose)
+                else:
+                    image = gb_image_reader.read(filename if pyramid is None else pyramid, None, read_size,
+                                                 use_RGB=use_RGB, verbose=verbose, check_filecache_size=check_size)
+                if image is not None and pyramid is not None:
+                    image.set_filename(filename)
+                if image is None:
+                    print(f"Failed to load image {filename}")
+                    return None
+                if self.disk_cache is not None and pyramid is None and not overview:
+                    self.disk_cache.put(filename, image, read_size, use_RGB)
             if image_transform is not None:
                 image = image_transform(image)
-            self.append(filename, image, extra=mtime, check_size=check_size)
+            if image.downscale < downscale and downscale % image.downscale == 0:
+                # The reader does not support this read_size: keep the decoded resolution too
+                self.append((key, image.downscale), image, mtime, check_size=False, cold=cold)
+                image = ImageCache.reduce_image(image, downscale//image.downscale)
             self._print_log(" get_image after read_image took {0:0.3f} sec.".format(get_time() - start))
-        else:
-            print(f"Failed to load image {filename}")
-            return None, False
-        return image, False
+            return image, mtime
+
+        # An image requested concurrently by several threads is only decoded once
+        return self.get_or_load((key, downscale), read_image, check_size=check_size,
+                                cold=cold)
+
+    def pyramid_built(self, filename, read_size, use_RGB, image_transform) -> None:
+        """ Called in the Qt thread when the pyramid build started by get_image() is over: the overview
+            is replaced by the image read from the pyramid, signals.image_ready is emitted once it is read """
+        self.remove_image(filename)
+        self.add_images_async([filename], read_size, use_RGB=use_RGB, image_transform=image_transform, cancel=False)
 
     def add_image(self, filename, read_size='full', verbose=False,
                   use_RGB=True, image_transform=None,
@@ -77,40 +291,73 @@ class ImageCache(BaseCache[str, ViewerImage, float]):
         data, flag = self.get_image(filename, read_size, verbose, use_RGB, image_transform, check_size=False)
         return data is not None
 
-    def image_added(self, filename):
-        pass
-        # print(f" *** Added image {os.path.basename(filename)} to cache finished")
+    def prefetch_image(self, filename, read_size='full', use_RGB=True) -> bool:
+        """ Read an image in advance if the cache has enough free space, it is added as least recently used
+            so it never evicts other images
+            :return: True if the image is available in the cache
+        """
+        if self.has_image(filename, read_size): return True
+        # Prefetch threads run below the priority of the threads reading displayed images
+        QtCore.QThread.currentThread().setPriority(QtCore.QThread.Priority.LowPriority)
+        # estimate the size of the image from the current elements
+        nb_elts = len(self.cache)
+        if nb_elts>0 and self.free_size() < self.cache_size/nb_elts:
+            self._print_log(f" ImageCache: no space left to prefetch {filename}")
+            return False
+        data, flag = self.get_image(filename, read_size, use_RGB=use_RGB, check_size=False, cold=True)
+        return data is not None
 
-    def add_result(self, r):
-        # print(f"adding {r} to results ")
-        self.add_results.append(r)
+    def prefetch_images(self, filenames, read_size='full', use_RGB=True, cancel=True):
+        """ Read images in advance in background threads, in the given order, at lower priority than
+            add_images(). Prefetch requests that are not started yet are cancelled, unless cancel is False.
+        """
+        if cancel: self.prefetch_pool.cancel('prefetch')
+        for f in filenames:
+            if f is not None and not self.has_image(f, read_size):
+                self.prefetch_pool.submit(self.prefetch_image, f, read_size, use_RGB,
+                                          priority=TaskPriority.PREFETCH, tag='prefetch')
 
     def add_images(self, filenames, read_size='full', verbose=False,
-                   use_RGB=True, image_transform=None):
+                   use_RGB=True, image_transform=None, timeout=2):
+        """ Read the images in parallel threads and wait for them, at most timeout seconds """
         start = get_time()
-        self.add_results = []
-        num_workers = 0
+        futures = []
         for f in filenames:
-            if f is not None and not self.has_image(f):
+            if f is not None and not self.has_image(f, read_size):
                 # print(f" start worker with image {f}")
-                self.thread_pool.set_worker(self.add_image, f, read_size, verbose, use_RGB, image_transform)
-                self.thread_pool.set_worker_callbacks(finished_cb=lambda: self.image_added(f),
-                                                      result_cb=self.add_result)
-                self.thread_pool.start_worker()
-                num_workers += 1
-        wait_time = 0
-        while len(self.add_results) != num_workers and wait_time < 2:
-            # wait 5 ms before checking again
-            #sleep(0.002)
-            self.thread_pool.waitForDone(2)
-            wait_time += 0.002
-        self._print_log(f" ImageCache.add_images() wait_time {wait_time} took {int((get_time()-start)*1000+0.5)} ms;")
-        if num_workers>0:
-            self.thread_pool.clear()
-            # There could be unfinished thread here?
+                futures.append(self.thread_pool.submit(self.add_image, f, read_size, verbose, use_RGB, image_transform,
+                                                       priority=TaskPriority.DISPLAY, tag='display'))
+        # Images not read within timeout will be waited for by get_image()
+        all_done = ThreadPool.wait(futures, timeout=timeout)
+        self._print_log(f" ImageCache.add_images() all done {all_done} took {int((get_time()-start)*1000+0.5)} ms;")
+        if len(futures)>0:
             # It seems that the progress bar must be updated outside the threads
             self.check_size_limit(update_progress=True)
             if gb_image_reader.file_cache is not None:
                 gb_image_reader.file_cache.check_size_limit(update_progress=True)
-        assert len(self.add_results) == num_workers, "Workers left"
-        self._print_log(f" ImageCache.add_images() {num_workers}, {self.add_results} took {int((get_time()-start)*1000+0.5)} ms;")
+        self._print_log(f" ImageCache.add_images() {len(futures)} took {int((get_time()-start)*1000+0.5)} ms;")
+
+    def add_images_async(self, filenames, read_size='full', verbose=False,
+                         use_RGB=True, image_transform=None, cancel=True) -> List[Future]:
+        """ Read the images in parallel threads without waiting for them: signals.image_ready is emitted
+            for each image once it is read. Previous requests not started yet are cancelled, unless cancel
+            is False.
+            :return: futures of the images being read, the other images are already in the cache
+        """
+        if cancel: self.thread_pool.cancel('display')
+        futures = []
+        for f in filenames:
+            if f is not None and not self.has_image(f, read_size):
+                futures.append(self.thread_pool.submit(self.add_image, f, read_size, verbose, use_RGB, image_transform,
+                                                       priority=TaskPriority.DISPLAY, tag='display',
+                                                       result_cb=lambda ok, f=f: self.image_read(f, read_size, ok),
+                                                       error_cb =lambda e,  f=f: self.image_read(f, read_size, False)))
+        return futures
+
+    def image_read(self, filename, read_size, ok : bool) -> None:
+        """ Called in the Qt thread when an image requested by add_images_async() is read """
+        # the progress bar must be updated outside the threads
+        self.check_size_limit(update_progress=True)
+        if gb_image_reader.file_cache is not None:
+            gb_image_reader.file_cache.check_size_limit(update_progress=True)
+        self.signals.image_ready.emit(filename, read_size, ok)
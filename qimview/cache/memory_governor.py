@@ -0,0 +1,111 @@
+import weakref
+import psutil
+from typing import Dict
+from qimview.utils.qt_imports import QtCore
+from .basecache import BaseCache
+from .cache_config import CacheConfig
+
+
+class MemoryGovernor(QtCore.QObject):
+    """
+        Process-wide memory budget shared by the registered caches (FileCache for the compressed bytes,
+        ImageCache for the decoded images).
+
+        The budget is split between the caches according to the time each of them saved since the previous
+        check (hits times the average loading time), so memory goes where it avoids the most work.
+        The available system memory is checked periodically: the budget is reduced before the system
+        runs out of memory (other processes, several viewers open) and increased back up to its maximum
+        when memory is released. The caches evict their least recently used elements when their share
+        decreases, and their memory bars are updated.
+    """
+    def __init__(self):
+        super().__init__()
+        total = psutil.virtual_memory().total
+        self.max_budget    : int   = int(total * CacheConfig.memory_budget)
+        self.min_available : int   = int(total * CacheConfig.memory_min_available)
+        # Never shrink below 5% of the maximal budget
+        self.min_budget    : int   = self.max_budget // 20
+        self.budget        : int   = self.max_budget
+        # Smoothing of the shares between successive checks
+        self.inertia       : float = 0.8
+        # Minimal share of each cache
+        self.min_share     : float = 0.05
+        self.verbose       : bool  = False
+        # weight given at registration, share of the budget of each cache,
+        # and its number of hits at the previous check
+        self._weights  : weakref.WeakKeyDictionary[BaseCache, float] = weakref.WeakKeyDictionary()
+        self._shares   : weakref.WeakKeyDictionary[BaseCache, float] = weakref.WeakKeyDictionary()
+        self._hits     : weakref.WeakKeyDictionary[BaseCache, int]   = weakref.WeakKeyDictionary()
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.update)
+
+    def _print_log(self, message : str) -> None:
+        if self.verbose:
+            print(message)
+
+    def register(self, cache : BaseCache, weight : float) -> None:
+        """ Add a cache to the governor, its initial share of the budget is proportional to weight,
+            must be called from the Qt thread """
+        self._weights[cache] = weight
+        self._hits[cache] = cache.hit_count
+        # restart from the initial shares
+        total = sum(self._weights.values())
+        for c, w in self._weights.items():
+            self._shares[c] = w / total
+        self._apply()
+        if not self._timer.isActive():
+            self._timer.start(int(CacheConfig.memory_check_interval*1000))
+
+    def unregister(self, cache : BaseCache) -> None:
+        self._weights.pop(cache, None)
+        self._shares.pop(cache, None)
+        self._hits.pop(cache, None)
+
+    def used_memory(self) -> int:
+        """ Memory used by all the caches in bytes """
+        return sum(c.cache_size for c in self._shares.keys())
+
+    def _update_budget(self) -> None:
+        available = psutil.virtual_memory().available
+        used = self.used_memory()
+        if available < self.min_available:
+            # release the missing memory
+            self.budget = max(self.min_budget, used - (self.min_available - available))
+            self._print_log(f" MemoryGovernor: low memory, budget reduced to {self.budget/(1024*1024):0.0f} Mb")
+        else:
+            # grow progressively since the caches themselves reduce the available memory
+            self.budget = min(self.max_budget, self.budget + (available - self.min_available)//2)
+
+    def _update_shares(self) -> None:
+        saved : Dict[BaseCache, float] = {}
+        for c in self._shares.keys():
+            hits = self._hits[c]
+            self._hits[c] = c.hit_count
+            saved[c] = (c.hit_count - hits) * c.saved_time_per_hit()
+        total_saved = sum(saved.values())
+        if total_saved == 0: return
+        for c, share in self._shares.items():
+            target = max(self.min_share, saved.get(c, 0) / total_saved)
+            self._shares[c] = self.inertia * share + (1-self.inertia) * target
+        total = sum(self._shares.values())
+        for c in self._shares.keys():
+            self._shares[c] /= total
+
+    def _apply(self) -> None:
+        for c, share in self._shares.items():
+            size = max(1, int(self.budget * share / c.cache_unit))
+            if size != c.max_cache_size:
+                c.set_max_cache_size(size)
+            c.update_progress()
+
+    def update(self) -> None:
+        """ Check the available memory and share the budget between the caches """
+        self._update_budget()
+        self._update_shares()
+        self._apply()
+        self._print_log(" MemoryGovernor: " + ", ".join(f"{c._name} {c.max_cache_size} Mb"
+                                                         for c in self._shares.keys()))
+
+
+# unique instance of MemoryGovernor for the application
+gb_memory_governor = MemoryGovernor()
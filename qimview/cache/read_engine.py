@@ -0,0 +1,191 @@
+"""
+    File reads of FileCache: each file is read with readinto() into a buffer taken from a pool, so that
+    successive reads reuse the same memory instead of allocating a new bytes object per file.
+    The reads run in up to CacheConfig.file_read_max_threads threads, the number of reads in flight
+    is adapted to the storage from the measured throughput: network shares gain from many parallel
+    requests while spinning disks are faster with few.
+"""
+
+import os
+import threading
+from typing import Dict, List
+from qimview.utils.utils import get_time
+from qimview.utils.thread_pool import ThreadPool
+
+# posix_fadvise() is not available on Windows and macOS
+has_fadvise = hasattr(os, 'posix_fadvise')
+
+
+class BufferPool:
+    """ Free buffers by capacity. A buffer is only given back to the pool once no view of it remains,
+        which bytearray tells by refusing to be resized """
+    min_capacity : int = 64*1024
+
+    def __init__(self, max_size : int):
+        # maximal size in bytes of the free buffers kept
+        self.max_size   : int                         = max_size
+        self._free      : Dict[int, List[bytearray]]  = {}
+        self._free_size : int                         = 0
+        self._lock      : threading.Lock              = threading.Lock()
+
+    @staticmethod
+    def capacity(size : int) -> int:
+        """ Size rounded up to 1/8 of its power of 2, so that buffers are reused by files of close sizes
+            and at most 1/8 of each buffer is wasted """
+        step = max(BufferPool.min_capacity, (1 << max(0, size-1).bit_length()) >> 3)
+        return max(1, (size+step-1)//step)*step
+
+    def acquire(self, size : int) -> bytearray:
+        capacity = BufferPool.capacity(size)
+        with self._lock:
+            buffers = self._free.get(capacity)
+            if buffers:
+                self._free_size -= capacity
+                return buffers.pop()
+        return bytearray(capacity)
+
+    @staticmethod
+    def in_use(buffer : bytearray) -> bool:
+        """ True while a view of the buffer exists """
+        try:
+            # shrinking keeps the allocation
+            buffer.append(buffer.pop())
+        except BufferError:
+            return True
+        return False
+
+    def release(self, buffer : bytearray) -> None:
+        """ Keep a buffer that is not used anymore for later reads, if the pool is not full """
+        with self._lock:
+            if self._free_size + len(buffer) > self.max_size: return
+            self._free.setdefault(len(buffer), []).append(buffer)
+            self._free_size += len(buffer)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._free.clear()
+            self._free_size = 0
+
+
+class ReadEngine:
+    """ Reads files into pooled buffers, measures the read throughput and adapts the number of parallel
+        reads (concurrency) by hill climbing: after each measurement period, the concurrency keeps moving in the
+        same direction while the throughput improves, turns back when it drops, and decreases when it
+        does not change, since fewer parallel reads are better for the storage and the other caches.
+    """
+    def __init__(self, max_concurrency : int = 8, adaptive : bool = True, pool_size : int = 128*1024*1024):
+        self.max_concurrency : int        = max(1, max_concurrency)
+        self.adaptive        : bool       = adaptive
+        # number of reads in flight used by the read-ahead
+        self.concurrency     : int        = min(2, self.max_concurrency) if adaptive else self.max_concurrency
+        self.pool            : BufferPool = BufferPool(pool_size)
+        self.thread_pool     : ThreadPool = ThreadPool()
+        self.thread_pool.setMaxThreadCount(self.max_concurrency)
+        # Minimal duration in seconds of a measurement period
+        self.period_duration : float      = 1
+        # Last measured throughput in bytes per second
+        self.throughput      : float      = 0
+        self.verbose         : bool       = False
+        self._direction      : int        = 1
+        self._lock           : threading.Lock = threading.Lock()
+        # current period: bytes and reads done, time spent with at least one read in flight
+        self._bytes          : int        = 0
+        self._reads          : int        = 0
+        self._busy_time      : float      = 0
+        self._active         : int        = 0
+        self._busy_start     : float      = 0
+        # Buffers not used by the cache anymore, that may still be used by a reader or an image
+        self.max_retired     : int        = 256
+        self._retired        : List[bytearray] = []
+
+    def will_need(self, filename : str) -> None:
+        """ Ask the system to start reading the file in the background """
+        if not has_fadvise: return
+        try:
+            fd = os.open(filename, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    def read(self, filename : str) -> memoryview | bytes:
+        """ Content of the file, as a view of a pooled buffer """
+        self._collect_retired()
+        self._read_started()
+        nbytes = 0
+        try:
+            with open(filename, 'rb', buffering=0) as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return b''
+                if has_fadvise:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                view = memoryview(self.pool.acquire(size))
+                while nbytes < size:
+                    n = f.readinto(view[nbytes:size])
+                    if not n: break
+                    nbytes += n
+                return view[:nbytes]
+        finally:
+            self._read_done(nbytes)
+
+    def retire(self, buffer : memoryview) -> None:
+        """ Called when the cache does not use a buffer returned by read() anymore, it goes back to the
+            pool once all its views are released """
+        if isinstance(buffer.obj, bytearray):
+            with self._lock:
+                self._retired.append(buffer.obj)
+
+    def _collect_retired(self) -> None:
+        with self._lock:
+            retired, self._retired = self._retired, []
+        used = []
+        for buffer in retired:
+            if BufferPool.in_use(buffer):
+                used.append(buffer)
+            else:
+                self.pool.release(buffer)
+        with self._lock:
+            # the oldest buffers still in use are left to the garbage collector
+            self._retired = (used + self._retired)[-self.max_retired:]
+
+    def _read_started(self) -> None:
+        with self._lock:
+            if self._active == 0:
+                self._busy_start = get_time()
+            self._active += 1
+
+    def _read_done(self, nbytes : int) -> None:
+        with self._lock:
+            self._active -= 1
+            self._bytes += nbytes
+            self._reads += 1
+            if self._active == 0:
+                self._busy_time += get_time()-self._busy_start
+            busy_time = self._busy_time + (get_time()-self._busy_start if self._active > 0 else 0)
+            # a period covers at least 2 rounds of parallel reads
+            if busy_time < self.period_duration or self._reads < 2*self.concurrency: return
+            throughput = self._bytes/busy_time
+            self._bytes, self._reads, self._busy_time = 0, 0, 0
+            if self._active > 0:
+                self._busy_start = get_time()
+            self._adapt(throughput)
+
+    def _adapt(self, throughput : float) -> None:
+        previous = self.throughput
+        self.throughput = throughput
+        if not self.adaptive: return
+        if previous > 0:
+            if throughput < previous*0.95:
+                self._direction = -self._direction
+            elif throughput < previous*1.05:
+                self._direction = -1
+        concurrency = max(1, min(self.max_concurrency, self.concurrency+self._direction))
+        if concurrency == self.concurrency:
+            # at a bound, probe the other direction next time
+            self._direction = -self._direction
+        self.concurrency = concurrency
+        if self.verbose:
+            print(f" ReadEngine: {throughput/(1024*1024):0.1f} Mb/s, concurrency {self.concurrency}")
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+from qimview.utils.qt_imports import QtCore, Signal, Slot
+from .cache_config import CacheConfig
+
+# Identity of a file content: device, inode (or absolute path if the file system has no inodes), size
+# and modification time. Paths reaching the same file through symbolic or hard links have the same key.
+FileKey = Tuple[int, Union[int, str], int, float]
+
+
+def stat_key(filename : str) -> FileKey:
+    """ Key of a file from os.stat(), raises OSError if the file does not exist """
+    st = os.stat(filename)
+    return (st.st_dev, st.st_ino if st.st_ino else filename, st.st_size, st.st_mtime)
+
+
+def has_qt_application() -> bool:
+    """ The file system watcher only receives notifications once the Qt application exists """
+    return QtCore.QCoreApplication.instance() is not None
+
+
+class StatCache(QtCore.QObject):
+    """
+        Cache of normalized paths and file keys (device, inode, size, modification time) shared by
+        FileCache and ImageCache, so that a cache hit does not need any system call (each stat is a round
+        trip on network drives). The caches are indexed by file key, so the paths aliased by symbolic or
+        hard links share the same file buffer and decoded images.
+
+        A file key is kept until the file changes on disk, detected either
+            - by a QFileSystemWatcher (inotify on Linux), which needs a running Qt event loop: it is
+              created with the first key cached once the Qt application exists, and the files are polled
+              until then. Files that cannot be watched (inotify limit reached) are not cached.
+            - or by a thread polling the cached files, which also detects changes made from other
+              hosts on network drives
+        depending on CacheConfig.stat_cache_mode ('watcher', 'polling' or 'none' to disable the cache).
+        When the key read for a path differs from the previous one, the callbacks added by
+        add_key_changed_callback() are called with the previous key, so that the caches free its elements.
+    """
+    # Emitted from any thread, processed in the thread owning the watcher
+    _watch_requested = Signal(str)
+
+    def __init__(self, mode : Optional[str] = None, poll_interval : Optional[float] = None):
+        super().__init__()
+        self._mode          : str                = mode if mode else CacheConfig.stat_cache_mode
+        self._poll_interval : float              = poll_interval if poll_interval else \
+                                                   CacheConfig.stat_cache_poll_interval
+        self._abspaths      : Dict[str, str]     = {}
+        # Alias table: file key of each absolute path
+        self._keys          : Dict[str, FileKey] = {}
+        # Last key returned for each path, kept when the key is invalidated to detect its change
+        self._last_keys     : Dict[str, FileKey] = {}
+        self._key_changed_callbacks : List[weakref.WeakMethod] = []
+        self._lock          : threading.Lock     = threading.Lock()
+        self.verbose        : bool               = False
+        self._watcher       : Optional[QtCore.QFileSystemWatcher] = None
+        self._poll_thread   : Optional[threading.Thread] = None
+        # Files watched, and files that the watcher failed to watch, whose key is read at each call
+        self._watched       : Set[str]           = set()
+        self._unwatched     : Set[str]           = set()
+        if self._mode == 'watcher':
+            self._watch_requested.connect(self._add_watch)
+        elif self._mode == 'polling':
+            self._start_polling()
+
+    def add_key_changed_callback(self, callback : Callable[[FileKey], None]) -> None:
+        """ callback is a method called with the previous key of a file that changed on disk,
+            from the thread that read the new key; only a weak reference to its object is kept """
+        with self._lock:
+            self._key_changed_callbacks.append(weakref.WeakMethod(callback))
+
+    def _key_read(self, filename : str, key : FileKey) -> None:
+        """ Call the callbacks if the key of the file changed """
+        with self._lock:
+            previous = self._last_keys.get(filename, None)
+            self._last_keys[filename] = key
+            if previous is None or previous == key: return
+            callbacks = [ ref() for ref in self._key_changed_callbacks ]
+            self._key_changed_callbacks = [ ref for ref, cb in zip(self._key_changed_callbacks, callbacks)
+                                            if cb is not None ]
+        self._print_log(f" StatCache: key of {filename} changed")
+        for callback in callbacks:
+            if callback is not None:
+                callback(previous)
+
+    def _start_polling(self) -> None:
+        with self._lock:
+            if self._poll_thread is not None: return
+            self._poll_thread = threading.Thread(target=self._poll, name="StatCache polling", daemon=True)
+        self._poll_thread.start()
+
+    def _print_log(self, message : str) -> None:
+        if self.verbose:
+            print(message)
+
+    def abspath(self, filename : str) -> str:
+        """ Cached os.path.abspath(), relative paths are resolved from the current directory at first call """
+        res = self._abspaths.get(filename, None)
+        if res is None:
+            res = os.path.abspath(filename)
+            with self._lock:
+                self._abspaths[filename] = res
+        return res
+
+    def file_key(self, filename : str) -> FileKey:
+        """ Cached key of the file, raises OSError if the file does not exist
+            :param filename: absolute path, as returned by abspath()
+        """
+        if self._mode == 'none' or filename in self._unwatched:
+            key = stat_key(filename)
+            self._key_read(filename, key)
+            return key
+        key = self._keys.get(filename, None)
+        if key is None:
+            key = stat_key(filename)
+            self._key_read(filename, key)
+            with self._lock:
+                self._keys[filename] = key
+            if self._mode == 'watcher':
+                if has_qt_application():
+                    self._watch_requested.emit(filename)
+                else:
+                    self._start_polling()
+        return key
+
+    def getmtime(self, filename : str) -> float:
+        """ Cached os.path.getmtime(), raises OSError if the file does not exist
+            :param filename: absolute path, as returned by abspath()
+        """
+        return self.file_key(filename)[3]
+
+    def aliases(self, key : FileKey) -> List[str]:
+        """ Known paths of the file with the given key """
+        with self._lock:
+            return [ filename for filename, k in self._keys.items() if k == key ]
+
+    def _create_watcher(self) -> None:
+        """ Called in the thread of the Qt application, the files cached before are watched as well
+            and the polling thread stops """
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self.invalidate)
+        with self._lock:
+            filenames = list(self._keys)
+        for filename in filenames:
+            self._add_watch(filename)
+
+    @Slot(str)
+    def _add_watch(self, filename : str) -> None:
+        if self._watcher is None:
+            self._create_watcher()
+        if filename in self._keys and filename not in self._watched:
+            if self._watcher.addPath(filename):
+                self._watched.add(filename)
+            else:
+                self._print_log(f" StatCache: cannot watch {filename}, its key is read at each access")
+                with self._lock:
+                    self._unwatched.add(filename)
+                    self._keys.pop(filename, None)
+
+    @Slot(str)
+    def invalidate(self, filename : str) -> None:
+        """ Forget the key of a file, the next call to file_key() reads it from disk """
+        self._print_log(f" StatCache: {filename} changed")
+        with self._lock:
+            self._keys.pop(filename, None)
+        # The watcher stops watching removed or replaced files, they are watched again by the next file_key()
+        if self._watcher is not None and filename in self._watched:
+            self._watched.discard(filename)
+            self._watcher.removePath(filename)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._abspaths.clear()
+            self._keys.clear()
+            self._last_keys.clear()
+            self._unwatched.clear()
+        if self._watcher is not None and len(self._watched)>0:
+            self._watcher.removePaths(list(self._watched))
+            self._watched.clear()
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(self._poll_interval)
+            # in watcher mode, the files are only polled until the watcher is created
+            if self._watcher is not None: return
+            with self._lock:
+                keys = list(self._keys.items())
+            for filename, key in keys:
+                try:
+                    changed = stat_key(filename) != key
+                except OSError:
+                    changed = True
+                if changed:
+                    self.invalidate(filename)
+
+
+# unique instance of StatCache for the application
+gb_stat_cache = StatCache()
@@ -0,0 +1,132 @@
+import os
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from qimview.utils.thread_pool import ThreadPool, TaskPriority
+from qimview.image_readers import gb_image_reader
+from qimview.image_readers.pyramid import PyramidImage, build_pyramid
+from .basecache import BaseCache
+from .cache_config import CacheConfig
+from .memory_governor import gb_memory_governor
+
+# Tile id: pyramid filename, level, tile column and row
+TileId = Tuple[str, int, int, int]
+
+
+class TileCache(BaseCache[TileId, np.ndarray, None]):
+    """
+        Least recently used tiles of the pyramids of very large images, so that zooming and panning only
+        read the tiles of the displayed region that are not already in memory.
+    """
+    def __init__(self):
+        BaseCache.__init__(self, "TileCache")
+        gb_memory_governor.register(self, weight=5)
+        self.verbose : bool = False
+
+    def entry_size(self, id: TileId, value: np.ndarray, extra: None) -> int:
+        return value.nbytes
+
+    def get_tile(self, pyramid : PyramidImage, level : int, tx : int, ty : int) -> np.ndarray:
+        def load():
+            self.set_load_source('pyramid')
+            return pyramid.read_tile(level, tx, ty), None
+        tile, _ = self.get_or_load((pyramid.filename, level, tx, ty), load)
+        return tile
+
+
+def pyramid_filename(filename : str) -> str:
+    """ Pyramid file of an image in CacheConfig.pyramid_dir, the name depends on the path, size and modification
+        time of the image so that a modified image gets a new pyramid """
+    st = os.stat(filename)
+    key = hashlib.sha1(f"{os.path.abspath(filename)}|{st.st_size}|{st.st_mtime}".encode()).hexdigest()
+    return os.path.join(os.path.expanduser(CacheConfig.pyramid_dir), key + '.qpyr')
+
+
+class PyramidBuilder:
+    """ Builds the pyramids in a background thread, one at a time since each build decodes a very large image """
+    def __init__(self):
+        self.thread_pool : ThreadPool = ThreadPool()
+        self.thread_pool.setMaxThreadCount(1)
+        # callbacks of the pyramids being built, by pyramid file
+        self._building : Dict[str, List[Callable[[], None]]] = {}
+        # pyramid files that could not be built
+        self._failed   : Set[str] = set()
+        self._lock     : threading.Lock = threading.Lock()
+
+    def is_building(self, output : str) -> bool:
+        with self._lock:
+            return output in self._building
+
+    def has_failed(self, output : str) -> bool:
+        with self._lock:
+            return output in self._failed
+
+    def build(self, filename : str, output : str, finished_cb : Optional[Callable[[], None]] = None) -> None:
+        """ Start building the pyramid if it is not being built, finished_cb is called in the Qt thread
+            once the build is over, whether it succeeded or not """
+        with self._lock:
+            callbacks = self._building.get(output)
+            started = callbacks is not None
+            if not started:
+                callbacks = self._building[output] = []
+            if finished_cb is not None:
+                callbacks.append(finished_cb)
+        if started: return
+        self.thread_pool.submit(self._build, filename, output, priority=TaskPriority.BACKGROUND, tag='pyramid',
+                                finished_cb=lambda: self._finished(output))
+
+    def _build(self, filename : str, output : str) -> None:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        ok = False
+        try:
+            ok = build_pyramid(filename, output, CacheConfig.pyramid_tile_size)
+        except Exception as e:
+            print(f"Failed to build the pyramid of {filename}: {e}")
+        if not ok:
+            with self._lock:
+                self._failed.add(output)
+
+    def _finished(self, output : str) -> None:
+        with self._lock:
+            callbacks = self._building.pop(output, [])
+        for cb in callbacks:
+            cb()
+
+
+def needs_pyramid(filename : str) -> bool:
+    """ Check if the image size is above CacheConfig.pyramid_min_size """
+    if CacheConfig.pyramid_min_size <= 0 or os.path.splitext(filename)[1].upper() == '.QPYR': return False
+    # probing other formats would decode the image
+    if not gb_image_reader.has_probe(filename): return False
+    info = gb_image_reader.probe(filename, full_read=False)
+    return info is not None and info.width*info.height >= CacheConfig.pyramid_min_size*1e6
+
+
+def get_pyramid(filename : str, finished_cb : Optional[Callable[[], None]] = None) -> Optional[str]:
+    """ Pyramid file of the image if it is already built, otherwise its build is started in background
+        for images above CacheConfig.pyramid_min_size
+        :param finished_cb: called in the Qt thread when the build started or continued by this call is over
+        :return: None if the pyramid is not available yet, or if the image is small enough to be read directly
+    """
+    if not needs_pyramid(filename): return None
+    output = pyramid_filename(filename)
+    if os.path.isfile(output): return output
+    if not gb_pyramid_builder.has_failed(output):
+        gb_pyramid_builder.build(filename, output, finished_cb)
+    return None
+
+
+def is_building_pyramid(filename : str) -> bool:
+    """ Check if the pyramid of the image is being built """
+    try:
+        return gb_pyramid_builder.is_building(pyramid_filename(filename))
+    except OSError:
+        return False
+
+
+# unique instance of TileCache for the application, used by all the pyramids
+gb_tile_cache = TileCache()
+PyramidImage.tile_cache = gb_tile_cache
+# unique instance of PyramidBuilder, created in the Qt thread which runs its callbacks
+gb_pyramid_builder = PyramidBuilder()
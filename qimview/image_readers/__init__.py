@@ -1,4 +1,5 @@
 
 from .image_reader import gb_image_reader
+from .image_probe import ImageInfo
 
-__all__ = ['gb_image_reader']
+__all__ = ['gb_image_reader', 'ImageInfo']
@@ -0,0 +1,128 @@
+"""
+    Header-only probing of images: dimensions, channels and bit depth without decoding the pixels.
+    Probe functions have the signature (image_filename, image_buffer) like the readers, image_buffer
+    may be None, and return an ImageInfo or None if the header cannot be parsed.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Number of bytes read from the file to parse a header, large enough for JPEG EXIF segments
+header_read_size = 128*1024
+
+read_size_downscale = {'full': 1, '1/2': 2, '1/4': 4, '1/8': 8}
+
+
+@dataclass
+class ImageInfo:
+    """ Image properties given by the file header """
+    width        : int
+    height       : int
+    # Number of channels and bits per channel in the file
+    channels     : int
+    precision    : int
+    # Estimated size in bytes of the image decoded by the default reader at full resolution
+    decoded_size : int
+
+    def decoded_size_at(self, read_size : str = 'full') -> int:
+        """ Estimated decoded size in bytes at the given read_size """
+        downscale = read_size_downscale[read_size]
+        return self.decoded_size // (downscale*downscale)
+
+
+def read_header(image_filename : str, image_buffer, size : int = header_read_size) -> bytes:
+    """ First bytes of the file, from the buffer if available """
+    if image_buffer is not None:
+        return bytes(image_buffer[:size])
+    with open(image_filename, 'rb') as f:
+        return f.read(size)
+
+
+def opencv_decoded_size(width : int, height : int) -> int:
+    # OpenCV and JPEG readers return 8-bit colour images
+    return width*height*3
+
+
+def probe_jpeg(image_filename, image_buffer) -> Optional[ImageInfo]:
+    """ Parse the JPEG markers up to the start of frame """
+    data = read_header(image_filename, image_buffer)
+    if data[:2] != b'\xff\xd8': return None
+    pos = 2
+    while pos+4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos+1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        length = struct.unpack('>H', data[pos+2:pos+4])[0]
+        # Start of frame markers, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if pos+10 > len(data): return None
+            precision, height, width, channels = struct.unpack('>BHHB', data[pos+4:pos+10])
+            return ImageInfo(width, height, channels, precision, opencv_decoded_size(width, height))
+        pos += 2 + length
+    return None
+
+
+# Number of channels of each PNG colour type
+png_channels = { 0: 1, 2: 3, 3: 3, 4: 2, 6: 4 }
+
+
+def probe_png(image_filename, image_buffer) -> Optional[ImageInfo]:
+    """ Parse the IHDR chunk """
+    data = read_header(image_filename, image_buffer, 32)
+    if data[:8] != b'\x89PNG\r\n\x1a\n' or data[12:16] != b'IHDR': return None
+    width, height, depth, color_type = struct.unpack('>IIBB', data[16:26])
+    # palette images have 8-bit colours
+    precision = 8 if color_type == 3 else depth
+    return ImageInfo(width, height, png_channels.get(color_type, 3), precision, opencv_decoded_size(width, height))
+
+
+# Size in bytes of the TIFF field types BYTE, ASCII, SHORT, LONG, RATIONAL
+tiff_type_size = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8 }
+
+
+def parse_tiff_ifd(image_filename, image_buffer) -> Optional[Tuple[str, Dict[int, List[int]]]]:
+    """ Parse the first image file directory of a TIFF file, reading only the needed bytes
+        :return: byte order for struct ('<' or '>') and the integer values of each tag
+    """
+    data = read_header(image_filename, image_buffer)
+    if data[:4] == b'II*\x00':   endian = '<'
+    elif data[:4] == b'MM\x00*': endian = '>'
+    else: return None
+
+    def read_at(offset : int, size : int) -> bytes:
+        # the directory and the tag values may be at the end of the file
+        if offset+size <= len(data): return data[offset:offset+size]
+        if image_buffer is not None: return bytes(image_buffer[offset:offset+size])
+        with open(image_filename, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    offset = struct.unpack(endian+'I', data[4:8])[0]
+    nb_entries = struct.unpack(endian+'H', read_at(offset, 2))[0]
+    directory = read_at(offset+2, 12*nb_entries)
+    formats = { 1: 'B', 3: 'H', 4: 'I' }
+    tags : Dict[int, List[int]] = {}
+    for n in range(len(directory)//12):
+        entry = directory[12*n : 12*n+12]
+        tag, type_, count = struct.unpack(endian+'HHI', entry[:8])
+        if type_ not in formats: continue
+        size = tiff_type_size[type_]*count
+        # values that do not fit in 4 bytes are stored at an offset
+        values = entry[8:8+size] if size <= 4 else read_at(struct.unpack(endian+'I', entry[8:12])[0], size)
+        tags[tag] = list(struct.unpack(f"{endian}{count}{formats[type_]}", values))
+    return endian, tags
+
+
+def probe_tiff(image_filename, image_buffer) -> Optional[ImageInfo]:
+    """ Parse the tags of the first image file directory """
+    res = parse_tiff_ifd(image_filename, image_buffer)
+    if res is None: return None
+    tags = res[1]
+    if 256 not in tags or 257 not in tags: return None
+    width, height = tags[256][0], tags[257][0]
+    return ImageInfo(width, height, tags.get(277, [1])[0], tags.get(258, [1])[0], opencv_decoded_size(width, height))
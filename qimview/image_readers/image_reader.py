@@ -1,10 +1,18 @@
 from qimview.utils.viewer_image import *
+import itertools
 import os
-from .libraw_reader import libraw_supported_formats, read_libraw, has_rawpy
-from .turbojpeg_reader import read_jpeg_turbojpeg, gb_turbo_jpeg, has_turbojpeg
-from .simplejpeg_reader import read_jpeg_simplejpeg, has_simplejpeg
+from .libraw_reader import libraw_supported_formats, read_libraw, read_libraw_preview, probe_libraw, has_rawpy
+from .turbojpeg_reader import read_jpeg_turbojpeg, probe_jpeg_turbojpeg, read_jpeg_roi_turbojpeg, gb_turbo_jpeg, \
+                              has_turbojpeg
+from .tiff_reader import read_tiff_roi, is_tiled_tiff, Rect
+from .pyramid import read_pyramid, probe_pyramid
+from .memmap_reader import memmap_readers, probe_memmap
+from .process_reader import ProcessReader, attach_shared
+from .reader_calibration import gb_backend_ranking
 from .opencv_reader import read_opencv, opencv_supported_formats
-from typing import Optional, TYPE_CHECKING
+from .image_probe import ImageInfo, probe_jpeg, probe_png, probe_tiff
+from qimview.utils.thread_pool import ThreadPool, TaskPriority
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 # Avoid circular imports
 # Imports specific for type checking
@@ -12,18 +20,18 @@ if TYPE_CHECKING:
     from qimview.cache import FileCache
 
 def read_jpeg(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False):
-    # in terms of speed, it seems that turbojpeg is faster than simplejpeg which is faster than cv2
-    # so turbojpeg > simplejpeg > cv2
-    verbose = True
-    im1 = im2 = im3 = None
+    # backends from the fastest measured by reader_calibration, by default turbojpeg > simplejpeg > cv2
+    for name, reader in gb_backend_ranking.backends('jpeg', read_size):
+        image = reader(image_filename, image_buffer, read_size, use_RGB, verbose)
+        if image is not None: return image
+    return None
+
+
+def probe_jpeg_header(image_filename, image_buffer) -> Optional[ImageInfo]:
     if gb_turbo_jpeg and has_turbojpeg:
-        im1 = read_jpeg_turbojpeg(image_filename, image_buffer, read_size=read_size, use_RGB=use_RGB, verbose=verbose)
-    if im1 is not None: return im1
-    if read_size == 'full' and has_simplejpeg:
-        im2 = read_jpeg_simplejpeg(image_filename, image_buffer, read_size, use_RGB, verbose)
-    if im2 is not None: return im2
-    im3 = read_opencv(image_filename, image_buffer, read_size, use_RGB, verbose)
-    return im3
+        info = probe_jpeg_turbojpeg(image_filename, image_buffer)
+        if info is not None: return info
+    return probe_jpeg(image_filename, image_buffer)
 
 
 class ImageReader:
@@ -38,42 +46,293 @@ class ImageReader:
             for ext in libraw_supported_formats():
                 if ext.upper() not in self._plugins:
                     self._plugins[ext.upper()] = read_libraw
+        # tiled pyramids are memory-mapped, they are not read through the file cache
+        self._plugins[".QPYR"] = read_pyramid
+        self._no_file_cache = { ".QPYR" }
+        # uncompressed formats are memory-mapped as well
+        for ext, callback in memmap_readers.items():
+            self._plugins[ext] = callback
+            self._no_file_cache.add(ext)
+        # formats decoded at reduced read sizes without decoding the full image: JPEG by DCT scaling,
+        # pyramid levels and strided views of the memory-mapped formats
+        self._reduced_size_plugins = { ".JPG", ".JPEG", ".QPYR" } | set(memmap_readers)
         # add all opencv supposedly supported extensions
         for ext in opencv_supported_formats():
             if ext.upper() not in self._plugins:
                 self._plugins[ext.upper()] = read_opencv
+        # header-only probes, other formats are probed by reading the image
+        self._probes = {
+            ".JPG":probe_jpeg_header,
+            ".JPEG":probe_jpeg_header,
+            ".PNG":probe_png,
+            ".TIF":probe_tiff,
+            ".TIFF":probe_tiff,
+            ".QPYR":probe_pyramid,
+        }
+        for ext in memmap_readers:
+            self._probes[ext] = probe_memmap
+        if has_rawpy:
+            for ext in libraw_supported_formats():
+                self._probes[ext.upper()] = probe_libraw
+        # region of interest readers: (check, read, whole_file), check tells if a file supports it,
+        # whole_file if the reader needs the content of the whole file
+        self._roi_plugins = {
+            ".TIF":(is_tiled_tiff, read_tiff_roi, False),
+            ".TIFF":(is_tiled_tiff, read_tiff_roi, False),
+        }
+        if gb_turbo_jpeg and has_turbojpeg:
+            for ext in [".JPG", ".JPEG"]:
+                # the JPEG is cropped from its whole entropy-coded data
+                self._roi_plugins[ext] = (None, read_jpeg_roi_turbojpeg, True)
+        # fast previews displayed while the image is read, like the thumbnails embedded in raw files
+        self._preview_plugins = {}
+        if has_rawpy:
+            for ext in libraw_supported_formats():
+                self._preview_plugins[ext.upper()] = read_libraw_preview
+        # result of the roi check of each file
+        self._roi_support : Dict[str, bool] = {}
         self.file_cache : Optional[FileCache] = None
+        self._probe_pool : Optional[ThreadPool] = None
+        self._read_pool  : Optional[ThreadPool] = None
+        self._read_many_calls : Iterator[int] = itertools.count()
+        self._process_reader : ProcessReader = ProcessReader()
 
     def extensions(self):
         return list(self._plugins.keys())
 
+    def plugin_name(self, filename) -> str:
+        """ Name of the reader function used for this file """
+        extension = os.path.splitext(filename)[1].upper()
+        if extension not in self._plugins: return 'unsupported'
+        return getattr(self._plugins[extension], '__name__', 'plugin')
+
     def set_file_cache(self, file_cache):
         self.file_cache = file_cache
+        if file_cache is not None:
+            # shared set, so that the plugins set later are taken into account
+            file_cache.skipped_extensions = self._no_file_cache
 
-    def set_plugin(self, extensions, callback):
+    def set_plugin(self, extensions, callback, use_file_cache=True, reduced_sizes=False):
         """ Set support to a image format based on list of extensions and callback
 
         Args:
             extensions ([type]): [description]
             callback (function): callback has signature (image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False) 
             and returns a ViewerImage object
+            use_file_cache (bool): if False, the callback reads the file itself (image_buffer is None)
+            reduced_sizes (bool): True if the callback decodes the reduced read sizes without decoding the full image
         """
         for ext in extensions:
             self._plugins[ext.upper()] = callback
+            if reduced_sizes:
+                self._reduced_size_plugins.add(ext.upper())
+            else:
+                self._reduced_size_plugins.discard(ext.upper())
+            if use_file_cache:
+                self._no_file_cache.discard(ext.upper())
+            else:
+                self._no_file_cache.add(ext.upper())
+
+    def set_probe_plugin(self, extensions, callback):
+        """ Set a header-only probe for a list of extensions,
+            callback has signature (image_filename, image_buffer) and returns an ImageInfo or None
+        """
+        for ext in extensions:
+            self._probes[ext.upper()] = callback
+
+    def set_roi_plugin(self, extensions, callback, check=None, whole_file=False):
+        """ Set support to region of interest reading for a list of extensions
+            callback has signature (image_filename, image_buffer, roi, use_RGB=True) with roi as
+            (x, y, width, height) and returns a pair (ViewerImage, rectangle of the image) or None,
+            check is an optional callback (image_filename) -> bool telling if the file supports it,
+            whole_file tells if the callback needs the content of the whole file, otherwise it gets a buffer
+            only if the file is already in the file cache and reads the parts it needs from the file
+        """
+        for ext in extensions:
+            self._roi_plugins[ext.upper()] = (check, callback, whole_file)
+
+    def set_preview_plugin(self, extensions, callback):
+        """ Set a fast preview reader for a list of extensions, callback has signature
+            (image_filename, image_buffer, use_RGB=True) and returns a ViewerImage or None
+        """
+        for ext in extensions:
+            self._preview_plugins[ext.upper()] = callback
+
+    def has_preview(self, filename) -> bool:
+        return os.path.splitext(filename)[1].upper() in self._preview_plugins
+
+    def read_preview(self, filename, use_RGB=True) -> Optional[ViewerImage]:
+        """ Fast low quality version of the image, to display while the image is read,
+            None if not available """
+        extension = os.path.splitext(filename)[1].upper()
+        if extension not in self._preview_plugins: return None
+        buffer = None
+        try:
+            if self.file_cache is not None and extension not in self._no_file_cache and \
+                    self.file_cache.has_file(filename):
+                buffer, _ = self.file_cache.get_file(filename)
+            return self._preview_plugins[extension](filename, buffer, use_RGB)
+        except Exception as e:
+            print(f"Exception while reading preview of {filename}: {e}")
+            return None
+
+    def reads_reduced_sizes(self, filename) -> bool:
+        """ Check if reading the image at a reduced read_size is cheaper than decoding it at full resolution """
+        return os.path.splitext(filename)[1].upper() in self._reduced_size_plugins
+
+    def has_probe(self, filename) -> bool:
+        """ Check if the image dimensions can be obtained from its header only """
+        return os.path.splitext(filename)[1].upper() in self._probes
+
+    def supports_roi(self, filename) -> bool:
+        """ Check if a region of the image can be decoded without decoding the full image """
+        extension = os.path.splitext(filename)[1].upper()
+        if extension not in self._roi_plugins: return False
+        check = self._roi_plugins[extension][0]
+        if check is None: return True
+        if filename not in self._roi_support:
+            try:
+                self._roi_support[filename] = check(filename)
+            except Exception as e:
+                self._roi_support[filename] = False
+        return self._roi_support[filename]
+
+    def roi_reads_whole_file(self, filename) -> bool:
+        """ Check if decoding a region needs the content of the whole file """
+        extension = os.path.splitext(filename)[1].upper()
+        return extension in self._roi_plugins and self._roi_plugins[extension][2]
+
+    def read_roi(self, filename, roi : Rect, use_RGB=True, buffer=None) -> Optional[Tuple[ViewerImage, Rect]]:
+        """ Decode at full resolution the region roi (x, y, width, height) of the image
+            :param buffer: content of the file, otherwise it is taken from the file cache when the reader needs
+                the whole file, when the file is memory-mapped or already cached
+            :return: image of a region that contains roi, aligned on the blocks or tiles of the file,
+                and its rectangle; None if not supported
+        """
+        extension = os.path.splitext(filename)[1].upper()
+        if extension not in self._roi_plugins: return None
+        fromcache = None
+        try:
+            if buffer is None and self.file_cache is not None and extension not in self._no_file_cache and \
+                    (self._roi_plugins[extension][2] or self.file_cache.use_mmap or self.file_cache.has_file(filename)):
+                # the regions of a JPEG are decoded from a single read of the file, the tiles of a TIFF
+                # are read from the file unless it is already in memory
+                buffer, fromcache = self.file_cache.get_file(filename)
+            res = self._roi_plugins[extension][1](filename, buffer, roi, use_RGB)
+            if fromcache is not None:
+                self.file_cache.buffer_used(filename)
+            if res is not None:
+                res[0].set_filename(filename)
+            return res
+        except Exception as e:
+            print(f"Exception while reading region {roi} of image {filename}: {e}")
+            return None
+
+    def probe(self, filename, buffer=None, full_read : bool = True) -> Optional[ImageInfo]:
+        """ Get the image dimensions, channels, precision and estimated decoded size from the file header,
+            without decoding the image. Formats without probe are read at full resolution.
+            :param full_read: if False, return None instead of reading the image when the header cannot be probed
+        """
+        extension = os.path.splitext(filename)[1].upper()
+        if extension not in self._plugins: return None
+        try:
+            if buffer is None and self.file_cache is not None and extension not in self._no_file_cache and \
+                    self.file_cache.has_file(filename):
+                buffer, _ = self.file_cache.get_file(filename)
+            if extension in self._probes:
+                info = self._probes[extension](filename, buffer)
+                if info is not None: return info
+        except Exception as e:
+            print(f"Exception while probing image {filename}: {e}")
+        if not full_read: return None
+        image = self.read(filename, buffer)
+        if image is None: return None
+        height, width = image.data.shape[:2]
+        channels = image.data.shape[2] if image.data.ndim > 2 else 1
+        return ImageInfo(width, height, channels, image.precision, image.data.nbytes)
+
+    def probe_files(self, filenames : List[str], timeout : Optional[float] = None) -> Dict[str, Optional[ImageInfo]]:
+        """ Probe files in parallel threads, None for the files that cannot be probed """
+        if self._probe_pool is None:
+            self._probe_pool = ThreadPool()
+        futures = { f: self._probe_pool.submit(self.probe, f, priority=TaskPriority.PREFETCH, tag='probe')
+                    for f in filenames }
+        ThreadPool.wait(list(futures.values()), timeout=timeout)
+        return { f: future.result() if future.done() and future.exception() is None else None
+                 for f, future in futures.items() }
+
+    def probe_directory(self, folder : str, timeout : Optional[float] = None) -> Dict[str, Optional[ImageInfo]]:
+        """ Probe in parallel all the supported images of a folder """
+        filenames = [ os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                      if os.path.splitext(f)[1].upper() in self._plugins ]
+        return self.probe_files(filenames, timeout)
+
+    def supports_process(self, filename) -> bool:
+        """ Check if the image can be decoded in a worker process: memory-mapped formats are not """
+        extension = os.path.splitext(filename)[1].upper()
+        return extension in self._plugins and extension not in self._no_file_cache
+
+    def read_in_process(self, filename, read_size='full', use_RGB=True, verbose=False) -> Optional[ViewerImage]:
+        """ Decode the image in a worker process and wait for it, to call from a thread.
+            The worker reads the file itself, without the file cache. Images that cannot be decoded in a
+            process, including plugins that cannot be pickled (lambdas, closures), are read in this thread.
+        """
+        if not self.supports_process(filename):
+            return self.read(filename, None, read_size, use_RGB, verbose)
+        extension = os.path.splitext(filename)[1].upper()
+        try:
+            shared = self._process_reader.submit(self._plugins[extension], filename, read_size, use_RGB,
+                                                 verbose).result()
+        except Exception as e:
+            print(f"Failed to read image {filename} in a process ({e}), reading it in this thread")
+            return self.read(filename, None, read_size, use_RGB, verbose)
+        if shared is None: return None
+        image = attach_shared(shared)
+        image.set_filename(filename)
+        return image
+
+    def read_many(self, filenames : List[str], read_size='full', use_RGB=True, backend : str = 'thread',
+                  timeout : Optional[float] = None) -> Dict[str, Optional[ViewerImage]]:
+        """ Decode several images in parallel and wait for them, at most timeout seconds
+            :param backend: 'thread' decodes in threads, 'process' in worker processes so that decoders
+                holding the GIL scale with the number of cores
+            :return: image of each filename, None if it failed or is not done within timeout; the decodes not
+                started within timeout are cancelled
+        """
+        if backend not in ('thread', 'process'):
+            raise ValueError(f"Unknown backend {backend}, use 'thread' or 'process'")
+        if self._read_pool is None:
+            self._read_pool = ThreadPool()
+        read = self.read_in_process if backend == 'process' else self.read
+        # own tag, so that the decodes of other calls are not cancelled
+        tag = ('read_many', next(self._read_many_calls))
+        # threads only wait for the worker processes with the process backend
+        futures = { f: self._read_pool.submit(read, f, read_size=read_size, use_RGB=use_RGB, tag=tag)
+                    for f in dict.fromkeys(filenames) }
+        ThreadPool.wait(list(futures.values()), timeout=timeout)
+        self._read_pool.cancel(tag)
+        return { f: future.result() if future.done() and not future.cancelled() and future.exception() is None
+                    else None for f, future in futures.items() }
 
-    def read(self, filename, buffer=None, read_size='full', use_RGB=True, verbose=False, check_filecache_size=True):
+    def read(self, filename, buffer=None, read_size='full', use_RGB=True, verbose=False, check_filecache_size=True,
+             use_file_cache=True):
+        """ Decode the image, from buffer if given, otherwise from the file cache if set and use_file_cache,
+            otherwise the reader reads the file """
         extension = os.path.splitext(filename)[1].upper()
         if extension not in self._plugins:
             print(  f"ERROR: ImageRead.read({filename}) extension not supported, "
                     f"supported extensions are {self._plugins.keys()}")
             return None
 
+        fromcache = None
         try:
-            if buffer is None and self.file_cache is not None:
+            if buffer is None and use_file_cache and self.file_cache is not None and extension not in self._no_file_cache:
                 # try to get the buffer from the file cache
                 buffer, fromcache = self.file_cache.get_file(filename, check_size=check_filecache_size)
                 print(f" got buffer from cache? {fromcache}")
             res = self._plugins[extension](filename, buffer, read_size, use_RGB, verbose)
+            if fromcache is not None:
+                self.file_cache.buffer_used(filename)
             if res:
                 res.set_filename(filename)
             return res
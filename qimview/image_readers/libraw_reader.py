@@ -6,37 +6,112 @@ except:
 else:
   has_rawpy = True
 import math
+import cv2
 import numpy as np
 from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.utils.utils import get_time
 from io import BytesIO
+from typing import Optional
+from .image_probe import ImageInfo
+
+# Position of each Bayer channel in the ViewerImage, the first green is named 'g'
+bayer_channel_pos = {'R': 0, 'g': 1, 'G': 2, 'B': 3}
+
+
+def bayer_split(raw_image : np.ndarray, raw_pattern : np.ndarray, color_desc : str, step : int = 1) -> np.ndarray:
+    """ Split the Bayer mosaic into 4 half resolution channels R, Gr, Gb, B with a single copy
+        :param raw_pattern: 2x2 array of the color index of each phase in color_desc
+        :param step: keep one 2x2 block every step blocks in each direction
+    """
+    height, width = raw_image.shape[0] & ~1, raw_image.shape[1] & ~1
+    # phases (i,j) of each 2x2 block along the last axis, in the order 2*i+j
+    phases = raw_image[:height, :width].reshape(height >> 1, 2, width >> 1, 2).transpose(0, 2, 1, 3)
+    phases = phases.reshape(height >> 1, width >> 1, 4)[::step, ::step]
+    # not perfect, we may switch Gr and Gb
+    bayer_desc = color_desc.replace('G', 'g', 1)
+    order = [0]*4
+    for i in range(2):
+        for j in range(2):
+            order[bayer_channel_pos[bayer_desc[raw_pattern[i, j]]]] = 2*i+j
+    # copying each channel to a contiguous array is faster than fancy indexing, which needs a second copy
+    res = np.empty(phases.shape, dtype=raw_image.dtype)
+    for pos, phase in enumerate(order):
+        res[:, :, pos] = phases[:, :, phase]
+    return res
+
 
 def read_libraw(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False):
-    if image_buffer:
+    if verbose:
+        start = get_time()
+    if image_buffer is not None:
+        # rawpy reads a file object, which also works with a memory-mapped file
         raw = rawpy.imread(BytesIO(image_buffer))
     else:
         raw = rawpy.imread(image_filename)
-    height, width = raw.raw_image.shape
-    print(f"height, width {(height, width)}")
-    # Transform Bayer image
-    im1 = np.empty((height >> 1, width >> 1, 4), dtype=raw.raw_image.dtype)
-    bayer_desc = raw.color_desc.decode('utf-8')
-    bayer_pattern = raw.raw_pattern
-    # not perfect, we may switch Gr and Gb
-    bayer_desc = bayer_desc.replace('G', 'g', 1)
-    # Detect the green channels?
-    channel_pos = {'R': 0, 'g': 1, 'G': 2, 'B': 3}
-    for i in range(2):
-        for j in range(2):
-            print("str(bayer_desc[bayer_pattern[i,j]]) {}".format(
-                str(bayer_desc[bayer_pattern[i, j]])))
-            pos = channel_pos[str(bayer_desc[bayer_pattern[i, j]])]
-            im1[:, :, pos] = raw.raw_image[i::2, j::2]
+    downscale = {'full': 1, '1/2': 2, '1/4': 4, '1/8': 8}[read_size]
+    im1 = bayer_split(raw.raw_image, raw.raw_pattern, raw.color_desc.decode('utf-8'), downscale)
     prec = math.ceil(math.log2(raw.white_level+1))
-    viewer_image = ViewerImage(im1, precision=prec, downscale=1, channels=ImageFormat.CH_RGGB)
-    print("viewer_image channels {}".format(viewer_image.channels))
+    raw.close()
+    viewer_image = ViewerImage(im1, precision=prec, downscale=downscale, channels=ImageFormat.CH_RGGB)
+    if verbose:
+        print(f" read_libraw {image_filename} {im1.shape} took {get_time()-start:0.3f} sec.")
+    return viewer_image
+
+
+def read_libraw_preview(image_filename, image_buffer, use_RGB=True) -> Optional[ViewerImage]:
+    """ Embedded preview of the raw file, without unpacking the raw data, scaled to the geometry of the
+        image given by read_libraw() so that the viewers keep their zoom when it is replaced
+        :return: None if the file has no usable thumbnail
+    """
+    raw = rawpy.RawPy()
+    try:
+        if image_buffer is not None:
+            raw.open_buffer(BytesIO(image_buffer))
+        else:
+            raw.open_file(image_filename)
+        sizes = raw.sizes
+        thumb = raw.extract_thumb()
+    except Exception:
+        return None
+    finally:
+        raw.close()
+    # native channel order of the thumbnail
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        data = cv2.imdecode(np.frombuffer(thumb.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if data is None: return None
+        channels = ImageFormat.CH_BGR
+    elif thumb.format == rawpy.ThumbFormat.BITMAP:
+        data = thumb.data
+        channels = ImageFormat.CH_RGB
+    else:
+        return None
+    # read_libraw() image dimensions, the preview gets the closest power of 2 downscale
+    width, height = sizes.raw_width >> 1, sizes.raw_height >> 1
+    ratio = max(1, width/data.shape[1])
+    downscale = 2**int(round(math.log2(ratio)))
+    data = cv2.resize(data, (max(1, width//downscale), max(1, height//downscale)), interpolation=cv2.INTER_AREA)
+    viewer_image = ViewerImage(data, precision=8, downscale=downscale, channels=channels)
+    viewer_image.set_filename(image_filename)
     return viewer_image
 
 
+def probe_libraw(image_filename, image_buffer) -> Optional[ImageInfo]:
+    """ Sensor dimensions from the raw metadata, without unpacking the raw data """
+    raw = rawpy.RawPy()
+    if image_buffer is not None:
+        raw.open_buffer(BytesIO(image_buffer))
+    else:
+        raw.open_file(image_filename)
+    sizes = raw.sizes
+    try:
+        prec = math.ceil(math.log2(raw.white_level+1))
+    except Exception:
+        prec = 16
+    raw.close()
+    # read_libraw() gives 4 half resolution Bayer channels of 16-bit values
+    return ImageInfo(sizes.raw_width, sizes.raw_height, 1, prec, sizes.raw_width*sizes.raw_height*2)
+
+
 def libraw_supported_formats():
     # Need to find the complete list of supported formats
     return [".ARW", ".GPR", ".DNG" ]
@@ -0,0 +1,187 @@
+"""
+    Zero-copy readers of uncompressed formats: the returned ViewerImage is backed by np.memmap, so that
+    opening a large file is immediate and only the displayed pixels are paged in.
+    Supported formats:
+        - .npy arrays, as written by npViewer,
+        - binary PGM/PPM (P5/P6) and PFM images,
+        - headerless raw dumps described by a json sidecar file <image>.json, for example
+          { "width": 4000, "height": 3000, "dtype": "<u2", "precision": 12, "bayer": "RGGB" }
+          with optional "channels" (1 or 3, default 1) and "offset" (bytes to skip, default 0).
+    Reduced read sizes are strided views of the memory-mapped array.
+    Bayer dumps are split into 4 channels, and 16-bit PGM/PPM are converted to the native byte order,
+    which both need a copy.
+"""
+
+import json
+import math
+import os
+from typing import Optional, Tuple
+import numpy as np
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.utils.utils import get_time
+from .image_probe import ImageInfo
+
+read_size_downscale = {'full': 1, '1/2': 2, '1/4': 4, '1/8': 8}
+
+bayer_formats = {
+    'RGGB': ImageFormat.CH_RGGB,
+    'GRBG': ImageFormat.CH_GRBG,
+    'GBRG': ImageFormat.CH_GBRG,
+    'BGGR': ImageFormat.CH_BGGR,
+}
+
+
+def array_image(data : np.ndarray, precision : int, read_size : str, channels : Optional[ImageFormat] = None
+                ) -> Optional[ViewerImage]:
+    """ ViewerImage of a memory-mapped array of shape (height, width) or (height, width, channels),
+        reduced read sizes are strided views """
+    if channels is None:
+        if data.ndim == 2:
+            channels = ImageFormat.CH_Y
+        elif data.ndim == 3 and data.shape[2] == 3:
+            channels = ImageFormat.CH_RGB
+        else:
+            return None
+    downscale = read_size_downscale[read_size]
+    if downscale > 1:
+        data = data[::downscale, ::downscale]
+    return ViewerImage(data, precision=precision, downscale=downscale, channels=channels)
+
+
+def dtype_precision(dtype : np.dtype) -> int:
+    return dtype.itemsize*8
+
+
+def read_npy(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False) -> Optional[ViewerImage]:
+    """ Memory-mapped .npy array, colour arrays are expected in RGB order """
+    if verbose:
+        start = get_time()
+    data = np.load(image_filename, mmap_mode='r')
+    if data.ndim == 3 and data.shape[2] == 1:
+        data = data[:, :, 0]
+    res = array_image(data, dtype_precision(data.dtype), read_size)
+    if verbose:
+        print(f" read_npy {image_filename} {data.shape} took {get_time()-start:0.3f} sec.")
+    return res
+
+
+def parse_pnm_header(image_filename) -> Optional[Tuple[bytes, int, int, float, int]]:
+    """ Parse the header of a binary PGM, PPM or PFM file
+        :return: magic number, width, height, maximal value (scale for PFM) and offset of the pixels
+    """
+    with open(image_filename, 'rb') as f:
+        header = f.read(1024)
+    magic = header[:2]
+    if magic not in (b'P5', b'P6', b'Pf', b'PF'): return None
+    # 3 fields after the magic number, separated by white spaces, with optional comments
+    fields = []
+    pos = 2
+    while len(fields) < 3:
+        while pos < len(header) and header[pos:pos+1].isspace():
+            pos += 1
+        if header[pos:pos+1] == b'#':
+            pos = header.index(b'\n', pos)
+            continue
+        end = pos
+        while end < len(header) and not header[end:end+1].isspace():
+            end += 1
+        if end == pos: return None
+        fields.append(header[pos:end])
+        pos = end
+    # a single white space before the pixels
+    return magic, int(fields[0]), int(fields[1]), float(fields[2]), pos+1
+
+
+def read_pnm(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False) -> Optional[ViewerImage]:
+    """ Memory-mapped binary PGM/PPM/PFM image, other variants are read by OpenCV """
+    header = parse_pnm_header(image_filename)
+    if header is None:
+        from .opencv_reader import read_opencv
+        return read_opencv(image_filename, image_buffer, read_size, use_RGB, verbose)
+    magic, width, height, maxval, offset = header
+    nb_channels = 3 if magic in (b'P6', b'PF') else 1
+    shape = (height, width, nb_channels) if nb_channels == 3 else (height, width)
+    if magic in (b'Pf', b'PF'):
+        # negative scale for little-endian data, rows are stored from bottom to top
+        dtype = np.dtype('<f4' if maxval < 0 else '>f4')
+        data = np.memmap(image_filename, dtype=dtype, mode='r', offset=offset, shape=shape)[::-1]
+        if not dtype.isnative:
+            data = np.array(data, dtype=dtype.newbyteorder('='))
+        precision = 32
+    else:
+        dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype('>u2')
+        data = np.memmap(image_filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+        if not dtype.isnative:
+            data = np.array(data, dtype=np.uint16)
+        precision = math.ceil(math.log2(maxval+1))
+    return array_image(data, precision, read_size)
+
+
+def sidecar_filename(image_filename : str) -> str:
+    return image_filename + '.json'
+
+
+def read_sidecar(image_filename : str) -> dict:
+    with open(sidecar_filename(image_filename), 'r') as f:
+        return json.load(f)
+
+
+def read_raw_dump(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False
+                  ) -> Optional[ViewerImage]:
+    """ Memory-mapped headerless raw image with the geometry given by its sidecar file """
+    geometry = read_sidecar(image_filename)
+    width, height = geometry['width'], geometry['height']
+    dtype = np.dtype(geometry.get('dtype', '<u2'))
+    nb_channels = geometry.get('channels', 1)
+    shape = (height, width, nb_channels) if nb_channels > 1 else (height, width)
+    data = np.memmap(image_filename, dtype=dtype, mode='r', offset=geometry.get('offset', 0), shape=shape)
+    if not dtype.isnative:
+        data = np.array(data, dtype=dtype.newbyteorder('='))
+    precision = geometry.get('precision', dtype_precision(dtype))
+    bayer = geometry.get('bayer', None)
+    if bayer is None:
+        return array_image(data, precision, read_size)
+    # Bayer phases (i,j) in the order 2*i+j, which is the channel order of the Bayer ImageFormat
+    downscale = read_size_downscale[read_size]
+    h, w = height & ~1, width & ~1
+    phases = data[:h, :w].reshape(h >> 1, 2, w >> 1, 2)[::downscale, :, ::downscale, :]
+    res = np.empty((phases.shape[0], phases.shape[2], 4), dtype=data.dtype)
+    for i in range(2):
+        for j in range(2):
+            res[:, :, 2*i+j] = phases[:, i, :, j]
+    return ViewerImage(res, precision=precision, downscale=downscale, channels=bayer_formats[bayer.upper()])
+
+
+def probe_memmap(image_filename, image_buffer) -> Optional[ImageInfo]:
+    """ Dimensions from the npy, pnm header or the sidecar file """
+    extension = os.path.splitext(image_filename)[1].upper()
+    if extension == '.NPY':
+        data = np.load(image_filename, mmap_mode='r')
+        if data.ndim < 2: return None
+        channels = data.shape[2] if data.ndim == 3 else 1
+        return ImageInfo(data.shape[1], data.shape[0], channels, dtype_precision(data.dtype), data.nbytes)
+    if extension == '.RAW':
+        geometry = read_sidecar(image_filename)
+        width, height = geometry['width'], geometry['height']
+        dtype = np.dtype(geometry.get('dtype', '<u2'))
+        channels = geometry.get('channels', 1)
+        return ImageInfo(width, height, channels, geometry.get('precision', dtype_precision(dtype)),
+                         width*height*channels*dtype.itemsize)
+    header = parse_pnm_header(image_filename)
+    if header is None: return None
+    magic, width, height, maxval, _ = header
+    channels = 3 if magic in (b'P6', b'PF') else 1
+    if magic in (b'Pf', b'PF'):
+        return ImageInfo(width, height, channels, 32, width*height*channels*4)
+    itemsize = 1 if maxval < 256 else 2
+    return ImageInfo(width, height, channels, math.ceil(math.log2(maxval+1)), width*height*channels*itemsize)
+
+
+# reader of each extension
+memmap_readers = {
+    ".NPY": read_npy,
+    ".PGM": read_pnm,
+    ".PPM": read_pnm,
+    ".PFM": read_pnm,
+    ".RAW": read_raw_dump,
+}
@@ -18,11 +18,12 @@ def read_opencv(image_filename, image_buffer, read_size='full', use_RGB=True, ve
     else:
         bytes_as_np_array = np.frombuffer(image_buffer, dtype=np.uint8)
         cv2_im = cv2.imdecode(bytes_as_np_array, flags) 
+    if cv2_im is None:
+        return None
 
     open_cv2_start2 = get_time()
-    # transform default opencv BGR to RGB
-    if use_RGB:
-        im = cv2.cvtColor(cv2_im, cv2.COLOR_BGR2RGB)
+    # the image is kept in the BGR order of OpenCV whatever use_RGB, the viewers swap the channels
+    # at display time
 
     if verbose:
         last_time = get_time()
@@ -31,7 +32,7 @@ def read_opencv(image_filename, image_buffer, read_size='full', use_RGB=True, ve
                                                                     last_time - open_cv2_start2),
                 )
     downscale = {'full': 1, '1/2': 2, '1/4': 4, '1/8': 8}[read_size]
-    viewer_image = ViewerImage(im, precision=8, downscale=downscale, channels=ImageFormat.CH_RGB if use_RGB else ImageFormat.CH_BGR)
+    viewer_image = ViewerImage(cv2_im, precision=8, downscale=downscale, channels=ImageFormat.CH_BGR)
     return viewer_image
 
 
@@ -0,0 +1,67 @@
+"""
+    Decoding of images in worker processes, for reader plugins that hold the GIL (rawpy post-processing,
+    numpy Bayer reshuffles, Python plugins).
+    The decoded pixels come back through a file of the shared memory (/dev/shm on Linux) that the parent
+    maps and removes, instead of being pickled through the pipe of the pool.
+"""
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Optional, Tuple
+import numpy as np
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+
+# Folder of the files holding the decoded images
+shared_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# Shared file, precision, downscale and channels of a decoded image
+SharedImage = Tuple[str, int, int, int]
+
+
+def read_to_shared(callback : Callable, image_filename : str, read_size : str, use_RGB : bool,
+                   verbose : bool) -> Optional[SharedImage]:
+    """ Run in the worker process: decode the image with the reader plugin and save it to shared memory """
+    image = callback(image_filename, None, read_size, use_RGB, verbose)
+    if image is None: return None
+    if image.u is not None or image.v is not None or image.uv is not None:
+        raise ValueError("images with several planes are not supported")
+    fd, path = tempfile.mkstemp(prefix='qimview_', suffix='.npy', dir=shared_dir)
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, image.data)
+    return path, image.precision, image.downscale, int(image.channels)
+
+
+def attach_shared(shared : SharedImage) -> ViewerImage:
+    """ Map the image saved by read_to_shared(), its file is removed once mapped """
+    path, precision, downscale, channels = shared
+    # copy-on-write mapping, as a plain array since its pages are not backed by the image file
+    data = np.asarray(np.load(path, mmap_mode='c'))
+    try:
+        os.remove(path)
+    except OSError:
+        # mapped files cannot be removed on Windows
+        pass
+    return ViewerImage(data, precision=precision, downscale=downscale, channels=ImageFormat(channels))
+
+
+class ProcessReader:
+    """ Pool of worker processes started on first use """
+    def __init__(self, max_workers : Optional[int] = None):
+        self._max_workers : Optional[int]                 = max_workers
+        self._executor    : Optional[ProcessPoolExecutor] = None
+
+    def submit(self, callback : Callable, image_filename : str, read_size : str = 'full', use_RGB : bool = True,
+               verbose : bool = False) -> 'Future[Optional[SharedImage]]':
+        """ The callback is sent to the worker by reference, it must be a function of an importable module """
+        if self._executor is None:
+            # spawn: forking a process that runs Qt threads is not safe
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor.submit(read_to_shared, callback, image_filename, read_size, use_RGB, verbose)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,255 @@
+"""
+    Tiled multi-resolution pyramid of an image, stored in a single file (.qpyr) that is memory-mapped,
+    for images too large to be decoded in memory (stitched panoramas, wafer scans).
+
+    File layout:
+        b'QPYR', header length (uint32), json header, then each level aligned on 4096 bytes as an array
+        of shape (tiles_y, tiles_x, tile_size, tile_size, nb_channels); level k has the dimensions of the
+        image divided by 2**k, the last level fits in a single tile.
+    Only the tiles intersecting the displayed region are read, through the tile cache if set.
+
+    usage: python -m qimview.image_readers.pyramid [--tile-size 256] input output.qpyr
+"""
+
+import argparse
+import json
+import math
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.utils.utils import get_time
+from .image_probe import ImageInfo
+
+pyramid_magic = b'QPYR'
+pyramid_alignment = 4096
+# Maximal dimension of the level read as image data, the other levels are read as tiles
+pyramid_overview_size = 2048
+
+
+def _align(offset : int) -> int:
+    return (offset + pyramid_alignment - 1) // pyramid_alignment * pyramid_alignment
+
+
+def pyramid_levels(width : int, height : int, tile_size : int) -> List[Dict[str, int]]:
+    """ Dimensions and number of tiles of each level """
+    levels = []
+    while True:
+        levels.append({ 'width': width, 'height': height,
+                        'tiles_x': (width+tile_size-1)//tile_size, 'tiles_y': (height+tile_size-1)//tile_size })
+        if width <= tile_size and height <= tile_size: break
+        width, height = (width+1)//2, (height+1)//2
+    return levels
+
+
+class PyramidImage:
+    """ Read access to a pyramid file """
+    # Cache of tiles shared by all the pyramids, set by qimview.cache.tilecache
+    tile_cache = None
+
+    def __init__(self, filename : str):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(4) != pyramid_magic:
+                raise ValueError(f"{filename} is not a pyramid file")
+            header_length = struct.unpack('<I', f.read(4))[0]
+            self.header : Dict = json.loads(f.read(header_length))
+        self.width     : int         = self.header['width']
+        self.height    : int         = self.header['height']
+        self.tile_size : int         = self.header['tile_size']
+        self.channels  : ImageFormat = ImageFormat(self.header['channels'])
+        self.precision : int         = self.header['precision']
+        self.dtype     : np.dtype    = np.dtype(self.header['dtype'])
+        self.nb_channels : int       = self.header['nb_channels']
+        self.levels    : List[Dict[str, int]] = self.header['levels']
+        self._arrays   : List[np.memmap] = [
+            np.memmap(filename, dtype=self.dtype, mode='r', offset=level['offset'],
+                      shape=(level['tiles_y'], level['tiles_x'], self.tile_size, self.tile_size, self.nb_channels))
+            for level in self.levels ]
+
+    def read_tile(self, level : int, tx : int, ty : int) -> np.ndarray:
+        """ Copy of a tile from the file """
+        return np.array(self._arrays[level][ty, tx])
+
+    def get_tile(self, level : int, tx : int, ty : int) -> np.ndarray:
+        if PyramidImage.tile_cache is not None:
+            return PyramidImage.tile_cache.get_tile(self, level, tx, ty)
+        return self.read_tile(level, tx, ty)
+
+    def overview_level(self, max_size : int = pyramid_overview_size) -> int:
+        """ Finest level whose dimensions are at most max_size """
+        for n, level in enumerate(self.levels):
+            if level['width'] <= max_size and level['height'] <= max_size:
+                return n
+        return len(self.levels)-1
+
+    def read_level_region(self, level : int, x0 : int, y0 : int, x1 : int, y1 : int) -> np.ndarray:
+        """ Region [x0,x1[ x [y0,y1[ in the coordinates of the level, assembled from its tiles """
+        t = self.tile_size
+        res = np.empty((y1-y0, x1-x0, self.nb_channels), dtype=self.dtype)
+        for ty in range(y0//t, (y1+t-1)//t):
+            for tx in range(x0//t, (x1+t-1)//t):
+                tile = self.get_tile(level, tx, ty)
+                # intersection of the tile with the region
+                ix0, iy0 = max(x0, tx*t), max(y0, ty*t)
+                ix1, iy1 = min(x1, (tx+1)*t), min(y1, (ty+1)*t)
+                res[iy0-y0:iy1-y0, ix0-x0:ix1-x0] = tile[iy0-ty*t:iy1-ty*t, ix0-tx*t:ix1-tx*t]
+        return res
+
+    def read_region(self, x0 : int, y0 : int, x1 : int, y1 : int, width : int, height : int,
+                    use_RGB : bool = True) -> Tuple[np.ndarray, int]:
+        """ Region [x0,x1[ x [y0,y1[ in full resolution coordinates, from the coarsest level that still
+            has at least width x height pixels for it
+            :return: data and downscale factor of the level
+        """
+        ratio = min((x1-x0)/max(1, width), (y1-y0)/max(1, height))
+        level = int(math.floor(math.log2(ratio))) if ratio >= 1 else 0
+        level = max(0, min(level, len(self.levels)-1))
+        f = 2**level
+        lw, lh = self.levels[level]['width'], self.levels[level]['height']
+        data = self.read_level_region(level, min(x0//f, lw-1), min(y0//f, lh-1),
+                                      max(min(lw, (x1+f-1)//f), 1), max(min(lh, (y1+f-1)//f), 1))
+        return self._convert(data, use_RGB), f
+
+    def _convert(self, data : np.ndarray, use_RGB : bool) -> np.ndarray:
+        if self.channels == ImageFormat.CH_RGB and not use_RGB:
+            return np.ascontiguousarray(data[:, :, ::-1])
+        return data
+
+    def image_channels(self, use_RGB : bool) -> ImageFormat:
+        if self.channels == ImageFormat.CH_RGB and not use_RGB:
+            return ImageFormat.CH_BGR
+        return self.channels
+
+
+def read_pyramid(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False) -> Optional[ViewerImage]:
+    """ Reader plugin: reduced level of the pyramid, the pyramid is attached to the image to read its tiles """
+    pyramid = PyramidImage(image_filename)
+    downscale = {'full': 1, '1/2': 2, '1/4': 4, '1/8': 8}[read_size]
+    level = min(max(pyramid.overview_level(), int(math.log2(downscale))), len(pyramid.levels)-1)
+    lw, lh = pyramid.levels[level]['width'], pyramid.levels[level]['height']
+    data = pyramid._convert(pyramid.read_level_region(level, 0, 0, lw, lh), use_RGB)
+    image = ViewerImage(data, precision=pyramid.precision, downscale=2**level,
+                        channels=pyramid.image_channels(use_RGB))
+    image.pyramid = pyramid
+    return image
+
+
+def probe_pyramid(image_filename, image_buffer) -> Optional[ImageInfo]:
+    pyramid = PyramidImage(image_filename)
+    return ImageInfo(pyramid.width, pyramid.height, pyramid.nb_channels, pyramid.precision,
+                     pyramid.width*pyramid.height*pyramid.nb_channels*pyramid.dtype.itemsize)
+
+
+def build_pyramid(input_filename : str, output_filename : str, tile_size : int = 256,
+                  progress_callback : Optional[Callable[[int], None]] = None) -> bool:
+    """ Create the pyramid file of an image. If the reader supports regions of interest, the input is read
+        by bands of tiles so that the full image is never in memory: the tiles of a tiled TIFF are read from
+        the file, a JPEG is read once in a buffer and each band is cropped from it. Other formats are
+        decoded at once, as a fallback. Each level is then computed from the previous one by bands.
+        The file cache is not used: the input would take most of its memory, for a single read.
+        The file is written next to the output and renamed once complete.
+    """
+    # avoid circular import
+    from .image_reader import gb_image_reader
+    start = get_time()
+    info = gb_image_reader.probe(input_filename, full_read=False)
+    use_roi = info is not None and gb_image_reader.supports_roi(input_filename)
+    buffer = None
+    full_image = None
+    if use_roi:
+        width, height = info.width, info.height
+        if gb_image_reader.roi_reads_whole_file(input_filename):
+            with open(input_filename, 'rb') as f:
+                buffer = f.read()
+    else:
+        full_image = gb_image_reader.read(input_filename, use_file_cache=False)
+        if full_image is None: return False
+        height, width = full_image.data.shape[:2]
+
+    def read_band(y0 : int, y1 : int) -> Optional[ViewerImage]:
+        if full_image is not None:
+            return ViewerImage(full_image.data[y0:y1], precision=full_image.precision, channels=full_image.channels)
+        res = gb_image_reader.read_roi(input_filename, (0, y0, width, y1-y0), buffer=buffer)
+        if res is None: return None
+        image, (rx, ry, rw, rh) = res
+        image.data = image.data[y0-ry:y1-ry, :width]
+        return image
+
+    levels = pyramid_levels(width, height, tile_size)
+    nb_bands = levels[0]['tiles_y']
+    first = read_band(0, min(height, tile_size))
+    if first is None: return False
+    data = first.data if first.data.ndim == 3 else first.data[:, :, np.newaxis]
+    dtype, nb_channels = data.dtype, data.shape[2]
+    header = { 'width': width, 'height': height, 'tile_size': tile_size, 'channels': int(first.channels),
+               'precision': first.precision, 'dtype': dtype.str, 'nb_channels': nb_channels,
+               'source': os.path.abspath(input_filename), 'levels': levels }
+    # The offsets depend on the header length, which depends on the offsets: reserve enough space
+    offset = _align(8 + len(json.dumps(header)) + 32*len(levels) + 64)
+    for level in levels:
+        level['offset'] = offset
+        offset = _align(offset + level['tiles_y']*level['tiles_x']*tile_size*tile_size*nb_channels*dtype.itemsize)
+    header_bytes = json.dumps(header).encode()
+    tmp_filename = output_filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(pyramid_magic + struct.pack('<I', len(header_bytes)) + header_bytes)
+        f.truncate(offset)
+    arrays = [ np.memmap(tmp_filename, dtype=dtype, mode='r+', offset=level['offset'],
+                         shape=(level['tiles_y'], level['tiles_x'], tile_size, tile_size, nb_channels))
+               for level in levels ]
+    nb_steps = sum(level['tiles_y'] for level in levels)
+    step = 0
+
+    def write_band(level : int, ty : int, band : np.ndarray) -> None:
+        nonlocal step
+        t = tile_size
+        for tx in range(levels[level]['tiles_x']):
+            tile = band[:, tx*t:(tx+1)*t]
+            arrays[level][ty, tx, :tile.shape[0], :tile.shape[1]] = tile
+        step += 1
+        if progress_callback is not None:
+            progress_callback(int(step*100/nb_steps+0.5))
+
+    # level 0 from the input
+    for ty in range(nb_bands):
+        band = first if ty == 0 else read_band(ty*tile_size, min(height, (ty+1)*tile_size))
+        if band is None:
+            del arrays
+            os.remove(tmp_filename)
+            return False
+        data = band.data if band.data.ndim == 3 else band.data[:, :, np.newaxis]
+        write_band(0, ty, data)
+    full_image = buffer = None
+    # each level from the previous one, by bands of 2 rows of tiles
+    for n in range(1, len(levels)):
+        prev = levels[n-1]
+        for ty in range(levels[n]['tiles_y']):
+            y0, y1 = 2*ty*tile_size, min(prev['height'], 2*(ty+1)*tile_size)
+            band = np.concatenate([ arrays[n-1][row].transpose(1, 0, 2, 3).reshape(tile_size, -1, nb_channels)
+                                    for row in range(2*ty, min(prev['tiles_y'], 2*ty+2)) ])
+            band = band[:y1-y0, :prev['width']]
+            reduced = cv2.resize(band, ((band.shape[1]+1)//2, (band.shape[0]+1)//2), interpolation=cv2.INTER_AREA)
+            write_band(n, ty, reduced.reshape(reduced.shape[0], reduced.shape[1], nb_channels))
+    for a in arrays:
+        a.flush()
+    del arrays
+    os.replace(tmp_filename, output_filename)
+    print(f"Pyramid of {input_filename} ({width}x{height}, {len(levels)} levels) built in {get_time()-start:0.1f} sec.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the tiled multi-resolution pyramid of an image')
+    parser.add_argument('input', help='input image')
+    parser.add_argument('output', help='output pyramid file (.qpyr)')
+    parser.add_argument('-t', '--tile-size', type=int, default=256, help='tile size in pixels')
+    args = parser.parse_args()
+    if not build_pyramid(args.input, args.output, args.tile_size):
+        print(f"Failed to build the pyramid of {args.input}")
+
+
+if __name__ == '__main__':
+    main()
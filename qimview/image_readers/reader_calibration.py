@@ -0,0 +1,160 @@
+"""
+    Calibration of the decoders available for each format: each backend is timed on sample images at each
+    read_size, and the ranking is saved to reader_ranking_file. read_jpeg() then tries the backends from the
+    fastest measured one. Without calibration, the default order is used.
+
+    usage: python -m qimview.image_readers.reader_calibration [--repeat 5] [samples or folders ...]
+    without samples, the images of qimview/test_data are used.
+"""
+
+import argparse
+import json
+import os
+import statistics
+from typing import Callable, Dict, List, Optional, Tuple
+from qimview.utils.utils import get_time
+from .turbojpeg_reader import read_jpeg_turbojpeg, gb_turbo_jpeg, has_turbojpeg
+from .simplejpeg_reader import read_jpeg_simplejpeg, has_simplejpeg
+from .opencv_reader import read_opencv
+
+reader_ranking_file = os.path.join('~', '.cache', 'qimview', 'reader_ranking.json')
+
+read_sizes = ['full', '1/2', '1/4', '1/8']
+
+# Backend: reader, availability and supported read sizes
+Backend = Tuple[Callable, bool, List[str]]
+
+# Candidate backends of each format, in the default order
+format_backends : Dict[str, Dict[str, Backend]] = {
+    'jpeg': {
+        'turbojpeg'  : (read_jpeg_turbojpeg,  gb_turbo_jpeg is not None and has_turbojpeg, read_sizes),
+        # simplejpeg does not decode at reduced sizes
+        'simplejpeg' : (read_jpeg_simplejpeg, has_simplejpeg, ['full']),
+        'opencv'     : (read_opencv,          True, read_sizes),
+    },
+}
+
+format_extensions = {
+    'jpeg': ['.JPG', '.JPEG'],
+}
+
+
+class BackendRanking:
+    """ Order of the backends of each format and read_size, fastest first """
+    def __init__(self, filename : str = reader_ranking_file):
+        self.filename : str = os.path.expanduser(filename)
+        # format -> read_size -> backend names
+        self.ranking  : Dict[str, Dict[str, List[str]]] = {}
+        self.load()
+
+    def load(self) -> None:
+        if not os.path.isfile(self.filename): return
+        try:
+            with open(self.filename, 'r') as f:
+                self.ranking = json.load(f)
+        except Exception as e:
+            print(f"Failed to read reader ranking {self.filename}: {e}")
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename, 'w') as f:
+            json.dump(self.ranking, f, indent=2)
+
+    def backends(self, format : str, read_size : str = 'full') -> List[Tuple[str, Callable]]:
+        """ Available backends supporting read_size, the measured ones first in ranking order,
+            then the others in the default order """
+        candidates = format_backends[format]
+        ranked = self.ranking.get(format, {}).get(read_size, [])
+        names = [ name for name in ranked if name in candidates ]
+        names.extend(name for name in candidates if name not in names)
+        return [ (name, candidates[name][0]) for name in names
+                 if candidates[name][1] and read_size in candidates[name][2] ]
+
+
+def sample_files(paths : List[str]) -> List[str]:
+    """ Files of the calibrated formats in the given files and folders """
+    extensions = [ ext for exts in format_extensions.values() for ext in exts ]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    return [ f for f in files if os.path.splitext(f)[1].upper() in extensions ]
+
+
+def decode_time(reader : Callable, filename : str, buffer : bytes, read_size : str, repeat : int) -> Optional[float]:
+    """ Median time of the decodes of the buffer, None if the reader fails """
+    durations = []
+    for _ in range(repeat):
+        start = get_time()
+        try:
+            image = reader(filename, buffer, read_size, True, False)
+        except Exception:
+            image = None
+        if image is None: return None
+        durations.append(get_time()-start)
+    return statistics.median(durations)
+
+
+def calibrate(samples : List[str], repeat : int = 3, verbose : bool = True) -> Dict[str, Dict[str, List[str]]]:
+    """ Time each backend on the samples, from memory buffers to exclude the file reading
+        :return: backend names by format and read_size, from the fastest to the slowest in total time; the
+            backends that failed to decode a sample decoded by another backend are not ranked
+    """
+    # format -> read_size -> backend -> sample -> time, None if the decoding failed
+    timings : Dict[str, Dict[str, Dict[str, Dict[str, Optional[float]]]]] = {}
+    for filename in samples:
+        extension = os.path.splitext(filename)[1].upper()
+        format = next((fmt for fmt, exts in format_extensions.items() if extension in exts), None)
+        if format is None: continue
+        with open(filename, 'rb') as f:
+            buffer = f.read()
+        for read_size in read_sizes:
+            for name, (reader, available, sizes) in format_backends[format].items():
+                if not available or read_size not in sizes: continue
+                duration = decode_time(reader, filename, buffer, read_size, repeat)
+                timings.setdefault(format, {}).setdefault(read_size, {}).setdefault(name, {})[filename] = duration
+                if verbose:
+                    if duration is None:
+                        print(f" {name} failed to decode {filename} at {read_size}")
+                    else:
+                        print(f" {os.path.basename(filename):>30} {read_size:>5} {name:>11} {duration*1000:8.1f} ms")
+    res = {}
+    for format, sizes in timings.items():
+        res[format] = {}
+        for read_size, backends in sizes.items():
+            # samples that no backend decodes are ignored
+            decoded = { f for durations in backends.values() for f, d in durations.items() if d is not None }
+            totals = { name: sum(durations[f] for f in decoded) for name, durations in backends.items()
+                       if all(durations.get(f) is not None for f in decoded) }
+            res[format][read_size] = sorted(totals, key=totals.get)
+    return res
+
+
+# ranking used by the readers
+gb_backend_ranking = BackendRanking()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the decoders of each format and save their ranking')
+    parser.add_argument('samples', nargs='*', help='sample images or folders, qimview/test_data by default')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of decodes of each image')
+    parser.add_argument('-o', '--output', type=str, default=reader_ranking_file, help='ranking file')
+    args = parser.parse_args()
+    paths = args.samples or [ os.path.join(os.path.dirname(os.path.dirname(__file__)), 'test_data') ]
+    samples = sample_files(paths)
+    if len(samples) == 0:
+        print(f"No sample image found in {paths}")
+        return
+    ranking = BackendRanking(args.output)
+    ranking.ranking.update(calibrate(samples, args.repeat))
+    ranking.save()
+    for format, sizes in ranking.ranking.items():
+        for read_size, names in sizes.items():
+            print(f"{format:>6} {read_size:>5}: {', '.join(names)}")
+    print(f"Ranking saved to {ranking.filename}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+    Region of interest reading of tiled TIFF images: only the tiles intersecting the region are read
+    and decoded. Uncompressed and deflate tiles are decoded directly, other compressions need tifffile.
+"""
+
+try:
+    import tifffile
+except:
+    has_tifffile = False
+else:
+    has_tifffile = True
+import zlib
+from io import BytesIO
+from typing import Optional, Tuple
+import numpy as np
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from .image_probe import parse_tiff_ifd
+
+# Rectangle x, y, width, height in pixels of the full resolution image
+Rect = Tuple[int, int, int, int]
+
+# TIFF tags
+TAG_WIDTH, TAG_HEIGHT, TAG_BITS, TAG_COMPRESSION = 256, 257, 258, 259
+TAG_SAMPLES, TAG_PLANAR, TAG_PREDICTOR = 277, 284, 317
+TAG_TILE_WIDTH, TAG_TILE_LENGTH, TAG_TILE_OFFSETS, TAG_TILE_BYTES = 322, 323, 324, 325
+
+
+def is_tiled_tiff(image_filename, image_buffer=None) -> bool:
+    res = parse_tiff_ifd(image_filename, image_buffer)
+    return res is not None and TAG_TILE_OFFSETS in res[1]
+
+
+def tile_range(roi : Rect, tile_width : int, tile_length : int) -> Tuple[int, int, int, int]:
+    """ First and last (excluded) tile columns and rows intersecting the region """
+    x, y, w, h = roi
+    return x//tile_width, (x+w+tile_width-1)//tile_width, y//tile_length, (y+h+tile_length-1)//tile_length
+
+
+def read_tiles_tifffile(image_filename, image_buffer, roi : Rect) -> Optional[Tuple[np.ndarray, Rect]]:
+    with tifffile.TiffFile(BytesIO(image_buffer) if image_buffer is not None else image_filename) as tif:
+        page = tif.pages[0]
+        if not page.is_tiled or page.tiledepth > 1 or page.planarconfig != 1: return None
+        height, width = page.imagelength, page.imagewidth
+        tw, tl = page.tilewidth, page.tilelength
+        tx0, tx1, ty0, ty1 = tile_range(roi, tw, tl)
+        nb_columns = (width+tw-1)//tw
+        samples = page.samplesperpixel
+        res = np.empty(((ty1-ty0)*tl, (tx1-tx0)*tw, samples), dtype=page.dtype)
+        fh = tif.filehandle
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                index = ty*nb_columns+tx
+                fh.seek(page.dataoffsets[index])
+                tile = page.decode(fh.read(page.databytecounts[index]), index)[0]
+                res[(ty-ty0)*tl:(ty-ty0+1)*tl, (tx-tx0)*tw:(tx-tx0+1)*tw] = np.asarray(tile).reshape(tl, tw, samples)
+    x0, y0 = tx0*tw, ty0*tl
+    rect = (x0, y0, min(width, tx1*tw)-x0, min(height, ty1*tl)-y0)
+    return res[:rect[3], :rect[2]], rect
+
+
+def read_tiles(image_filename, image_buffer, roi : Rect) -> Optional[Tuple[np.ndarray, Rect]]:
+    """ Read the uncompressed or deflate tiles of 8 or 16-bit images intersecting roi """
+    parsed = parse_tiff_ifd(image_filename, image_buffer)
+    if parsed is None: return None
+    endian, tags = parsed
+    if TAG_TILE_OFFSETS not in tags: return None
+    compression = tags.get(TAG_COMPRESSION, [1])[0]
+    bits        = tags.get(TAG_BITS, [1])[0]
+    predictor   = tags.get(TAG_PREDICTOR, [1])[0]
+    if compression not in (1, 8, 32946) or tags.get(TAG_PLANAR, [1])[0] != 1 or bits not in (8, 16) \
+            or predictor not in (1, 2):
+        return None
+    width, height = tags[TAG_WIDTH][0], tags[TAG_HEIGHT][0]
+    tw, tl = tags[TAG_TILE_WIDTH][0], tags[TAG_TILE_LENGTH][0]
+    samples = tags.get(TAG_SAMPLES, [1])[0]
+    dtype = np.dtype(np.uint8) if bits == 8 else np.dtype(endian+'u2')
+    tx0, tx1, ty0, ty1 = tile_range(roi, tw, tl)
+    nb_columns = (width+tw-1)//tw
+    res = np.empty(((ty1-ty0)*tl, (tx1-tx0)*tw, samples), dtype=dtype)
+    f = open(image_filename, 'rb') if image_buffer is None else None
+    try:
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                index = ty*nb_columns+tx
+                offset, size = tags[TAG_TILE_OFFSETS][index], tags[TAG_TILE_BYTES][index]
+                if f is not None:
+                    f.seek(offset)
+                    data = f.read(size)
+                else:
+                    data = image_buffer[offset:offset+size]
+                if compression != 1:
+                    data = zlib.decompress(data)
+                tile = np.frombuffer(data, dtype=dtype, count=tl*tw*samples).reshape(tl, tw, samples)
+                if predictor == 2:
+                    # horizontal differencing
+                    tile = np.cumsum(tile, axis=1, dtype=dtype)
+                res[(ty-ty0)*tl:(ty-ty0+1)*tl, (tx-tx0)*tw:(tx-tx0+1)*tw] = tile
+    finally:
+        if f is not None: f.close()
+    x0, y0 = tx0*tw, ty0*tl
+    rect = (x0, y0, min(width, tx1*tw)-x0, min(height, ty1*tl)-y0)
+    return res[:rect[3], :rect[2]], rect
+
+
+def read_tiff_roi(image_filename, image_buffer, roi : Rect, use_RGB=True) -> Optional[Tuple[ViewerImage, Rect]]:
+    """ Read the tiles of a tiled TIFF image intersecting roi
+        :return: image of the tiles clipped to the image, and its rectangle, None if the image is not tiled
+    """
+    res = read_tiles(image_filename, image_buffer, roi)
+    if res is None and has_tifffile:
+        res = read_tiles_tifffile(image_filename, image_buffer, roi)
+    if res is None: return None
+    data, rect = res
+    samples = data.shape[2]
+    if samples == 1:
+        channels = ImageFormat.CH_Y
+    elif samples >= 3:
+        data = data[:, :, :3]
+        channels = ImageFormat.CH_RGB
+        if not use_RGB:
+            data = data[:, :, ::-1]
+            channels = ImageFormat.CH_BGR
+        data = np.ascontiguousarray(data)
+    else:
+        return None
+    precision = data.dtype.itemsize*8
+    return ViewerImage(data, precision=precision, downscale=1, channels=channels), rect
@@ -8,6 +8,8 @@
 
 from qimview.utils.viewer_image import *
 from qimview.utils.utils import get_time
+from .image_probe import ImageInfo, read_header, opencv_decoded_size
+from typing import Optional, Tuple
 
 try:
     from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_BGR, TJFLAG_FASTDCT
@@ -67,3 +69,46 @@ def read_jpeg_turbojpeg(image_filename, image_buffer, read_size='full', use_RGB=
         print("read_jpeg: Failed to load image with turbojpeg {0}: {1}".format(image_filename, e))
         return None
 
+
+def probe_jpeg_turbojpeg(image_filename, image_buffer) -> Optional[ImageInfo]:
+    """ Image dimensions from the header decoded by turbojpeg, without decompressing the pixels """
+    try:
+        header = gb_turbo_jpeg.decode_header(read_header(image_filename, image_buffer))
+    except Exception as e:
+        return None
+    width, height = header[0], header[1]
+    # colorspace TJCS_GRAY is 2
+    channels = 1 if len(header)>3 and header[3] == 2 else 3
+    return ImageInfo(width, height, channels, 8, opencv_decoded_size(width, height))
+
+
+# MCU width and height of each chroma subsampling of turbojpeg (TJSAMP_444, 422, 420, GRAY, 440, 411)
+jpeg_mcu_sizes = [(8, 8), (16, 8), (16, 16), (8, 8), (8, 16), (32, 8)]
+
+
+def read_jpeg_roi_turbojpeg(image_filename, image_buffer, roi : Tuple[int, int, int, int],
+                            use_RGB=True) -> Optional[Tuple[ViewerImage, Tuple[int, int, int, int]]]:
+    """ Decode a rectangle x, y, width, height of the image: the JPEG is losslessly cropped to the MCU
+        blocks intersecting the rectangle, and only these blocks are decoded
+        :return: image and its rectangle, aligned on MCU blocks
+    """
+    try:
+        if image_buffer is None:
+            with open(image_filename, 'rb') as d:
+                image_buffer = d.read()
+        header = gb_turbo_jpeg.decode_header(image_buffer)
+        width, height, subsample = header[0], header[1], header[2]
+        mcu_w, mcu_h = jpeg_mcu_sizes[subsample] if 0 <= subsample < len(jpeg_mcu_sizes) else (16, 16)
+        x, y, w, h = roi
+        x0, y0 = (x//mcu_w)*mcu_w, (y//mcu_h)*mcu_h
+        x1, y1 = min(width, x+w), min(height, y+h)
+        cropped = gb_turbo_jpeg.crop(image_buffer, x0, y0, x1-x0, y1-y0)
+        pixel_format = TJPF_RGB if use_RGB else TJPF_BGR
+        im = gb_turbo_jpeg.decode(cropped, pixel_format=pixel_format, flags=TJFLAG_FASTDCT)
+        rect = (x0, y0, im.shape[1], im.shape[0])
+        return ViewerImage(im, precision=8, downscale=1,
+                           channels=ImageFormat.CH_RGB if use_RGB else ImageFormat.CH_BGR), rect
+    except Exception as e:
+        print(f"read_jpeg_roi: Failed to decode region of {image_filename} with turbojpeg: {e}")
+        return None
+
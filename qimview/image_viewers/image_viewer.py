@@ -194,6 +194,8 @@ class ImageViewer:
         self.show_stats             : bool = False
         self.show_intensity_line    : bool = False
         self.antialiasing           : bool = True
+        # Zoom above which the displayed region is decoded at full resolution, if supported (0 to disable)
+        self.roi_zoom               : float = 0
         # We track an image counter, changed by set_image, to help reducing same calculations
         self.image_id       = -1
         self.image_ref_id   = -1
@@ -3,14 +3,16 @@
 """
 import math
 import types
+import json
 from enum                         import Enum, auto
-from typing                       import List, Optional, NewType
+from typing                       import List, Optional, NewType, Callable, Tuple, Dict
 from qimview.utils.qt_imports     import QtGui, QtWidgets, QtCore
 from qimview.utils.utils          import get_time
-from qimview.utils.viewer_image   import ImageFormat
+from qimview.utils.viewer_image   import ImageFormat, ViewerImage
 from qimview.utils.menu_selection import MenuSelection
 from qimview.utils.mvlabel        import MVLabel
-from qimview.cache                import ImageCache
+from qimview.cache                import ImageCache, all_cache_stats
+from qimview.image_readers        import gb_image_reader, ImageInfo
 from qimview.image_viewers        import (QTImageViewer, GLImageViewer, GLImageViewerShaders,
                                           ImageFilterParameters, ImageFilterParametersGui)
 from qimview.image_viewers.image_viewer import ImageViewer
@@ -118,8 +120,18 @@ class MultiView(QtWidgets.QWidget):
 
         # save images of last visited row
         self.cache = ImageCache() if image_cache is None else image_cache
+        self.cache.signals.image_ready.connect(self.on_image_ready)
         self.image_dict = { }
+        # 'full', '1/2', '1/4', '1/8' or 'auto' to decode each image at the resolution needed by the viewers
         self.read_size = 'full'
+        # Header information of the images, used by the 'auto' read_size
+        self._image_info : Dict[str, Optional[ImageInfo]] = {}
+        # Fast previews of the displayed images that are being read
+        self._previews : Dict[str, Optional[ViewerImage]] = {}
+        # Channel order requested to the readers that can decode both at the same cost, the others return
+        # their native order: the viewers swap the channels at display time, and all the viewer types
+        # share the same cache entries
+        self.use_RGB : bool = False
         self.image1 = dict()
         self.image2 = dict()
         self.button_layout = None
@@ -128,10 +140,18 @@ class MultiView(QtWidgets.QWidget):
 
         self.key_up_callback = None
         self.key_down_callback = None
+        # Prefetching: number of images or image sets to read in advance in the navigation direction
+        self.prefetch_count    : int = 2
+        self.prefetch_callback : Optional[Callable[[int], Optional[dict]]] = None
+        # Last navigation steps within the images (left/right) and between image sets (up/down)
+        self._image_step       : int = 1
+        self._set_step         : int = 1
         self.output_image_label = dict()
 
         self.output_label_current_image   : str = ''
         self.output_label_reference_image : str = ''
+        # Filename and read_size of the reference image pinned in the cache
+        self._pinned_reference : Optional[Tuple[str, str]] = None
         self.add_context_menu()
         
         # Parameter to set the number of columns in the viewer grid layout
@@ -153,6 +173,17 @@ class MultiView(QtWidgets.QWidget):
     def set_key_down_callback(self, c):
         self.key_down_callback = c
 
+    def set_prefetch_callback(self, c: Optional[Callable[[int], Optional[dict]]]):
+        """ Set the callback giving the images dictionary of the image set at an offset from the current one,
+            as navigated by the key up (-1) and key down (+1) callbacks, or None if there is no such set.
+            It allows to prefetch the next image sets.
+        """
+        self.prefetch_callback = c
+
+    def set_prefetch_count(self, n: int):
+        """ Number of images and image sets read in advance in the navigation direction, 0 to disable """
+        self.prefetch_count = n
+
     def add_context_menu(self):
         self.setContextMenuPolicy(QtCore.Qt.ContextMenuPolicy.CustomContextMenu)
         self.customContextMenuRequested.connect(self.show_context_menu)
@@ -161,9 +192,14 @@ class MultiView(QtWidgets.QWidget):
         self._default_viewer_mode = ViewerType.QT_VIEWER.name
         self.viewer_mode_selection = MenuSelection("Viewer mode", 
             self._context_menu, self.viewer_modes, self._default_viewer_mode, self.update_viewer_mode)
+        read_sizes = { r:r for r in ['full', '1/2', '1/4', '1/8', 'auto'] }
+        self.read_size_selection = MenuSelection("Read size",
+            self._context_menu, read_sizes, self.read_size, self.update_read_size)
         self._context_menu.addSeparator()
         action = self._context_menu.addAction("Reset viewers")
         action.triggered.connect(self.reset_viewers)
+        action = self._context_menu.addAction("Cache statistics")
+        action.triggered.connect(self.show_cache_stats)
 
     def reset_viewers(self):
         for v in self.image_viewers:
@@ -181,10 +217,30 @@ class MultiView(QtWidgets.QWidget):
         self.viewer_grid_layout.update()
         self.update_image()
 
+    def show_cache_stats(self):
+        """ Dialog with the statistics of all the caches, the full snapshot is in the details as json """
+        stats = all_cache_stats()
+        text = "| cache | hits | misses | stale | hit ratio | evictions | in (Mb) | out (Mb) | mean load (ms) |\n"
+        text += "|---|---|---|---|---|---|---|---|---|\n"
+        for name, s in stats.items():
+            text += (f"| {name} | {s['hits']} | {s['misses']} | {s['stale']} | {s['hit_ratio']:0.2f} | "
+                     f"{s['evictions']} | {s['bytes_in']/(1024*1024):0.0f} | {s['bytes_out']/(1024*1024):0.0f} | "
+                     f"{s['mean_load_ms']:0.1f} |\n")
+        mb = QtWidgets.QMessageBox(self)
+        mb.setWindowTitle("Cache statistics")
+        mb.setTextFormat(QtCore.Qt.TextFormat.MarkdownText)
+        mb.setText(text)
+        mb.setDetailedText(json.dumps(stats, indent=2))
+        mb.exec()
+
     def update_viewer_mode(self):
         viewer_mode = self.viewer_mode_selection.get_selection_value()
         self.image_viewer_class = self.image_viewer_classes[viewer_mode]
 
+    def update_read_size(self):
+        self.set_read_size(self.read_size_selection.get_selection_value())
+        self.update_image()
+
     def show_context_menu(self, pos):
         self._context_menu.show()
         self._context_menu.popup( self.mapToGlobal(pos) )
@@ -244,9 +300,68 @@ class MultiView(QtWidgets.QWidget):
         return types.MethodType(mouse_double_click, self)
 
     def set_read_size(self, read_size):
+        # No need to reset the cache: each read_size is cached separately,
+        # and lower resolutions are computed from cached higher ones
         self.read_size = read_size
-        # reset cache
-        self.cache.reset()
+
+    def auto_read_size(self, image_filename : str) -> str:
+        """ Lowest resolution that still has at least one image pixel per screen pixel in the active viewer,
+            at its current zoom """
+        # runs in the UI thread: only the header is read, formats without probe are read at full resolution
+        if not gb_image_reader.has_probe(image_filename): return 'full'
+        if image_filename not in self._image_info:
+            self._image_info[image_filename] = gb_image_reader.probe(image_filename, full_read=False)
+        info = self._image_info[image_filename]
+        if info is None or info.width == 0 or info.height == 0: return 'full'
+        viewer = self._active_viewer if self._active_viewer in self.image_viewers else None
+        # Before the viewers are shown, their size is not known yet: use the whole widget
+        widget = viewer.widget if viewer is not None and viewer.widget.isVisible() else self
+        ratio = widget.devicePixelRatioF()
+        # screen pixels per image pixel
+        display_ratio = min(widget.width()*ratio/info.width, widget.height()*ratio/info.height)
+        if viewer is not None:
+            scale = viewer.current_scale
+            if viewer.roi_zoom > 0 and gb_image_reader.supports_roi(image_filename):
+                # higher zooms display regions decoded at full resolution
+                scale = min(scale, viewer.roi_zoom)
+            display_ratio *= scale
+        for read_size, downscale in (('1/8', 8), ('1/4', 4), ('1/2', 2)):
+            if downscale * display_ratio <= 1:
+                return read_size
+        return 'full'
+
+    def image_read_size(self, image_filename : str) -> str:
+        """ Read size used to display the image: the current read_size, or in 'auto' mode the resolution
+            needed by the viewer, or a finer one already in the cache """
+        if self.read_size != 'auto': return self.read_size
+        needed = self.auto_read_size(image_filename)
+        read_sizes = ['1/8', '1/4', '1/2', 'full']
+        for read_size in read_sizes[read_sizes.index(needed)+1:]:
+            if self.cache.has_image(image_filename, read_size):
+                return read_size
+        return needed
+
+    def _group_by_read_size(self, image_filenames : List[str]) -> Dict[str, List[str]]:
+        groups : Dict[str, List[str]] = {}
+        for f in image_filenames:
+            groups.setdefault(self.image_read_size(f), []).append(f)
+        return groups
+
+    def check_read_size(self) -> None:
+        """ In 'auto' mode, read in background the displayed images at a finer resolution when the viewers
+            are zoomed in or enlarged, they are displayed by on_image_ready() once read """
+        if self.read_size != 'auto': return
+        names = [ self.output_label_reference_image ]
+        names.extend(viewer.image_name for viewer in self.image_viewers[:self.nb_viewers_used])
+        image_filenames = list(dict.fromkeys(self.image_dict[name] for name in names
+                                             if self.image_dict.get(name, None) is not None))
+        missing = [ f for f in image_filenames if not self.cache.has_image(f, self.image_read_size(f)) ]
+        if len(missing)>0:
+            self.cache_read_images(missing)
+
+    def resizeEvent(self, event : QtGui.QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self.check_read_size()
 
     def update_image_intensity_event(self):
         self.update_image_parameters()
@@ -299,6 +414,8 @@ class MultiView(QtWidgets.QWidget):
             self.image_viewers[n].image_name = image_names[min(n,len(image_names)-1)]
 
     def update_reference(self) -> None:
+        # If the reference image is not read yet, it is set by display_images() once read
+        if not self.is_image_ready(self.output_label_reference_image): return
         reference_image = self.get_output_image(self.output_label_reference_image)
         for n in range(self.nb_viewers_used):
             viewer = self.image_viewers[n]
@@ -456,8 +573,9 @@ class MultiView(QtWidgets.QWidget):
             image_transform = None
             self.print_log(f"MultiView.get_output_image() image_filename:{image_filename}")
 
-            image_data, _ = self.cache.get_image(image_filename, self.read_size, verbose=self.show_timing_detailed(),
-                                                use_RGB=not self.use_opengl, image_transform=image_transform)
+            image_data, _ = self.cache.get_image(image_filename, self.image_read_size(image_filename),
+                                                 verbose=self.show_timing_detailed(),
+                                                use_RGB=self.use_RGB, image_transform=image_transform)
         # elif isinstance(img, np.ndarray):
         #     if len(img.shape) == 3 and img.shape[2]==3:
         #         image_data = ViewerImage(img)
@@ -502,9 +620,36 @@ class MultiView(QtWidgets.QWidget):
         image_transform = None
         if reload:
             for f in image_filenames:
-                self.cache.remove(f)
-        self.cache.add_images(image_filenames, self.read_size, verbose=False, use_RGB=not self.use_opengl,
-                             image_transform=image_transform)
+                self.cache.remove_image(f)
+        # Returns immediately, the images are displayed by on_image_ready() once read
+        for n, (read_size, filenames) in enumerate(self._group_by_read_size(image_filenames).items()):
+            self.cache.add_images_async(filenames, read_size, verbose=False, use_RGB=self.use_RGB,
+                                        image_transform=image_transform, cancel=(n==0))
+
+    def prefetch_images(self) -> None:
+        """ Read in background the images that are likely to be displayed next, based on the last
+            navigation directions. Previous prefetch requests not started yet are cancelled.
+        """
+        if self.prefetch_count <= 0 or len(self.image_list) == 0: return
+        image_filenames = []
+        # Next images of the current set, if they are not all displayed
+        if self.nb_viewers_used < len(self.image_list) and self.output_label_current_image in self.image_list:
+            current_pos = self.image_list.index(self.output_label_current_image)
+            nb_images = len(self.image_list)
+            for k in range(1, min(self.prefetch_count, nb_images-1)+1):
+                image_filenames.append(self.image_dict[self.image_list[(current_pos+k*self._image_step)%nb_images]])
+        # Displayed images of the next image sets, then of the previous one
+        if self.prefetch_callback is not None:
+            displayed = [ viewer.image_name for viewer in self.image_viewers[:self.nb_viewers_used] ]
+            offsets = [ k*self._set_step for k in range(1, self.prefetch_count+1) ] + [ -self._set_step ]
+            for offset in offsets:
+                images = self.prefetch_callback(offset)
+                if images is None: continue
+                image_filenames.extend(images[name] for name in displayed if name in images)
+        # remove duplicates keeping the order
+        image_filenames = list(dict.fromkeys(f for f in image_filenames if f is not None))
+        for n, (read_size, filenames) in enumerate(self._group_by_read_size(image_filenames).items()):
+            self.cache.prefetch_images(filenames, read_size, use_RGB=self.use_RGB, cancel=(n==0))
 
     def update_label_fonts(self):
         # Update selected image label, we could do it later too
@@ -537,6 +682,8 @@ class MultiView(QtWidgets.QWidget):
                 v.viewer_update()
                 # Force immediate paint
                 # viewer.repaint()
+        # zooming in may need a finer resolution
+        self.check_read_size()
     
     def set_clipboard(self, clipboard : Optional[QtGui.QClipboard], save_image: bool):
         self._clipboard            = clipboard
@@ -593,46 +740,105 @@ class MultiView(QtWidgets.QWidget):
         # print(f"image filenames {image_filenames}")
         self.cache_read_images(image_filenames, reload=reload)
 
-        try:
-            current_image = self.get_output_image(self.output_label_current_image)
-            if current_image is None: return
-        except Exception as e:
-            print("Error: failed to get image {}: {}".format(self.output_label_current_image, e))
-            return
+        current_viewer = self._active_viewer
+        current_viewer.is_active = True
+        current_viewer.image_name = self.output_label_current_image
+
+        # Images already in the cache are displayed now, the others by on_image_ready() when they are read
+        self.display_images()
 
-        # print(f"cur {self.output_label_current_image}")
-        current_filename = self.output_image_label[self.output_label_current_image]
+        # self.image_scroll_area.adjustSize()
+        # if self.show_timing():
+        print(f" Update image took {(get_time() - update_image_start)*1000:0.0f} ms")
 
-        # if self.show_timing_detailed(): time_spent = get_time() - update_image_start
+        self.prefetch_images()
 
-        self.setMessage("Image: {0}".format(current_filename))
+    def is_image_ready(self, im_string_id : str) -> bool:
+        """ Check if the image with given label is available in the cache at the current read size """
+        image_filename = self.image_dict.get(im_string_id, None)
+        return image_filename is not None and self.cache.has_image(image_filename, self.image_read_size(image_filename))
 
-        current_viewer = self._active_viewer
-        current_viewer.is_active = True
-        current_viewer.image_name = self.output_label_current_image
-        current_viewer.set_image(current_image)
+    def on_image_ready(self, image_filename : str, read_size : str, ok : bool) -> None:
+        """ Called when an image requested by update_image() has been read """
+        if read_size != self.image_read_size(image_filename): return
+        if not ok:
+            print(f"failed to get image {image_filename}")
+            return
+        displayed = [ self.output_label_reference_image ]
+        displayed.extend(viewer.image_name for viewer in self.image_viewers[:self.nb_viewers_used])
+        if image_filename in [ self.image_dict.get(name, None) for name in displayed ]:
+            self.display_images()
+
+    def get_preview(self, im_string_id : str) -> Optional[ViewerImage]:
+        """ Preview of the image with given label, like the thumbnail embedded in raw files, displayed
+            until the image is read """
+        image_filename = self.image_dict.get(im_string_id, None)
+        if image_filename is None or not gb_image_reader.has_preview(image_filename): return None
+        if image_filename not in self._previews:
+            self._previews[image_filename] = gb_image_reader.read_preview(image_filename, use_RGB=self.use_RGB)
+        return self._previews[image_filename]
+
+    def pin_reference(self) -> None:
+        """ Pin the displayed reference image in the cache so that it is never evicted while compared,
+            and unpin the previous one """
+        reference = None
+        if self.nb_viewers_used >= 2:
+            image_filename = self.image_dict.get(self.output_label_reference_image, None)
+            if image_filename is not None:
+                reference = (image_filename, self.image_read_size(image_filename))
+        if reference == self._pinned_reference: return
+        if self._pinned_reference is not None:
+            self.cache.unpin_image(*self._pinned_reference)
+        if reference is not None:
+            self.cache.pin_image(*reference)
+        self._pinned_reference = reference
+
+    def display_images(self) -> None:
+        """ Set the images of the viewers that are available in the cache and update the viewers,
+            the other viewers keep their previous image until it is called again by on_image_ready()
+        """
+        if self.output_label_current_image == "" or len(self.image_viewers) == 0: return
+        self.pin_reference()
 
         # print(f"ref {self.output_label_reference_image}")
-        if self.output_label_reference_image==self.output_label_current_image:
-            reference_image = current_image
-        else:
+        reference_image = None
+        if self.nb_viewers_used >= 2 and self.is_image_ready(self.output_label_reference_image):
             reference_image = self.get_output_image(self.output_label_reference_image)
 
-        if self.nb_viewers_used >= 2:
-            for n in range(self.nb_viewers_used):
-                viewer : ImageViewer = self.image_viewers[n]
-                if viewer != self._active_viewer:
-                    # Update viewer images
-                    try:
-                        viewer_image = self.get_output_image(viewer.image_name)
-                    except Exception as e:
-                        print("Error: failed to get image {}: {}".format(viewer.image_name, e))
-                        viewer_image = current_image
-                    # Be sure to update image data
-                    viewer.set_image(viewer_image)
-                    # set reference image
-                    viewer.set_image_ref(reference_image)
-                    viewer.image_ref_name = self.output_label_reference_image
+        current_ready = False
+        waiting = set()
+        for n in range(self.nb_viewers_used):
+            viewer : ImageViewer = self.image_viewers[n]
+            if not self.is_image_ready(viewer.image_name):
+                image_filename = self.image_dict.get(viewer.image_name, None)
+                waiting.add(image_filename)
+                current = viewer.get_image()
+                # keep the image if it is already displayed at another resolution
+                if current is None or current.filename != image_filename:
+                    preview = self.get_preview(viewer.image_name)
+                    if preview is not None:
+                        viewer.set_image(preview)
+                continue
+            # Update viewer images
+            try:
+                viewer_image = self.get_output_image(viewer.image_name)
+            except Exception as e:
+                print("Error: failed to get image {}: {}".format(viewer.image_name, e))
+                continue
+            if viewer_image is None: continue
+            # Be sure to update image data
+            viewer.set_image(viewer_image)
+            if viewer == self._active_viewer:
+                current_ready = True
+                # print(f"cur {self.output_label_current_image}")
+                self.setMessage("Image: {0}".format(self.output_image_label[viewer.image_name]))
+            if reference_image is not None:
+                # set reference image
+                viewer.set_image_ref(reference_image)
+                viewer.image_ref_name = self.output_label_reference_image
+
+        # previews are only kept for the images still being read
+        self._previews = { f: p for f, p in self._previews.items() if f in waiting }
 
         # if self._save_image_clipboard and self._clipboard:
         #     print("set save image to clipboard")
@@ -652,17 +858,13 @@ class MultiView(QtWidgets.QWidget):
                 if viewer.widget.isHidden(): viewer.widget.show()
                 else:                        viewer.widget.update()
 
-        if self._save_image_clipboard:
+        if self._save_image_clipboard and current_ready:
             print("set save image to clipboard")
             self._active_viewer.set_clipboard(self._clipboard, True)
             self._active_viewer.widget.repaint()
             print("end save image to clipboard")
             self._active_viewer.set_clipboard(None, False)
 
-        # self.image_scroll_area.adjustSize()
-        # if self.show_timing():
-        print(f" Update image took {(get_time() - update_image_start)*1000:0.0f} ms")
-
     def set_number_of_viewers(self, nb_viewers: int = 1, max_columns : int = 0) -> None:
         self.print_log("*** set_number_of_viewers()")
         if nb_viewers<1: return
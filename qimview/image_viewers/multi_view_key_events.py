@@ -109,6 +109,7 @@ class MultiViewKeyEvents:
     def upCallBack(self) -> bool:
         """ Call user-defined callback """
         if self._multiview.key_up_callback is not None:
+            self._multiview._set_step = -1
             self._multiview.key_up_callback()
             return True
         return False 
@@ -116,6 +117,7 @@ class MultiViewKeyEvents:
     def downCallBack(self) -> bool:
         """ Call user-defined callback """
         if self._multiview.key_down_callback is not None:
+            self._multiview._set_step = 1
             self._multiview.key_down_callback()
             return True
         return False 
@@ -164,6 +166,7 @@ class MultiViewKeyEvents:
             mv = self._multiview
             current_pos = mv.image_list.index(mv.output_label_current_image)
             nb_images = len(mv.image_list)
+            mv._image_step = -1
             mv.update_image(mv.image_list[(current_pos+nb_images-1)%nb_images])
             return True
         except ValueError:
@@ -175,6 +178,7 @@ class MultiViewKeyEvents:
             mv = self._multiview
             current_pos = mv.image_list.index(mv.output_label_current_image)
             nb_images = len(mv.image_list)
+            mv._image_step = 1
             mv.update_image(mv.image_list[(current_pos+1)%nb_images])
             return True
         except ValueError:
@@ -9,7 +9,9 @@ from qimview.utils.qt_imports import *
 from qimview.utils.viewer_image import *
 from qimview.utils.utils import clip_value
 from qimview.utils.utils import get_time
+from qimview.utils.thread_pool import ThreadPool
 from qimview.tests_utils.qtdump import *
+from qimview.image_readers import gb_image_reader
 # Renaming manually since syntax checker has issues with cv2
 import cv2
 # from cv2 import resize          as opencv_resize
@@ -19,9 +21,13 @@ import cv2
 # from cv2 import convertScaleAbs as opencv_convertScaleAbs
 # from cv2 import INTER_NEAREST   as opencv_INTER_NEAREST
 # from cv2 import INTER_AREA      as opencv_INTER_AREA
+import math
 import numpy as np
 from typing import Tuple, Optional
 
+# Rectangle x, y, width, height in pixels of the full resolution image
+Rect = Tuple[int, int, int, int]
+
 try:
     import qimview_cpp
 except Exception as e:
@@ -61,6 +67,14 @@ class QTImageViewer(ImageViewer, BaseWidget):
         self.paint_diff_cache = None
         self.diff_image       = None
 
+        # When zoomed in a downscaled image, the displayed region is decoded at full resolution
+        self.roi_zoom = 2
+        # Last decoded region: filename, rectangle and image
+        self._roi           : Optional[Tuple[str, Rect, ViewerImage]] = None
+        self._roi_requested : Optional[Tuple[str, Rect]] = None
+        self._roi_pool      : ThreadPool = ThreadPool()
+        self._roi_pool.setMaxThreadCount(1)
+
         # self.display_timing = False
         if BaseWidget is QOpenGLWidget:
             self.setAutoFillBackground(True)
@@ -179,6 +193,64 @@ class QTImageViewer(ImageViewer, BaseWidget):
         # print(f"output_crop {self.output_crop} new crop {new_crop}")
         return new_crop
 
+    def pyramid_image_data(self, crop) -> Optional[Tuple[np.ndarray, int]]:
+        """ Data of the crop from the tiles of the pyramid of the image, at the level matching the screen
+            resolution, if the displayed level is not fine enough
+            :param crop: relative crop xmin, ymin, xmax, ymax
+            :return: data and its downscale factor
+        """
+        image = self._image
+        if image is None or image.pyramid is None: return None
+        pyramid = image.pyramid
+        x0, y0 = int(crop[0]*pyramid.width), int(crop[1]*pyramid.height)
+        x1, y1 = int(math.ceil(crop[2]*pyramid.width)), int(math.ceil(crop[3]*pyramid.height))
+        ratio = self.devicePixelRatio()
+        width, height = int(self.width()*ratio), int(self.height()*ratio)
+        if (x1-x0) / image.downscale >= width or (y1-y0) / image.downscale >= height:
+            # the displayed level has enough pixels
+            return None
+        return pyramid.read_region(x0, y0, x1, y1, width, height, use_RGB=image.channels != ImageFormat.CH_BGR)
+
+    def roi_image_data(self, crop) -> Optional[np.ndarray]:
+        """ Full resolution data of the crop if its region has been decoded, otherwise request the
+            decoding of the region in background and return None
+            :param crop: relative crop xmin, ymin, xmax, ymax
+        """
+        image = self._image
+        if self.roi_zoom <= 0 or self.current_scale < self.roi_zoom or image is None or image.filename is None \
+                or image.downscale <= 1 or image.u is not None or image.pyramid is not None:
+            return None
+        if image.channels not in ImageFormat.CH_RGBFORMATS() + ImageFormat.CH_SCALARFORMATS(): return None
+        filename = image.filename
+        if not gb_image_reader.supports_roi(filename): return None
+        height, width = image.data.shape[:2]
+        full_width, full_height = width*image.downscale, height*image.downscale
+        x0, y0 = int(crop[0]*full_width), int(crop[1]*full_height)
+        x1, y1 = int(math.ceil(crop[2]*full_width)), int(math.ceil(crop[3]*full_height))
+        if self._roi is not None:
+            roi_filename, (rx, ry, rw, rh), roi_image = self._roi
+            if roi_filename == filename and roi_image.channels == image.channels and \
+                    rx <= x0 and ry <= y0 and x1 <= rx+rw and y1 <= ry+rh:
+                return roi_image.data[y0-ry:y1-ry, x0-rx:x1-rx]
+        # request a larger region to allow panning without decoding again
+        margin_x, margin_y = (x1-x0)//2, (y1-y0)//2
+        rect = (max(0, x0-margin_x), max(0, y0-margin_y), 0, 0)
+        rect = (rect[0], rect[1], min(full_width, x1+margin_x)-rect[0], min(full_height, y1+margin_y)-rect[1])
+        if self._roi_requested != (filename, rect):
+            self._roi_requested = (filename, rect)
+            self._roi_pool.cancel('roi')
+            self._roi_pool.submit(gb_image_reader.read_roi, filename, rect, image.channels == ImageFormat.CH_RGB,
+                                  tag='roi', result_cb=lambda res, f=filename: self.roi_read(f, res))
+        return None
+
+    def roi_read(self, filename : str, res : Optional[Tuple[ViewerImage, Rect]]) -> None:
+        """ Called in the Qt thread when a region requested by roi_image_data() is decoded """
+        self._roi_requested = None
+        if res is None or self._image is None or self._image.filename != filename: return
+        self._roi = (filename, res[1], res[0])
+        self.paint_cache = None
+        self.update()
+
     def apply_filters(self, current_image: ViewerImage) -> np.ndarray:
         self.print_log(f"current_image.data.shape {current_image.data.shape}")
         # return current_image
@@ -433,6 +505,11 @@ class QTImageViewer(ImageViewer, BaseWidget):
         if not use_cache:
             im1 = self._image.data
             im2 = self._image_ref.data
+            if self._image.channels != self._image_ref.channels and \
+                    self._image.channels in ImageFormat.CH_RGBFORMATS() and \
+                    self._image_ref.channels in ImageFormat.CH_RGBFORMATS():
+                # images read in different channel orders
+                im2 = np.ascontiguousarray(im2[:, :, ::-1])
             # TODO: get factor from parameters ...
             # factor = int(self.diff_color_slider.value())
             # print(f'factor = {factor}')
@@ -563,6 +640,17 @@ class QTImageViewer(ImageViewer, BaseWidget):
         cropped_image_shape = image_data.shape
         self.add_time('crop', time1)
 
+        if not show_diff and not self._show_overlap:
+            # Zoomed in a downscaled image: display the region decoded at full resolution when available
+            pyramid_data = self.pyramid_image_data(c)
+            if pyramid_data is not None:
+                image_data, downscale = pyramid_data
+            else:
+                roi_data = self.roi_image_data(c)
+                if roi_data is not None:
+                    image_data = roi_data
+                    downscale = 1
+
         # time1 = get_time()
         image_height, image_width  = image_data.shape[:2]
         ratio_width = float(label_width) / image_width
@@ -622,7 +710,7 @@ class QTImageViewer(ImageViewer, BaseWidget):
 
             # self.print_log("use_opencv_resize {} channels {}".format(use_opencv_resize, current_image.channels))
             # if ratio<1 we want anti aliasing and we want to resize as soon as possible to reduce computation time
-            if use_opencv_resize and not resize_applied and channels == ImageFormat.CH_RGB:
+            if use_opencv_resize and not resize_applied and channels in ImageFormat.CH_RGBFORMATS():
 
                 prev_shape = image_data.shape
                 initial_type = image_data.dtype
@@ -739,8 +827,11 @@ class QTImageViewer(ImageViewer, BaseWidget):
 
         if not current_image.flags['C_CONTIGUOUS']:
             current_image = np.require(current_image, np.uint8, 'C')
+        # apply_filters() of qimview_cpp outputs RGB, the python version keeps the BGR order
+        qimage_format = QtGui.QImage.Format_BGR888 if channels == ImageFormat.CH_BGR and not HAS_CPPBIND \
+                        else QtGui.QImage.Format_RGB888
         qimage = QtGui.QImage(current_image.data, current_image.shape[1], current_image.shape[0],
-                                    current_image.strides[0], QtGui.QImage.Format_RGB888)
+                                    current_image.strides[0], qimage_format)
         # self.add_time('QtGui.QPixmap',time1)
 
         assert resize_applied, "Image resized should be applied at this point"
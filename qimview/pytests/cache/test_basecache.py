@@ -0,0 +1,124 @@
+import threading
+import time
+import pytest
+
+# the caches need Qt for their thread pools
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.cache.basecache import BaseCache
+
+
+class BytesCache(BaseCache[str, bytes, None]):
+    """ Cache charging the length of the values, with sizes in bytes """
+    def __init__(self, max_size):
+        BaseCache.__init__(self, "BytesCache")
+        self.cache_unit = 1
+        self.max_cache_size = max_size
+
+    def entry_size(self, id, value, extra):
+        return len(value)
+
+
+@pytest.fixture
+def cache():
+    return BytesCache(100)
+
+
+def test_lru_eviction(cache):
+    for id in 'abc':
+        cache.append(id, b'x'*40, None, check_size=False)
+    # 'a' becomes the most recently used
+    assert cache.search('a') is not None
+    cache.check_size_limit()
+    assert list(cache.cache_list) == ['c', 'a']
+    assert cache.cache_size == 80
+
+
+def test_running_size(cache):
+    cache.append('a', b'x'*10, None)
+    cache.append('b', b'x'*20, None)
+    assert cache.cache_size == 30
+    # replacing an element charges the difference
+    cache.append('a', b'x'*5, None)
+    assert cache.cache_size == 25
+    assert cache.remove('b')
+    assert not cache.remove('b')
+    assert cache.cache_size == 5
+    assert cache.check_cache_size()
+
+
+def test_get_or_load(cache):
+    value, cached = cache.get_or_load('a', lambda: (b'abc', None))
+    assert value == b'abc' and not cached
+    value, cached = cache.get_or_load('a', lambda: pytest.fail("loaded twice"))
+    assert value == b'abc' and cached
+    # failed loads are not cached
+    value, cached = cache.get_or_load('b', lambda: None)
+    assert value is None and not cache.has('b')
+
+
+def test_outdated_element_reloaded(cache):
+    cache.get_or_load('a', lambda: (b'old', None))
+    value, cached = cache.get_or_load('a', lambda: (b'new', None), is_valid=lambda elt: elt[1] == b'new')
+    assert value == b'new' and not cached
+    assert cache.stats.stale == 1
+
+
+def test_single_flight(cache):
+    nb_loads = 0
+    started = threading.Event()
+
+    def load():
+        nonlocal nb_loads
+        nb_loads += 1
+        started.set()
+        time.sleep(0.2)
+        return b'value', None
+
+    results = []
+    def get():
+        results.append(cache.get_or_load('a', load))
+    threads = [ threading.Thread(target=get) for _ in range(4) ]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join()
+    assert nb_loads == 1
+    assert sorted(results, key=lambda r: r[1]) == [(b'value', False)] + [(b'value', True)]*3
+    assert cache.stats.waits == 3
+
+
+def test_failed_load_is_retried(cache):
+    def load():
+        raise OSError("unreadable")
+    with pytest.raises(OSError):
+        cache.get_or_load('a', load)
+    assert not cache.is_loading('a')
+    # the next call loads again
+    value, _ = cache.get_or_load('a', lambda: (b'ok', None))
+    assert value == b'ok'
+
+
+
+def test_cold_elements_evicted_first(cache):
+    cache.append('a', b'x'*40, None)
+    cache.append('b', b'x'*40, None)
+    cache.append('prefetched', b'x'*40, None, cold=True)
+    assert not cache.has('prefetched')
+    assert cache.has('a') and cache.has('b')
+
+
+def test_pinned_elements_are_kept(cache):
+    cache.pin('a')
+    cache.append('a', b'x'*60, None)
+    cache.append('b', b'x'*60, None)
+    assert cache.has('a') and not cache.has('b')
+    # only pinned elements remain: the cache stays above its limit
+    cache.append('c', b'x'*60, None, check_size=False)
+    cache.pin('c')
+    cache.check_size_limit()
+    assert cache.has('a') and cache.has('c')
+    cache.unpin('a')
+    cache.check_size_limit()
+    assert not cache.has('a') and cache.has('c')
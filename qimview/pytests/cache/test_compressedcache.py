@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.cache.compressedcache import CompressedImageCache, compress_image, decompress_image
+
+
+def make_image():
+    data = (np.arange(64*48*3, dtype=np.uint16) % 4096).reshape(48, 64, 3)
+    return ViewerImage(data, precision=12, downscale=1, channels=ImageFormat.CH_RGB)
+
+
+def test_compression_round_trip():
+    image = make_image()
+    restored = decompress_image(compress_image(image))
+    assert restored.data.dtype == image.data.dtype
+    assert np.array_equal(restored.data, image.data)
+    assert restored.precision == 12
+
+
+def test_saved_time_is_not_a_load():
+    cache = CompressedImageCache()
+    assert cache.add_image(('key', 1), make_image(), 1.0, saved_time=0.2)
+    assert cache.add_image(('key', 2), make_image(), 1.0, saved_time=0.4)
+    assert cache.load_count == 0 and cache.stats.snapshot()['latency'] == {}
+    assert cache.saved_time_per_hit() == pytest.approx(0.3)
+    assert cache.pop_image(('key', 1)) is not None
+    assert cache.hit_count == 1 and not cache.has(('key', 1))
+    assert cache.pop_image(('key', 1)) is None
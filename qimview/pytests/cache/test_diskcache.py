@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.cache.diskcache import DiskImageCache
+
+
+def make_image(value=0, height=48, width=64):
+    data = ((np.arange(height*width*3, dtype=np.uint16) + value) % 4096).reshape(height, width, 3)
+    return ViewerImage(data, precision=12, downscale=2, channels=ImageFormat.CH_RGB)
+
+
+def write_source(tmp_path, name, content=b'source'):
+    filename = str(tmp_path / name)
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return filename
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = DiskImageCache(str(tmp_path / 'cache'), max_size=10)
+    filename = write_source(tmp_path, 'image.png')
+    image = make_image()
+    assert cache.get(filename, 'half') is None
+    assert cache.put(filename, image, 'half')
+    restored = cache.get(filename, 'half')
+    assert isinstance(restored.data, np.memmap)
+    assert np.array_equal(restored.data, image.data)
+    assert restored.precision == 12 and restored.downscale == 2 and restored.channels == ImageFormat.CH_RGB
+    # the read options are part of the key
+    assert cache.get(filename, 'full') is None
+    assert cache.get(filename, 'half', use_RGB=False) is None
+    # the entries are found again by a new session
+    assert DiskImageCache(str(tmp_path / 'cache'), max_size=10).get(filename, 'half') is not None
+
+
+def test_modified_source_is_not_served(tmp_path):
+    cache = DiskImageCache(str(tmp_path / 'cache'), max_size=10)
+    filename = write_source(tmp_path, 'image.png')
+    assert cache.put(filename, make_image())
+    assert cache.get(filename) is not None
+    write_source(tmp_path, 'image.png', b'modified source')
+    assert cache.get(filename) is None
+    # same size, only the modification time changes
+    assert cache.put(filename, make_image())
+    assert cache.get(filename) is not None
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.get(filename) is None
+
+
+def test_eviction_past_max_size(tmp_path):
+    # each image takes about 0.4 Mb, two of them fit in 1 Mb
+    cache = DiskImageCache(str(tmp_path / 'cache'), max_size=1)
+    filenames = [ write_source(tmp_path, f'image{i}.png') for i in range(3) ]
+    images = [ make_image(i, 256, 256) for i in range(3) ]
+    assert cache.put(filenames[0], images[0])
+    assert cache.put(filenames[1], images[1])
+    # most recently used
+    assert cache.get(filenames[0]) is not None
+    assert cache.put(filenames[2], images[2])
+    assert cache.size <= 1024*1024
+    assert cache.get(filenames[1]) is None
+    assert np.array_equal(cache.get(filenames[0]).data, images[0].data)
+    assert np.array_equal(cache.get(filenames[2]).data, images[2].data)
+    assert len(os.listdir(tmp_path / 'cache')) == 4
+    # images larger than the cache are not saved
+    assert not cache.put(filenames[1], make_image(0, 512, 512))
@@ -0,0 +1,71 @@
+import pytest
+
+# importing the cache package needs Qt
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.cache.eviction import EvictionPolicy, LRUPolicy, GDSFPolicy, create_eviction_policy
+
+
+def test_base_policy_is_abstract():
+    with pytest.raises(TypeError):
+        EvictionPolicy()
+
+
+def test_lru_skips_pinned():
+    policy = LRUPolicy()
+    assert policy.select_victim(['a', 'b', 'c'], set()) == 'a'
+    assert policy.select_victim(['a', 'b', 'c'], {'a'}) == 'b'
+    assert policy.select_victim(['a', 'b'], {'a', 'b'}) is None
+
+
+def insert_all(policy, elements):
+    for id, size, cost in elements:
+        policy.on_insert(id, size, cost)
+
+
+def test_gdsf_evicts_cheap_large_elements_first():
+    policy = GDSFPolicy()
+    # value = frequency * cost / size
+    insert_all(policy, [ ('large_fast', 1000, 0.01), ('small_slow', 10, 1.0), ('medium', 100, 0.1) ])
+    order = ['large_fast', 'small_slow', 'medium']
+    assert policy.select_victim(order, set()) == 'large_fast'
+    policy.on_remove('large_fast')
+    assert policy.select_victim(order[1:], set()) == 'medium'
+
+
+def test_gdsf_frequency_and_pinning():
+    policy = GDSFPolicy()
+    insert_all(policy, [ ('a', 100, 0.1), ('b', 100, 0.1) ])
+    policy.on_access('a')
+    assert policy.select_victim(['a', 'b'], set()) == 'b'
+    assert policy.select_victim(['a', 'b'], {'b'}) == 'a'
+    # the victim stays a candidate until it is removed
+    assert policy.select_victim(['a', 'b'], set()) == 'b'
+    policy.on_remove('b')
+    policy.on_remove('a')
+    assert policy.select_victim([], set()) is None
+
+
+def test_gdsf_ages_old_elements():
+    policy = GDSFPolicy()
+    insert_all(policy, [ ('old', 100, 1.0), ('cheap', 100, 0.1) ])
+    policy.select_victim(['old', 'cheap'], set())
+    policy.on_remove('cheap')
+    # the inflation raises the value of new elements above the values of the old ones
+    for n in range(20):
+        policy.on_insert(f'new{n}', 100, 0.1)
+        victim = policy.select_victim(['old'] + [ f'new{i}' for i in range(n+1) ], set())
+        policy.on_remove(victim)
+        if victim == 'old': break
+    assert victim == 'old'
+
+
+def test_gdsf_cold_insert():
+    policy = GDSFPolicy()
+    insert_all(policy, [ ('a', 1000, 0.01) ])
+    policy.on_insert('prefetched', 10, 1.0, cold=True)
+    assert policy.select_victim(['a', 'prefetched'], set()) == 'prefetched'
+
+
+def test_create_eviction_policy():
+    assert isinstance(create_eviction_policy('gdsf'), GDSFPolicy)
+    assert isinstance(create_eviction_policy('unknown'), LRUPolicy)
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.cache.filecache import FileCache
+from qimview.cache.statcache import gb_stat_cache
+
+
+def write(filename, content):
+    with open(filename, 'wb') as f:
+        f.write(content)
+
+
+def test_rewritten_file_frees_previous_buffer(tmp_path, monkeypatch):
+    # read the key of the file on each call
+    monkeypatch.setattr(gb_stat_cache, '_mode', 'none')
+    filename = str(tmp_path / 'image.jpg')
+    write(filename, b'a'*1000)
+    cache = FileCache()
+    cache.set_use_mmap(False)
+    data, _ = cache.get_file(filename)
+    assert bytes(data) == b'a'*1000
+    previous_key = gb_stat_cache.file_key(gb_stat_cache.abspath(filename))
+    previous_buffer = data.obj
+    del data
+    write(filename, b'b'*3000)
+    data, from_cache = cache.get_file(filename)
+    assert not from_cache and bytes(data) == b'b'*3000
+    assert not cache.has(previous_key) and len(cache.cache) == 1
+    assert cache.cache_size == len(data.obj)
+    # the previous buffer went back to the pool and was reused
+    assert data.obj is previous_buffer
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.cache.imagecache import ImageCache, mapped_size
+
+
+def test_memory_mapped_images_charged_their_mapping(tmp_path):
+    filename = str(tmp_path / 'image.npy')
+    np.save(filename, np.zeros((400, 500), dtype=np.uint16))
+    data = np.load(filename, mmap_mode='r')
+    reduced = data[::8, ::8]
+    assert mapped_size(reduced) == mapped_size(data) >= data.nbytes
+    cache = ImageCache()
+    image = ViewerImage(reduced, precision=16, downscale=8, channels=ImageFormat.CH_Y)
+    assert cache.entry_size(('key', 8), image, 0) >= data.nbytes
+    copy = ViewerImage(np.array(reduced), precision=16, downscale=8, channels=ImageFormat.CH_Y)
+    assert mapped_size(copy.data) == copy.data.nbytes
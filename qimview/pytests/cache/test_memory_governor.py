@@ -0,0 +1,82 @@
+from collections import namedtuple
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.cache import memory_governor
+from qimview.cache.basecache import BaseCache
+from qimview.cache.memory_governor import MemoryGovernor
+
+Mb = 1024*1024
+VirtualMemory = namedtuple('VirtualMemory', ['total', 'available'])
+
+
+class FakeCache(BaseCache[str, bytes, float]):
+    """ Cache whose hits and time saved per hit are set by the test """
+    def __init__(self, name, saved_time):
+        super().__init__(name)
+        self.hits = 0
+        self.saved_time = saved_time
+
+    @property
+    def hit_count(self) -> int:
+        return self.hits
+
+    def saved_time_per_hit(self) -> float:
+        return self.saved_time
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """ System memory seen by the governor, available memory can be changed by the test """
+    state = VirtualMemory(total=16*1024*Mb, available=8*1024*Mb)
+    memory = { 'state': state }
+    monkeypatch.setattr(memory_governor.psutil, 'virtual_memory', lambda: memory['state'])
+    return memory
+
+
+@pytest.fixture
+def governor(memory):
+    governor = MemoryGovernor()
+    governor.max_budget = governor.budget = 100*Mb
+    governor.min_budget = 10*Mb
+    governor.min_available = 1024*Mb
+    yield governor
+    governor._timer.stop()
+
+
+def total_size(caches):
+    return sum(c.max_cache_size for c in caches)*Mb
+
+
+def test_budget_split_by_time_saved(governor):
+    fast = FakeCache('fast', saved_time=0.01)
+    slow = FakeCache('slow', saved_time=0.1)
+    governor.register(fast, weight=1)
+    governor.register(slow, weight=1)
+    assert fast.max_cache_size == slow.max_cache_size == 50
+    # same number of hits, the slow cache saves 10 times more time per hit
+    for _ in range(30):
+        fast.hits += 10
+        slow.hits += 10
+        governor.update()
+        assert total_size([fast, slow]) <= governor.budget
+    assert governor._shares[slow] == pytest.approx(10/11, abs=0.01)
+    assert slow.max_cache_size > 85 and fast.max_cache_size >= 5
+    # no hits since the previous check: the shares are kept
+    governor.update()
+    assert governor._shares[slow] == pytest.approx(10/11, abs=0.01)
+
+
+def test_budget_reduced_when_memory_is_low(governor, memory):
+    caches = [ FakeCache('a', saved_time=0.05), FakeCache('b', saved_time=0.05) ]
+    for c in caches:
+        governor.register(c, weight=1)
+    memory['state'] = VirtualMemory(total=16*1024*Mb, available=512*Mb)
+    governor.update()
+    assert governor.budget == governor.min_budget
+    assert total_size(caches) <= governor.budget
+    # memory released: back to the maximal budget
+    memory['state'] = VirtualMemory(total=16*1024*Mb, available=8*1024*Mb)
+    governor.update()
+    assert governor.budget == governor.max_budget
+    assert total_size(caches) <= governor.budget
@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.cache.read_engine import BufferPool, ReadEngine
+
+
+def test_capacity():
+    assert BufferPool.capacity(0) == BufferPool.min_capacity
+    assert BufferPool.capacity(1000) == BufferPool.min_capacity
+    # rounded up to 1/8 of the power of 2
+    assert BufferPool.capacity(1024*1024) == 1024*1024
+    assert BufferPool.capacity(1024*1024+1) == 1024*1024 + 256*1024
+    for size in [ 100*1000, 3*1000*1000, 77777777 ]:
+        capacity = BufferPool.capacity(size)
+        assert size <= capacity <= size*9/8 + BufferPool.min_capacity
+
+
+def test_in_use():
+    buffer = bytearray(100)
+    assert not BufferPool.in_use(buffer)
+    view = memoryview(buffer)[:10]
+    assert BufferPool.in_use(buffer)
+    view.release()
+    assert not BufferPool.in_use(buffer)
+    assert len(buffer) == 100
+
+
+def test_pool_reuse_and_limit():
+    pool = BufferPool(max_size=3*BufferPool.min_capacity)
+    buffer = pool.acquire(1000)
+    pool.release(buffer)
+    assert pool.acquire(2000) is buffer
+    for _ in range(4):
+        pool.release(bytearray(BufferPool.min_capacity))
+    # the pool keeps at most max_size bytes
+    assert pool._free_size == 3*BufferPool.min_capacity
+    pool.clear()
+    assert pool.acquire(1000) is not buffer
+
+
+def test_read_reuses_retired_buffers(tmp_path):
+    filename = str(tmp_path / 'file.bin')
+    content = bytes(range(256))*100
+    with open(filename, 'wb') as f:
+        f.write(content)
+    engine = ReadEngine(max_concurrency=2)
+    data = engine.read(filename)
+    assert bytes(data) == content
+    buffer = data.obj
+    engine.retire(data)
+    # still used by data
+    engine._collect_retired()
+    assert engine.read(filename).obj is not buffer
+    data.release()
+    assert engine.read(filename).obj is buffer
+    empty = str(tmp_path / 'empty.bin')
+    open(empty, 'wb').close()
+    assert engine.read(empty) == b''
@@ -0,0 +1,74 @@
+import os
+import time
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.qt_imports import QtCore
+from qimview.cache import statcache
+from qimview.cache.statcache import StatCache
+
+
+def write(filename, content):
+    with open(filename, 'wb') as f:
+        f.write(content)
+
+
+def wait_for(condition, timeout=3):
+    """ Process the Qt events until condition() is True """
+    app = QtCore.QCoreApplication.instance()
+    start = time.perf_counter()
+    while not condition() and time.perf_counter()-start < timeout:
+        if app is not None:
+            app.processEvents()
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    filename = str(tmp_path / 'image.jpg')
+    write(filename, b'x'*10)
+    return filename
+
+
+@pytest.fixture
+def app():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def test_polling_before_qt_application(image_file, monkeypatch):
+    monkeypatch.setattr(statcache, 'has_qt_application', lambda: False)
+    cache = StatCache(mode='watcher', poll_interval=0.05)
+    assert cache.file_key(image_file)[2] == 10
+    write(image_file, b'x'*20)
+    assert wait_for(lambda: cache.file_key(image_file)[2] == 20)
+    assert cache._watcher is None
+
+
+def test_watcher(image_file, app):
+    cache = StatCache(mode='watcher')
+    assert cache.file_key(image_file)[2] == 10
+    assert cache._watcher is not None
+    write(image_file, b'x'*20)
+    assert wait_for(lambda: cache.file_key(image_file)[2] == 20)
+
+
+def test_files_not_watched_are_not_cached(image_file, app, monkeypatch):
+    class FullWatcher(QtCore.QFileSystemWatcher):
+        """ Watcher having reached the limit of watched files """
+        def addPath(self, path):
+            return False
+    monkeypatch.setattr(statcache.QtCore, 'QFileSystemWatcher', FullWatcher)
+    cache = StatCache(mode='watcher')
+    assert cache.file_key(image_file)[2] == 10
+    write(image_file, b'x'*20)
+    assert cache.file_key(image_file)[2] == 20
+
+
+def test_abspath_and_aliases(image_file, tmp_path):
+    cache = StatCache(mode='polling', poll_interval=60)
+    link = str(tmp_path / 'link.jpg')
+    os.symlink(image_file, link)
+    key = cache.file_key(cache.abspath(image_file))
+    assert cache.file_key(cache.abspath(link)) == key
+    assert sorted(cache.aliases(key)) == sorted([image_file, link])
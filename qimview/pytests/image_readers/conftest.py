@@ -0,0 +1,47 @@
+import struct
+import numpy as np
+import pytest
+
+
+def tiff_file(filename, data, tile_size=None):
+    """ Uncompressed little-endian TIFF of an 8-bit image of shape (height, width) or (height, width, samples),
+        tiled if tile_size is set, otherwise in a single strip """
+    if data.ndim == 2:
+        data = data[:, :, np.newaxis]
+    height, width, samples = data.shape
+    if tile_size is None:
+        chunks = [ data ]
+    else:
+        t = tile_size
+        padded = np.zeros(((height+t-1)//t*t, (width+t-1)//t*t, samples), dtype=np.uint8)
+        padded[:height, :width] = data
+        chunks = [ padded[y:y+t, x:x+t] for y in range(0, padded.shape[0], t) for x in range(0, padded.shape[1], t) ]
+    pixels = b''.join(np.ascontiguousarray(c).tobytes() for c in chunks)
+    offsets = [ 8 + sum(c.nbytes for c in chunks[:n]) for n in range(len(chunks)) ]
+    sizes = [ c.nbytes for c in chunks ]
+    # values of the entries that do not fit in 4 bytes follow the directory
+    entries = [ (256, 4, [width]), (257, 4, [height]), (258, 3, [8]*samples), (259, 3, [1]),
+                (262, 3, [2 if samples >= 3 else 1]), (277, 3, [samples]) ]
+    if tile_size is None:
+        entries += [ (273, 4, offsets), (278, 4, [height]), (279, 4, sizes) ]
+    else:
+        entries += [ (322, 4, [tile_size]), (323, 4, [tile_size]), (324, 4, offsets), (325, 4, sizes) ]
+    ifd_offset = 8 + len(pixels)
+    extra_offset = ifd_offset + 2 + 12*len(entries) + 4
+    directory, extra = b'', b''
+    for tag, type_, values in entries:
+        fmt = 'H' if type_ == 3 else 'I'
+        packed = struct.pack(f'<{len(values)}{fmt}', *values)
+        if len(packed) <= 4:
+            directory += struct.pack('<HHI', tag, type_, len(values)) + packed.ljust(4, b'\0')
+        else:
+            directory += struct.pack('<HHII', tag, type_, len(values), extra_offset + len(extra))
+            extra += packed
+    with open(filename, 'wb') as f:
+        f.write(b'II*\0' + struct.pack('<I', ifd_offset) + pixels)
+        f.write(struct.pack('<H', len(entries)) + directory + b'\0'*4 + extra)
+
+
+@pytest.fixture
+def write_tiff():
+    return tiff_file
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+cv2 = pytest.importorskip('cv2')
+from qimview.image_readers.image_reader import ImageReader
+from qimview.image_readers.image_probe import probe_jpeg, probe_png, probe_tiff
+
+width, height = 300, 200
+
+
+def noise(channels, dtype=np.uint8):
+    rng = np.random.default_rng(0)
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    return rng.integers(0, np.iinfo(dtype).max, size=shape, dtype=dtype)
+
+
+def write_image(tmp_path, name, data, params=()):
+    filename = str(tmp_path / name)
+    assert cv2.imwrite(filename, data, list(params))
+    return filename
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    """ Image reader failing on any decode """
+    reader = ImageReader()
+    def read(*args, **kwargs):
+        raise AssertionError("image decoded")
+    monkeypatch.setattr(reader, 'read', read)
+    return reader
+
+
+@pytest.mark.parametrize('name, data, params, channels, precision', [
+    ('color.jpg',       noise(3), (), 3, 8),
+    ('gray.jpg',        noise(1), (), 1, 8),
+    ('progressive.jpg', noise(3), (cv2.IMWRITE_JPEG_PROGRESSIVE, 1), 3, 8),
+    ('color.png',       noise(3), (), 3, 8),
+    ('gray.png',        noise(1), (), 1, 8),
+    ('alpha.png',       noise(4), (), 4, 8),
+    ('color16.png',     noise(3, np.uint16), (), 3, 16),
+    ('gray16.png',      noise(1, np.uint16), (), 1, 16),
+])
+def test_jpeg_png_headers(tmp_path, reader, name, data, params, channels, precision):
+    filename = write_image(tmp_path, name, data, params)
+    info = reader.probe(filename)
+    assert (info.width, info.height, info.channels, info.precision) == (width, height, channels, precision)
+    assert info.decoded_size == width*height*3
+
+
+@pytest.mark.parametrize('tile_size', [None, 64])
+@pytest.mark.parametrize('channels', [1, 3])
+def test_tiff_header(tmp_path, reader, write_tiff, channels, tile_size):
+    filename = str(tmp_path / 'image.tif')
+    write_tiff(filename, noise(channels), tile_size=tile_size)
+    info = reader.probe(filename)
+    assert (info.width, info.height, info.channels, info.precision) == (width, height, channels, 8)
+
+
+@pytest.mark.parametrize('name, probe', [('image.jpg', probe_jpeg), ('image.png', probe_png)])
+def test_only_the_header_is_needed(tmp_path, name, probe):
+    filename = write_image(tmp_path, name, noise(3))
+    with open(filename, 'rb') as f:
+        header = f.read(1024)
+    info = probe(filename, header)
+    assert (info.width, info.height, info.channels, info.precision) == (width, height, 3, 8)
+    # not an image of this format
+    assert probe(filename, b'\0'*1024) is None
+
+
+def test_tiff_directory_at_the_end(tmp_path, write_tiff):
+    # the directory follows the pixels and is read at its offset
+    filename = str(tmp_path / 'image.tif')
+    write_tiff(filename, noise(3))
+    info = probe_tiff(filename, None)
+    assert (info.width, info.height, info.channels, info.precision) == (width, height, 3, 8)
+    assert probe_tiff(filename, b'\0'*1024) is None
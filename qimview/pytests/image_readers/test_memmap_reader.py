@@ -0,0 +1,70 @@
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.viewer_image import ImageFormat
+from qimview.image_readers.memmap_reader import (parse_pnm_header, read_pnm, read_npy, read_raw_dump,
+                                                 probe_memmap, sidecar_filename)
+
+
+def write_raw_dump(filename, data, **geometry):
+    data.tofile(filename)
+    with open(sidecar_filename(filename), 'w') as f:
+        json.dump(geometry, f)
+
+
+def test_parse_pnm_header(tmp_path):
+    filename = str(tmp_path / 'image.pgm')
+    pixels = (np.arange(12).reshape(3, 4)*300).astype('>u2')
+    with open(filename, 'wb') as f:
+        f.write(b'P5\n# comment\n4 3\n4095\n' + pixels.tobytes())
+    magic, width, height, maxval, offset = parse_pnm_header(filename)
+    assert (magic, width, height, maxval) == (b'P5', 4, 3, 4095)
+    image = read_pnm(filename, None)
+    assert image.precision == 12 and image.data.dtype == np.uint16
+    assert np.array_equal(image.data, pixels)
+    info = probe_memmap(filename, None)
+    assert (info.width, info.height, info.channels, info.precision) == (4, 3, 1, 12)
+
+
+def test_not_a_pnm(tmp_path):
+    filename = str(tmp_path / 'image.pgm')
+    with open(filename, 'wb') as f:
+        f.write(b'P2\n4 3\n255\n')
+    assert parse_pnm_header(filename) is None
+
+
+def test_npy_reduced_read_size(tmp_path):
+    filename = str(tmp_path / 'image.npy')
+    data = np.arange(64*48*3, dtype=np.uint8).reshape(48, 64, 3)
+    np.save(filename, data)
+    image = read_npy(filename, None, read_size='1/4')
+    assert isinstance(image.data, np.memmap)
+    assert image.downscale == 4 and image.channels == ImageFormat.CH_RGB
+    assert np.array_equal(image.data, data[::4, ::4])
+
+
+def test_raw_dump_sidecar(tmp_path):
+    filename = str(tmp_path / 'image.raw')
+    data = np.arange(6*8, dtype='<u2').reshape(6, 8)
+    write_raw_dump(filename, data, width=8, height=6, dtype='<u2', precision=10)
+    image = read_raw_dump(filename, None)
+    assert image.precision == 10 and image.channels == ImageFormat.CH_Y
+    assert np.array_equal(image.data, data)
+    info = probe_memmap(filename, None)
+    assert (info.width, info.height, info.precision, info.decoded_size) == (8, 6, 10, 6*8*2)
+
+
+def test_raw_dump_bayer_offset(tmp_path):
+    filename = str(tmp_path / 'image.raw')
+    data = np.arange(4*6, dtype='>u2').reshape(4, 6)
+    with open(filename, 'wb') as f:
+        f.write(b'\0'*16 + data.tobytes())
+    with open(sidecar_filename(filename), 'w') as f:
+        json.dump({ 'width': 6, 'height': 4, 'dtype': '>u2', 'offset': 16, 'bayer': 'grbg' }, f)
+    image = read_raw_dump(filename, None)
+    assert image.channels == ImageFormat.CH_GRBG and image.data.shape == (2, 3, 4)
+    # channels in the order of the Bayer phases (0,0) (0,1) (1,0) (1,1)
+    assert np.array_equal(image.data[:, :, 1], data[0::2, 1::2])
+    assert np.array_equal(image.data[:, :, 2], data[1::2, 0::2])
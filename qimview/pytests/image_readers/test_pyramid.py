@@ -0,0 +1,107 @@
+import os
+import time
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.qt_imports import QtCore
+from qimview.utils.viewer_image import ImageFormat
+from qimview.image_readers.pyramid import PyramidImage, build_pyramid, read_pyramid, pyramid_levels
+from qimview.image_readers import gb_image_reader
+from qimview.cache import tilecache
+from qimview.cache.filecache import FileCache
+from qimview.cache.imagecache import ImageCache
+from qimview.cache.cache_config import CacheConfig
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, size=(300, 500, 3), dtype=np.uint8)
+    filename = str(tmp_path / 'image.png')
+    cv2.imwrite(filename, data)
+    return filename, data
+
+
+def test_pyramid_levels():
+    levels = pyramid_levels(500, 300, 128)
+    assert [ (l['width'], l['height']) for l in levels ] == [ (500, 300), (250, 150), (125, 75) ]
+    assert (levels[0]['tiles_x'], levels[0]['tiles_y']) == (4, 3)
+
+
+def test_round_trip(image_file, tmp_path):
+    filename, bgr = image_file
+    output = str(tmp_path / 'image.qpyr')
+    progress = []
+    assert build_pyramid(filename, output, tile_size=128, progress_callback=progress.append)
+    assert progress[-1] == 100 and not os.path.exists(output + '.tmp')
+    pyramid = PyramidImage(output)
+    assert (pyramid.width, pyramid.height, pyramid.nb_channels) == (500, 300, 3)
+    assert pyramid.channels in (ImageFormat.CH_RGB, ImageFormat.CH_BGR) and pyramid.precision == 8
+    # the pyramid keeps the channel order of the reader
+    expected = bgr if pyramid.channels == ImageFormat.CH_BGR else bgr[:, :, ::-1]
+    assert np.array_equal(pyramid.read_level_region(0, 0, 0, 500, 300), expected)
+    assert np.array_equal(pyramid.read_level_region(0, 100, 130, 260, 290), expected[130:290, 100:260])
+    level1 = cv2.resize(expected, (250, 150), interpolation=cv2.INTER_AREA)
+    assert np.array_equal(pyramid.read_level_region(1, 0, 0, 250, 150), level1)
+    # region displayed in a 125x75 widget, read from the coarsest level
+    data, downscale = pyramid.read_region(0, 0, 500, 300, 125, 75, use_RGB=False)
+    assert downscale == 4 and data.shape == (75, 125, 3)
+    image = read_pyramid(output, None)
+    assert image.pyramid is not None and image.downscale == 1 and image.data.shape == (300, 500, 3)
+
+
+def test_built_by_bands_of_tiles(tmp_path, write_tiff, monkeypatch):
+    filename = str(tmp_path / 'image.tif')
+    rng = np.random.default_rng(1)
+    data = rng.integers(0, 256, size=(300, 500, 3), dtype=np.uint8)
+    write_tiff(filename, data, tile_size=64)
+    assert gb_image_reader.supports_roi(filename) and not gb_image_reader.roi_reads_whole_file(filename)
+    file_cache = FileCache()
+    monkeypatch.setattr(gb_image_reader, 'file_cache', file_cache)
+    regions = []
+    read_roi = gb_image_reader.read_roi
+    monkeypatch.setattr(gb_image_reader, 'read_roi', lambda *args, **kwargs: regions.append(args[1]) or
+                        read_roi(*args, **kwargs))
+    output = str(tmp_path / 'image.qpyr')
+    assert build_pyramid(filename, output, tile_size=128)
+    # one read per band of tiles, without the file cache
+    assert regions == [ (0, 0, 500, 128), (0, 128, 500, 128), (0, 256, 500, 44) ]
+    assert file_cache.load_count == 0
+    pyramid = PyramidImage(output)
+    assert pyramid.channels == ImageFormat.CH_RGB
+    assert np.array_equal(pyramid.read_level_region(0, 0, 0, 500, 300), data)
+    assert np.array_equal(pyramid.read_level_region(1, 0, 0, 250, 150),
+                          cv2.resize(data, (250, 150), interpolation=cv2.INTER_AREA))
+
+
+def test_placeholder_while_building(image_file):
+    filename = image_file[0]
+    # decoding a PNG at a reduced size decodes the full image
+    assert not gb_image_reader.reads_reduced_sizes(filename)
+    assert gb_image_reader.reads_reduced_sizes('image.jpg')
+    image = ImageCache.placeholder_image(filename, max_size=128)
+    assert image.downscale == 4 and image.data.shape == (75, 125, 3)
+
+
+def test_not_a_pyramid(image_file):
+    with pytest.raises(ValueError):
+        PyramidImage(image_file[0])
+
+
+def test_built_in_background(image_file, tmp_path, monkeypatch):
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    monkeypatch.setattr(CacheConfig, 'pyramid_min_size', 0.1)
+    monkeypatch.setattr(CacheConfig, 'pyramid_tile_size', 128)
+    monkeypatch.setattr(CacheConfig, 'pyramid_dir', str(tmp_path / 'pyramids'))
+    filename = image_file[0]
+    finished = []
+    assert tilecache.get_pyramid(filename, lambda: finished.append(True)) is None
+    start = time.perf_counter()
+    while not finished and time.perf_counter()-start < 10:
+        app.processEvents()
+        time.sleep(0.01)
+    assert finished == [True] and not tilecache.is_building_pyramid(filename)
+    output = tilecache.get_pyramid(filename)
+    assert output is not None and PyramidImage(output).width == 500
@@ -0,0 +1,88 @@
+import os
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.utils.thread_pool import ThreadPool
+from qimview.image_readers.image_reader import ImageReader
+from qimview.image_readers.process_reader import ProcessReader, attach_shared, read_to_shared
+
+
+def read_gradient(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False):
+    """ Plugin of a module that the worker processes can import: the file contains the image width """
+    with open(image_filename, 'rb') as f:
+        width = int(f.read())
+    data = np.tile(np.arange(width, dtype=np.uint16), (3, 1))
+    return ViewerImage(data, precision=12, downscale=1, channels=ImageFormat.CH_Y)
+
+
+def slow_read(image_filename, image_buffer, read_size='full', use_RGB=True, verbose=False):
+    time.sleep(0.3)
+    return read_gradient(image_filename, image_buffer, read_size, use_RGB, verbose)
+
+
+@pytest.fixture
+def files(tmp_path):
+    res = []
+    for width in [4, 5, 6]:
+        res.append(str(tmp_path / f'image{width}.grad'))
+        with open(res[-1], 'w') as f:
+            f.write(str(width))
+    return res
+
+
+def test_read_many_threads(files):
+    reader = ImageReader()
+    reader.set_plugin(['.grad'], read_gradient)
+    images = reader.read_many(files + [files[0]])
+    assert list(images) == files
+    assert [ images[f].data.shape for f in files ] == [ (3, 4), (3, 5), (3, 6) ]
+    assert images[files[1]].filename == files[1]
+    with pytest.raises(ValueError):
+        reader.read_many(files, backend='gpu')
+
+
+def test_read_many_timeout_cancels(files, monkeypatch):
+    reader = ImageReader()
+    reader.set_plugin(['.grad'], slow_read)
+    reader._read_pool = ThreadPool()
+    reader._read_pool.setMaxThreadCount(1)
+    calls = []
+    read = reader.read
+    monkeypatch.setattr(reader, 'read', lambda *args, **kwargs: calls.append(args[0]) or read(*args, **kwargs))
+    images = reader.read_many(files, timeout=0.1)
+    assert all(image is None for image in images.values())
+    reader._read_pool.waitForDone()
+    # only the decode started before the timeout ran
+    assert calls == files[:1]
+
+
+def test_shared_image_round_trip(files):
+    shared = read_to_shared(read_gradient, files[0], 'full', True, False)
+    assert os.path.isfile(shared[0])
+    image = attach_shared(shared)
+    assert not os.path.exists(shared[0])
+    assert image.precision == 12 and image.channels == ImageFormat.CH_Y
+    assert np.array_equal(image.data[1], np.arange(4))
+
+
+def test_process_round_trip(files):
+    process_reader = ProcessReader(max_workers=1)
+    try:
+        shared = process_reader.submit(read_gradient, files[2]).result(timeout=60)
+    finally:
+        process_reader.shutdown()
+    path = shared[0]
+    image = attach_shared(shared)
+    assert not os.path.exists(path)
+    assert np.array_equal(image.data, np.tile(np.arange(6, dtype=np.uint16), (3, 1)))
+
+    reader = ImageReader()
+    reader.set_plugin(['.grad'], read_gradient)
+    try:
+        images = reader.read_many(files, backend='process', timeout=60)
+    finally:
+        reader._process_reader.shutdown()
+    assert [ images[f].data.shape[1] for f in files ] == [4, 5, 6]
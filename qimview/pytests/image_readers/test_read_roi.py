@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.utils.viewer_image import ViewerImage, ImageFormat
+from qimview.cache.filecache import FileCache
+from qimview.image_readers.image_reader import ImageReader
+from qimview.image_readers.tiff_reader import is_tiled_tiff
+
+
+def test_regions_share_the_file_read(tmp_path):
+    filename = str(tmp_path / 'image.roi')
+    with open(filename, 'wb') as f:
+        f.write(bytes(range(256))*4)
+    buffers = []
+
+    def read_roi(image_filename, image_buffer, roi, use_RGB=True):
+        buffers.append(image_buffer)
+        x, y, w, h = roi
+        data = np.frombuffer(image_buffer, dtype=np.uint8).reshape(32, 32)[y:y+h, x:x+w]
+        return ViewerImage(data.copy(), precision=8, downscale=1, channels=ImageFormat.CH_Y), roi
+
+    reader = ImageReader()
+    reader.set_roi_plugin(['.roi'], read_roi, whole_file=True)
+    reader.set_file_cache(FileCache())
+    image, rect = reader.read_roi(filename, (0, 0, 8, 8))
+    assert rect == (0, 0, 8, 8) and image.data[0, 1] == 1
+    assert reader.file_cache.load_count == 1
+    reader.read_roi(filename, (8, 8, 8, 8))
+    # the second region is decoded from the cached buffer
+    assert reader.file_cache.load_count == 1 and reader.file_cache.hit_count == 1
+    assert all(b is not None for b in buffers)
+
+
+def test_tiled_tiff_regions_read_from_disk(tmp_path, write_tiff):
+    filename = str(tmp_path / 'image.tif')
+    data = np.arange(100*70, dtype=np.uint32).reshape(70, 100).astype(np.uint8)
+    write_tiff(filename, data, tile_size=32)
+    assert is_tiled_tiff(filename)
+    reader = ImageReader()
+    reader.set_file_cache(FileCache())
+    image, rect = reader.read_roi(filename, (40, 10, 30, 30))
+    assert rect == (32, 0, 64, 64)
+    assert np.array_equal(image.data[:, :, 0], data[0:64, 32:96])
+    # only the intersecting tiles are read, the file is not loaded in the file cache
+    assert reader.file_cache.load_count == 0 and reader.file_cache.cache_size == 0
@@ -0,0 +1,57 @@
+import time
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.image_readers import reader_calibration
+from qimview.image_readers.reader_calibration import calibrate, BackendRanking
+
+
+def reader(delay, fails=()):
+    def read(filename, buffer, read_size, use_RGB, verbose):
+        if buffer in fails: return None
+        time.sleep(delay)
+        return object()
+    return read
+
+
+@pytest.fixture
+def samples(tmp_path):
+    files = []
+    for name in ['a', 'b', 'broken']:
+        files.append(str(tmp_path / f'{name}.jpg'))
+        with open(files[-1], 'wb') as f:
+            f.write(name.encode())
+    return files
+
+
+def test_failing_backend_not_ranked(samples, monkeypatch):
+    monkeypatch.setattr(reader_calibration, 'format_backends', { 'jpeg': {
+        # fastest, but fails on a sample that the others decode
+        'partial' : (reader(0, fails=(b'b',)), True, ['full']),
+        'slow'    : (reader(0.01), True, ['full']),
+        'fast'    : (reader(0.002), True, ['full']),
+        'unavailable' : (reader(0), False, ['full']),
+    }})
+    ranking = calibrate(samples, repeat=1, verbose=False)
+    assert ranking == { 'jpeg': { 'full': ['fast', 'slow'] } }
+
+
+def test_broken_samples_ignored(samples, monkeypatch):
+    # no backend decodes the broken sample, it is not used for the ranking
+    monkeypatch.setattr(reader_calibration, 'format_backends', { 'jpeg': {
+        'slow' : (reader(0.01, fails=(b'broken',)), True, ['full']),
+        'fast' : (reader(0.002, fails=(b'broken',)), True, ['full']),
+    }})
+    assert calibrate(samples, repeat=1, verbose=False) == { 'jpeg': { 'full': ['fast', 'slow'] } }
+
+
+def test_unranked_backends_last(tmp_path, monkeypatch):
+    monkeypatch.setattr(reader_calibration, 'format_backends', { 'jpeg': {
+        'a' : (reader(0), True, ['full']),
+        'b' : (reader(0), True, ['full', '1/2']),
+        'c' : (reader(0), True, ['full', '1/2']),
+    }})
+    ranking = BackendRanking(str(tmp_path / 'ranking.json'))
+    ranking.ranking = { 'jpeg': { 'full': ['c', 'a'] } }
+    assert [ name for name, _ in ranking.backends('jpeg', 'full') ] == ['c', 'a', 'b']
+    assert [ name for name, _ in ranking.backends('jpeg', '1/2') ] == ['b', 'c']
@@ -0,0 +1,45 @@
+import os
+import pytest
+
+pytest.importorskip('qimview.utils.qt_imports', exc_type=ImportError)
+from qimview.video_player.image_sequence import natural_key, is_image_sequence, sequence_filenames
+
+
+@pytest.fixture
+def sequence_dir(tmp_path):
+    for name in ['frame_2.png', 'frame_10.png', 'frame_1.png', 'frame_0100.png', 'other_3.png', 'frame_5.txt']:
+        (tmp_path / name).write_bytes(b'')
+    return tmp_path
+
+
+def basenames(filenames):
+    return [ os.path.basename(f) for f in filenames ]
+
+
+def test_natural_key():
+    names = ['frame_10.png', 'frame_2.png', 'frame_1.png', 'a_2_b_10', 'a_2_b_9']
+    assert sorted(names, key=natural_key) == ['a_2_b_9', 'a_2_b_10', 'frame_1.png', 'frame_2.png', 'frame_10.png']
+
+
+def test_is_image_sequence(sequence_dir):
+    assert is_image_sequence(str(sequence_dir))
+    assert is_image_sequence(str(sequence_dir / 'frame_%04d.png'))
+    assert is_image_sequence(str(sequence_dir / 'frame_%d.png'))
+    assert is_image_sequence(str(sequence_dir / 'frame_*.png'))
+    assert not is_image_sequence(str(sequence_dir / 'frame_1.png'))
+
+
+def test_folder(sequence_dir):
+    assert basenames(sequence_filenames(str(sequence_dir))) == \
+        ['frame_1.png', 'frame_2.png', 'frame_10.png', 'frame_0100.png', 'other_3.png']
+
+
+def test_printf_pattern(sequence_dir):
+    assert basenames(sequence_filenames(str(sequence_dir / 'frame_%d.png'))) == \
+        ['frame_1.png', 'frame_2.png', 'frame_10.png', 'frame_0100.png']
+    # at least 3 digits
+    assert basenames(sequence_filenames(str(sequence_dir / 'frame_%03d.png'))) == ['frame_0100.png']
+
+
+def test_glob_pattern(sequence_dir):
+    assert basenames(sequence_filenames(str(sequence_dir / 'frame_?.*'))) == ['frame_1.png', 'frame_2.png']
@@ -1,8 +1,19 @@
 # example from https://www.learnpyqt.com/tutorials/multithreading-pyqt-applications-qthreadpool/
 
+import threading
+from concurrent.futures import Future, wait
+from enum import IntEnum
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set
 from .qt_imports import *
 
 
+class TaskPriority(IntEnum):
+    """ Priority classes of the tasks submitted to a ThreadPool, tasks with higher priority are started first """
+    BACKGROUND = 0  # statistics, read-ahead of files
+    PREFETCH   = 1  # images that may be displayed next
+    DISPLAY    = 2  # images to display now, video decoding
+
+
 class WorkerSignals(QtCore.QObject):
     '''
     Defines the signals available from a running worker thread.
@@ -84,12 +95,139 @@ class Worker(QtCore.QRunnable):
             self.signals.finished.emit()  # Done
 
 
+class Task(QtCore.QRunnable):
+    '''
+    Task submitted by ThreadPool.submit(), its result is set to a Future
+    '''
+    def __init__(self, future : Future, fn, *args, **kwargs):
+        super().__init__()
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        # A cancelled task is not processed
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            print(f"Exception catched while processing task: {e}")
+            import traceback
+            traceback.print_exc()
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class ProgressEmitter:
+    ''' progress_callback passed to the tasks, same interface as WorkerSignals.progress '''
+    def __init__(self, pool : 'ThreadPool', callback : Callable):
+        self._pool = pool
+        self._callback = callback
+
+    def emit(self, value : int):
+        self._pool._callback_requested.emit((self._callback, (value,)))
+
+
 class ThreadPool(QtCore.QThreadPool):
-    """ Can start several runnables in threads """
+    """ Can start several runnables in threads
+
+        submit() is the re-entrant interface: each call creates its own Worker and returns a Future,
+        tasks are started by priority, and the queued tasks of a given tag can be cancelled.
+        The callbacks given to submit() are sent through a signal of the pool, so they are called in the
+        thread owning the pool (the Qt thread) once its event loop processes them.
+        set_worker(), set_worker_callbacks() and start_worker() share a single worker and must be called
+        in sequence from one thread.
+    """
+    # Callback and its arguments, queued to the thread owning the pool
+    _callback_requested = Signal(object)
+
     def __init__(self):
         super().__init__()
         # print(f"Multithreading with maximum {self.maxThreadCount()} threads" )
         self._worker : Worker
+        self._callback_requested.connect(self._run_callback)
+        # Futures of the tasks not finished yet, by tag
+        self._tasks      : Dict[Hashable, Set[Future]] = {}
+        self._tasks_lock : threading.Lock              = threading.Lock()
+
+    def submit(self, fn : Callable, *args,
+               priority    : int = TaskPriority.DISPLAY,
+               tag         : Optional[Hashable] = None,
+               result_cb   : Optional[Callable] = None,
+               error_cb    : Optional[Callable] = None,
+               finished_cb : Optional[Callable] = None,
+               progress_cb : Optional[Callable] = None,
+               **kwargs) -> Future:
+        """ Run fn(*args, **kwargs) in a thread of the pool
+
+        Args:
+            fn (Callable): function to run, it receives the keyword argument progress_callback
+                only if progress_cb is set
+            priority (int, optional): TaskPriority of the task. Defaults to TaskPriority.DISPLAY.
+            tag (Hashable, optional): group of tasks that can be cancelled together. Defaults to None.
+            result_cb (Callable, optional): called with the result
+            error_cb (Callable, optional): called with the exception
+            finished_cb (Callable, optional): called without argument once the task is processed
+            progress_cb (Callable, optional): called with the progress values sent by fn
+            The callbacks are called in the thread of the pool (the Qt thread), they are not called
+            for cancelled tasks.
+
+        Returns:
+            Future: result of fn, cancelled if the task is cancelled before being started
+        """
+        if progress_cb is not None:
+            kwargs['progress_callback'] = ProgressEmitter(self, progress_cb)
+        future = Future()
+        with self._tasks_lock:
+            self._tasks.setdefault(tag, set()).add(future)
+        def done(f : Future) -> None:
+            self._task_done(tag, f)
+            if f.cancelled(): return
+            if f.exception() is None:
+                if result_cb is not None: self._callback_requested.emit((result_cb, (f.result(),)))
+            else:
+                if error_cb  is not None: self._callback_requested.emit((error_cb,  (f.exception(),)))
+            if finished_cb is not None:   self._callback_requested.emit((finished_cb, ()))
+        future.add_done_callback(done)
+        self.start(Task(future, fn, *args, **kwargs), int(priority))
+        return future
+
+    def _run_callback(self, callback_args) -> None:
+        callback, args = callback_args
+        callback(*args)
+
+    def _task_done(self, tag : Optional[Hashable], future : Future) -> None:
+        with self._tasks_lock:
+            tasks = self._tasks.get(tag)
+            if tasks is not None:
+                tasks.discard(future)
+                if len(tasks) == 0:
+                    del self._tasks[tag]
+
+    def cancel(self, tag : Optional[Hashable]) -> int:
+        """ Cancel the tasks of the given tag that are not started yet
+            returns: number of cancelled tasks
+        """
+        with self._tasks_lock:
+            futures = list(self._tasks.get(tag, []))
+        # cancelled workers return immediately when the pool starts them
+        return sum(1 for f in futures if f.cancel())
+
+    def pending(self, tag : Optional[Hashable]) -> int:
+        """ Number of unfinished tasks of the given tag """
+        with self._tasks_lock:
+            return len(self._tasks.get(tag, []))
+
+    @staticmethod
+    def wait(futures : Iterable[Future], timeout : Optional[float] = None) -> bool:
+        """ Wait for the futures to finish
+            returns: True if all of them are done
+        """
+        done, not_done = wait(list(futures), timeout=timeout)
+        return len(not_done) == 0
 
     def set_worker(self, work_function, *args, **kwargs):
         """ Define a new worker to process work_function and its arguments """
@@ -104,7 +242,7 @@ class ThreadPool(QtCore.QThreadPool):
         self._worker.set_finished_callback(finished_cb)
         self._worker.set_result_callback(result_cb)
 
-    def start_worker(self):
-        """ Starts the worker in a thread """
-        self.start(self._worker)
+    def start_worker(self, priority: int = 0):
+        """ Starts the worker in a thread, workers with higher priority are started first """
+        self.start(self._worker, priority)
 
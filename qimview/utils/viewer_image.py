@@ -76,6 +76,9 @@ class ViewerImage:
         # For YUV format, _uv contains interlaced UV data
         self._uv : Optional[np.ndarray]   = None
         self._crop : Optional[np.ndarray] = None
+        # Tiled multi-resolution source of images too large for memory (PyramidImage), data is then
+        # a reduced level of the pyramid
+        self.pyramid = None
 
 
     @property
@@ -165,5 +168,7 @@ class ViewerImage:
         size = self.data.nbytes
         for v in vars(self):
             # print(f" v {v} {self.__dict__[v].__sizeof__()}")
-            size += self.__dict__[v].__sizeof__()
+            # _data buffer is already counted by nbytes
+            if v != '_data':
+                size += self.__dict__[v].__sizeof__()
         return size
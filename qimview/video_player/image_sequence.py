@@ -0,0 +1,207 @@
+"""
+    Image sequences played as videos: rendered frames (frame_0001.png ... frame_5000.png, EXR, raw dumps)
+    are read by gb_image_reader and provided to VideoPlayerAV and VideoScheduler through the same
+    frame buffer and frame provider interfaces as video containers.
+    A sequence is given as a folder, a printf pattern (frame_%04d.png) or a glob pattern (frame_*.png),
+    it is played at VideoConfig.sequence_framerate.
+    Each frame is a key frame, so seeking is exact, and the frames following the current position are
+    decoded in parallel by a pool of VideoConfig.decoder_thread_count threads.
+"""
+
+import glob
+import os
+import re
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+from qimview.utils.viewer_image import ViewerImage
+from qimview.utils.thread_pool import ThreadPool, TaskPriority
+from qimview.image_readers import gb_image_reader
+from qimview.video_player.video_frame_buffer_base import VideoFrameBufferBase
+from qimview.video_player.video_frame_provider_base import VideoFrameProviderBase
+from qimview.video_player.video_exceptions import EndOfVideo
+from qimview.video_player.video_player_config import VideoConfig
+
+
+def natural_key(filename : str) -> list:
+    """ Sort key where the numbers are compared by value: frame_2 < frame_10 """
+    return [ int(t) if t.isdigit() else t for t in re.split(r'(\d+)', filename) ]
+
+
+def is_image_sequence(path : str) -> bool:
+    """ True for a folder, a printf pattern or a glob pattern """
+    if os.path.isdir(path): return True
+    name = os.path.basename(path)
+    return re.search(r'%0?\d*d', name) is not None or any(c in name for c in '*?[')
+
+
+def sequence_filenames(path : str) -> List[str]:
+    """ Image files of the sequence in frame order """
+    extensions = gb_image_reader.extensions()
+    if os.path.isdir(path):
+        filenames = [ os.path.join(path, f) for f in os.listdir(path) ]
+    else:
+        folder, name = os.path.split(path)
+        printf = re.search(r'%0?(\d*)d', name)
+        if printf is not None:
+            # frame number with at least the given number of digits
+            digits = int(printf.group(1)) if printf.group(1) else 1
+            pattern = re.compile(re.escape(name[:printf.start()]) + r'(\d{' + str(digits) + r',})' +
+                                 re.escape(name[printf.end():]) + '$')
+            filenames = [ os.path.join(folder, f) for f in os.listdir(folder or '.') if pattern.match(f) ]
+        else:
+            filenames = glob.glob(path)
+    filenames = [ f for f in filenames if os.path.isfile(f) and os.path.splitext(f)[1].upper() in extensions ]
+    return sorted(filenames, key=natural_key)
+
+
+class ImageSequence:
+    """ Container of an image sequence, it is also its single video stream """
+    def __init__(self, filenames : List[str], framerate : float = VideoConfig.sequence_framerate):
+        self.filenames : List[str] = filenames
+        self.framerate : float     = framerate
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def close(self) -> None:
+        """ Same interface as the video containers, the files are not kept open """
+        pass
+
+
+class ImageSequenceFrame:
+    """ Decoded frame of a sequence, with the attributes of the video frames used by the player """
+    def __init__(self, index : int, filename : str, image : Optional[ViewerImage]):
+        self.pts       : int                   = index  # time base is the frame duration
+        self.key_frame : bool                  = True
+        self.pict_type : str                   = 'I'
+        self.filename  : str                   = filename
+        self.image     : Optional[ViewerImage] = image
+
+
+class ImageSequenceFrameBuffer(VideoFrameBufferBase):
+    """ Queue of decoded frames filled by the decoding thread of VideoFrameBufferBase, each frame is
+        read ahead by a pool of threads so that the decoding scales with the number of cores
+    """
+    def __init__(self, sequence : ImageSequence, maxsize = VideoConfig.framebuffer_max_size,
+                 read_ahead : int = VideoConfig.sequence_read_ahead,
+                 nb_threads : int = VideoConfig.decoder_thread_count):
+        super().__protocol_init__(maxsize)
+        self._name       : str              = "ImageSequenceFrameBuffer"
+        self._sequence   : ImageSequence    = sequence
+        self._read_ahead : int              = max(1, read_ahead)
+        self._read_pool  : ThreadPool       = ThreadPool()
+        self._read_pool.setMaxThreadCount(max(1, nb_threads))
+        # index of the frame returned by the next call to decodeNextFrame()
+        self._next_index : int              = 0
+        self._reads      : Dict[int, Future] = {}
+        self._reads_lock : threading.Lock   = threading.Lock()
+
+    def _read_frame(self, index : int) -> ImageSequenceFrame:
+        filename = self._sequence.filenames[index]
+        # native channel order, as read by the image viewers
+        image = gb_image_reader.read(filename, use_RGB=False)
+        if image is None:
+            print(f"Failed to read frame {index} {filename}")
+        return ImageSequenceFrame(index, filename, image)
+
+    def _update_reads(self) -> None:
+        """ Cancel the reads outside of the read-ahead window and start the missing ones, in frame order """
+        end = min(len(self._sequence), self._next_index + self._read_ahead)
+        for index in [ i for i in self._reads if i < self._next_index or i >= end ]:
+            self._reads.pop(index).cancel()
+        for index in range(self._next_index, end):
+            if index not in self._reads:
+                self._reads[index] = self._read_pool.submit(self._read_frame, index,
+                                                            priority=TaskPriority.DISPLAY, tag='sequence')
+
+    def seek(self, index : int) -> None:
+        """ Next decoded frame will be the frame index, the frames already queued are saved """
+        self.reset()
+        with self._reads_lock:
+            self._next_index = max(0, min(index, len(self._sequence)))
+
+    def decodeNextFrame(self) -> Optional[ImageSequenceFrame]:
+        with self._reads_lock:
+            if self._next_index >= len(self._sequence):
+                return None
+            self._update_reads()
+            future = self._reads.pop(self._next_index)
+            self._next_index += 1
+            self._update_reads()
+        return future.result()
+
+    def resetDecoder(self) -> None:
+        with self._reads_lock:
+            self._next_index = 0
+
+    def decoderOk(self) -> bool:
+        return len(self._sequence) > 0
+
+
+class ImageSequenceFrameProvider(VideoFrameProviderBase[ImageSequenceFrame, ImageSequence]):
+    def __init__(self):
+        super().__protocol_init__()
+        self._name : str = 'ImageSequenceFrameProvider'
+
+    def get_video_streams(self):
+        return [self._container] if len(self._container) > 0 else []
+
+    def set_stream_threads(self, stream):
+        # the number of threads is set when creating the frame buffer
+        pass
+
+    def CreateFrameBuffer(self, video_stream_number: int):
+        assert self._container is not None
+        self._frame_buffer = ImageSequenceFrameBuffer(self._container,
+                                                      maxsize    = VideoConfig.framebuffer_max_size,
+                                                      read_ahead = VideoConfig.sequence_read_ahead,
+                                                      nb_threads = VideoConfig.decoder_thread_count)
+
+    def logStreamInfo(self):
+        st = self.stream
+        print(f"Image sequence of {len(st)} frames at {st.framerate} FPS")
+        if len(st) > 0:
+            print(f"  {st.filenames[0]} ... {st.filenames[-1]}")
+
+    def copyStreamInfo(self):
+        st = self.stream
+        self._framerate       = float(st.framerate)
+        self._frame_duration  = float(1/self._framerate)
+        self._time_base       = self._frame_duration
+        self._ticks_per_frame = 1
+        self._duration        = len(st)*self._frame_duration
+        self._end_time        = max(0, self._duration-self._frame_duration)
+
+    @property
+    def frame_duration(self) -> float:
+        return self._frame_duration
+
+    def seek_position(self, time_pos: float) -> bool:
+        assert self._frame_buffer is not None
+        self._frame_buffer.seek(int(time_pos*self._framerate+0.5))
+        return True
+
+    def set_time(self, time_pos : float, exact: bool =True):
+        """ set time position in seconds, the seek is always exact since each frame is a key frame,
+            the reading continues from the frame following the requested one
+        """
+        if self._frame_buffer is None or not self._frame_buffer.decoderOk():
+            print("Video not initialized")
+            return
+        frame_num = max(0, min(int(time_pos*self._framerate+0.5), len(self._container)-1))
+        if self._frame is not None and self._frame.pts == frame_num:
+            return
+        frame = next((f for f in self._frame_buffer._saved_frames if f.pts == frame_num), None)
+        if frame is not None:
+            self._frame_buffer.seek(frame_num+1)
+        else:
+            self._frame_buffer.seek(frame_num)
+            try:
+                frame = self._frame_buffer.get_frame(timeout=1)
+            except EndOfVideo:
+                print(f"set_time(): Reached end of image sequence")
+                self._frame_buffer.reset()
+                return
+        self._from_saved = False
+        self._frame = frame
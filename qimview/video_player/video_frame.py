@@ -1,5 +1,5 @@
 """
-    Class VideoFrame will deal with frames from either pyav or decode_lib (bound ffmpeg)
+    Class VideoFrame will deal with frames from either pyav, decode_lib (bound ffmpeg) or image sequences
     and convert the frames to ViewerImage data
 """
 
@@ -14,6 +14,7 @@ from cv2 import cvtColor, COLOR_YUV2RGB_I420 # type: ignore
 import av
 from av.video.frame import VideoFrame as AVVideoFrame
 from qimview.utils.viewer_image  import ViewerImage, ImageFormat
+from qimview.video_player.image_sequence import ImageSequenceFrame
 
 class VideoFrame:
 
@@ -86,8 +87,8 @@ class VideoFrame:
         else:
             return None
 
-    def __init__(self, frame:decode_lib.Frame | AVVideoFrame):
-        self._frame : decode_lib.Frame | AVVideoFrame = frame
+    def __init__(self, frame:decode_lib.Frame | AVVideoFrame | ImageSequenceFrame):
+        self._frame : decode_lib.Frame | AVVideoFrame | ImageSequenceFrame = frame
         # Pre-allocated array to avoid allocation for each new frame
         self._yuv_array : np.ndarray = np.empty((1), dtype=np.uint8)
 
@@ -179,4 +180,7 @@ class VideoFrame:
             return self._libFrameToViewer()
         if type(self._frame) is AVVideoFrame:
             return self._avFrameToViewer(rgb)
+        if type(self._frame) is ImageSequenceFrame:
+            # already decoded in the native channel order, supported by both viewers
+            return self._frame.image
 
@@ -32,6 +32,10 @@ print(f"{has_decode_video_py=}")
 from qimview.video_player.video_frame_provider_cpp import VideoFrameProviderCpp
 from qimview.video_player.video_frame_provider     import VideoFrameProvider
 from qimview.video_player.video_player_config      import VideoConfig
+from qimview.video_player.image_sequence           import (ImageSequence, ImageSequenceFrameProvider,
+                                                           is_image_sequence, sequence_filenames)
+
+FrameProvider = VideoFrameProvider | VideoFrameProviderCpp | ImageSequenceFrameProvider
 
 class AverageTime:
     def __init__(self):
@@ -67,17 +71,14 @@ class VideoPlayerAV(VideoPlayerBase):
         self.show()
         self._im = None
         self._button_play_pause.clicked.connect(self.play_pause)
-        self._container : container.InputContainer | None = None
+        self._container : container.InputContainer | ImageSequence | None = None
 
         self._scheduler : VideoScheduler = VideoScheduler()
         self._start_video_time : float = 0
         self.loop_start_time  : float = 0
         self.loop_end_time    : float = -1 # -1 means end of video
         self._skipped : int = 0
-        if use_decode_video_py:
-            self._frame_provider : VideoFrameProvider | VideoFrameProviderCpp = VideoFrameProviderCpp()
-        else:
-            self._frame_provider : VideoFrameProvider | VideoFrameProviderCpp = VideoFrameProvider()
+        self._frame_provider : FrameProvider = self._create_frame_provider(sequence=False)
         self._displayed_pts : int = -1
         self._name : str = "video player"
         self._t1 : AverageTime = AverageTime()
@@ -99,9 +100,16 @@ class VideoPlayerAV(VideoPlayerBase):
         return self._scheduler
 
     @property
-    def frame_provider(self) -> VideoFrameProvider | VideoFrameProviderCpp:
+    def frame_provider(self) -> FrameProvider:
         return self._frame_provider
 
+    def _create_frame_provider(self, sequence: bool) -> FrameProvider:
+        if sequence:
+            return ImageSequenceFrameProvider()
+        if self._use_decode_video_py:
+            return VideoFrameProviderCpp()
+        return VideoFrameProvider()
+
     @property
     def frame_duration(self) -> float:
         if self.frame_provider:
@@ -133,7 +141,8 @@ class VideoPlayerAV(VideoPlayerBase):
         """ Set input video filename and optionally stream number
 
         Args:
-            filename (string): filename or filename:stream_number
+            filename (string): filename or filename:stream_number,
+                or image sequence as a folder, a printf pattern or a glob pattern
         """
         # Pause video if running
         self.pause()
@@ -272,6 +281,8 @@ class VideoPlayerAV(VideoPlayerBase):
         video_frame = VideoFrame(frame)
         # print(f" --- set_image_YUV420 for {self._name} with pos {frame.pts}")
         self._im = video_frame.toViewerImage()
+        if self._im is None:
+            return
         self._im.filename = self._filename + frame_str
         use_crop = self._scheduler.is_running
         if len(self._compare_players)>0:
@@ -356,14 +367,20 @@ class VideoPlayerAV(VideoPlayerBase):
             self.scheduler.pause()
         print(f"filename = {self._filename}")
         if self._container is not None:
-            self._frame_provider.frame_buffer.reset()
+            if self._frame_provider.frame_buffer:
+                self._frame_provider.frame_buffer.reset()
             # del self._frame_provider.frame_buffer
             # del self._frame_provider._container
-            if not self._use_decode_video_py:
+            if not self._use_decode_video_py or isinstance(self._container, ImageSequence):
                 self._container.close()
             del self._container
             self._container = None
-        if self._use_decode_video_py:
+        is_sequence = is_image_sequence(self._filename)
+        if is_sequence != isinstance(self._frame_provider, ImageSequenceFrameProvider):
+            self._frame_provider = self._create_frame_provider(sequence=is_sequence)
+        if is_sequence:
+            self._container = ImageSequence(sequence_filenames(self._filename), VideoConfig.sequence_framerate)
+        elif self._use_decode_video_py:
             device_type = self._codec if self._codec != '' else None
             # Use framebuffer max size to set the number of allocated frames in C++ Decoder
             self._container = decode_lib.VideoDecoder(VideoConfig.framebuffer_max_size)
@@ -411,12 +428,17 @@ def main():
     # import pprint
     # import numpy for generating random data points
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('input_video', nargs='+', help='video[:stream_number]')
+    parser.add_argument('input_video', nargs='+',
+                        help='video[:stream_number], or image sequence as a folder, '
+                             'a printf pattern (frame_%%04d.png) or a glob pattern (frame_*.png)')
     parser.add_argument('--pyav', action='store_true', help='Use pyav instead of ffmpeg bound with pybind11')
     parser.add_argument('--codec', type=str, default='', help='Use codec (ex: cuda) hardware acceleration with ffmpeg bound library')
+    parser.add_argument('--fps', type=float, default=None, help='Frame rate of image sequences')
     args = parser.parse_args()
     # _params = vars(args)
     print(args)
+    if args.fps is not None:
+        VideoConfig.sequence_framerate = args.fps
 
     QtCore.QCoreApplication.setAttribute(QtCore.Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
     # These 3 lines solve a flickering issue by allowing immediate repaint
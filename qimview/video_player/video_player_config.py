@@ -21,6 +21,9 @@ class VideoConfig:
     decoder_thread_type  : str = "FRAME"
     decoder_thread_count : int = 4
     framebuffer_max_size : int = 10
+    # image sequences
+    sequence_framerate   : float = 25
+    sequence_read_ahead  : int = 8
 
 if res:
     VideoConfig.mipmap_max_level     = config.getint('VIDEOPLAYER', 'mipmap_max_level',
@@ -31,7 +34,13 @@ if res:
                                                    fallback=VideoConfig.decoder_thread_count)
     VideoConfig.framebuffer_max_size = config.getint('VIDEOPLAYER', 'framebuffer_max_size',
                                                    fallback=VideoConfig.framebuffer_max_size)
+    VideoConfig.sequence_framerate   = config.getfloat('VIDEOPLAYER', 'sequence_framerate',
+                                                   fallback=VideoConfig.sequence_framerate)
+    VideoConfig.sequence_read_ahead  = config.getint('VIDEOPLAYER', 'sequence_read_ahead',
+                                                   fallback=VideoConfig.sequence_read_ahead)
     print(f"{VideoConfig.mipmap_max_level=}")
     print(f"{VideoConfig.decoder_thread_type=}")
     print(f"{VideoConfig.decoder_thread_count=}")
     print(f"{VideoConfig.framebuffer_max_size=}")
+    print(f"{VideoConfig.sequence_framerate=}")
+    print(f"{VideoConfig.sequence_read_ahead=}")